@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# This code is distributed under the two-clause BSD license.
+# Copyright (c) 2012-2013 Raphaël Barrois
+
+"""Compare uncontended reads of ConfigFile, ThreadSafeConfigFile and a global mutex.
+
+Usage: python benchmarks/locking.py [--reads N] [--repeat N]
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import argparse
+import os
+import sys
+import threading
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from confutils import configfile
+
+
+def make_configfile(cls, keys=50):
+    cf = cls()
+    cf.parse(['[section]'] + ['key_%d: value_%d' % (i, i) for i in range(keys)])
+    return cf
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--reads', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    plain = make_configfile(configfile.ConfigFile)
+    safe = make_configfile(configfile.ThreadSafeConfigFile)
+    plain_view = plain.section_view('section')
+    safe_view = safe.section_view('section')
+    mutex = threading.Lock()
+
+    def mutex_get_one():
+        with mutex:
+            return plain.get_one('section', 'key_25')
+
+    def mutex_contains():
+        with mutex:
+            return 'key_25' in plain_view
+
+    benchmarks = [
+        ('get_one, ConfigFile', lambda: plain.get_one('section', 'key_25')),
+        ('get_one, global mutex', mutex_get_one),
+        ('get_one, ThreadSafe', lambda: safe.get_one('section', 'key_25')),
+        ('in view, ConfigFile', lambda: 'key_25' in plain_view),
+        ('in view, global mutex', mutex_contains),
+        ('in view, ThreadSafe', lambda: 'key_25' in safe_view),
+    ]
+
+    print("%d reads, best of %d runs" % (args.reads, args.repeat))
+    for name, fn in benchmarks:
+        best = min(timeit.repeat(fn, number=args.reads, repeat=args.repeat))
+        print("%-25s %8.3f us/read" % (name, best * 1e6 / args.reads))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
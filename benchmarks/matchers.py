@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# This code is distributed under the two-clause BSD license.
+# Copyright (c) 2012-2013 Raphaël Barrois
+
+"""Compare ConfigLine.match() to compiled matchers.
+
+Usage: python benchmarks/matchers.py [--lines N] [--repeat N]
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from confutils import configfile
+
+
+def make_lines(count):
+    parser = configfile.Parser()
+    texts = []
+    for i in range(count):
+        if i % 10 == 0:
+            texts.append('# comment %d' % i)
+        else:
+            texts.append('key_%d: value_%d' % (i % 100, i))
+    return list(parser.parse(texts))
+
+
+def make_configfile(lines):
+    cf = configfile.ConfigFile()
+    cf.enter_block('section')
+    for line in lines:
+        cf.insert_line(line)
+    return cf
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--lines', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args(argv)
+
+    lines = make_lines(args.lines)
+    data = configfile.ConfigLine(configfile.ConfigLine.KIND_DATA, key='key_42')
+    data_value = configfile.ConfigLine(configfile.ConfigLine.KIND_DATA, key='key_42', value='value_42')
+    blank = configfile.ConfigLine(configfile.ConfigLine.KIND_BLANK, text='# comment 420')
+
+    def scan_match(query):
+        return [line for line in lines if line.match(query)]
+
+    def scan(matcher):
+        return [line for line in lines if matcher(line)]
+
+    def scan_compiled(query):
+        return scan(query.matcher())
+
+    benchmarks = [
+        ('key, match()', lambda: scan_match(data)),
+        ('key, compiled', lambda: scan_compiled(data)),
+        ('key+value, match()', lambda: scan_match(data_value)),
+        ('key+value, compiled', lambda: scan_compiled(data_value)),
+        ('blank, match()', lambda: scan_match(blank)),
+        ('blank, compiled', lambda: scan_compiled(blank)),
+        ('key prefix, compiled', lambda: scan(configfile.match_key_prefix('key_4'))),
+        ('key regex, compiled', lambda: scan(configfile.match_key_regex(r'key_4\d$'))),
+    ]
+
+    cf = make_configfile(lines)
+    benchmarks.append(('ConfigFile.get_line', lambda: list(cf.get_line('section', data))))
+
+    print("%d lines, best of %d runs" % (args.lines, args.repeat))
+    for name, fn in benchmarks:
+        best = min(timeit.repeat(fn, number=1, repeat=args.repeat))
+        print("%-25s %8.3f ms" % (name, best * 1000))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
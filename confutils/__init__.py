@@ -7,7 +7,11 @@ from __future__ import unicode_literals
 __author__ = "Raphaël Barrois <raphael.barrois+confutils@polytechnique.org>"
 __version__ = '0.3.7'
 
-from .configfile import ConfigFile, ConfigLine, Parser
+from .configfile import ConfigFile, ConfigLine, FrozenConfigFile, Parser
+from .configfile import OverlayConfigFile, ThreadSafeConfigFile
 from .configfile import ConfigError, ConfigReadingError, ConfigWritingError
+from .configfile import PatchConflict
+from .configdiff import diff
 from .merged_config import Default, NoDefault
 from .merged_config import NormalizedDict, DictNamespace, MergedConfig
+from .schema import Option, Schema
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+# This code is distributed under the two-clause BSD license.
+# Copyright (c) 2012-2013 Raphaël Barrois
+
+from __future__ import absolute_import, unicode_literals
+
+
+"""Columnar export of many config files, for analysis across a fleet.
+
+:class:`ColumnarConfigs` holds one row per data line of a set of config
+files, as parallel integer arrays; strings are dictionary-encoded::
+
+    columns = ColumnarConfigs.from_configfiles(configs, names=hostnames)
+    columns.value_counts('server', 'port')  # => {'80': 3512, '8080': 12}
+    arrays = columns.to_numpy()             # Requires NumPy
+
+Filters compare integer codes: a string is looked up once in the
+dictionary, and never compared row by row.
+"""
+
+
+import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from .compact import ARRAY_TYPECODE
+from .configfile import ConfigError, ConfigLine
+
+
+class StringColumn(object):
+    """A dictionary-encoded column of strings.
+
+    Attributes:
+        codes (int array): the code of each row
+        dictionary (str list): the string for each code, by first appearance
+    """
+
+    def __init__(self):
+        self.codes = array.array(ARRAY_TYPECODE)
+        self.dictionary = []
+        self._codes_by_string = {}
+
+    def append(self, text):
+        try:
+            code = self._codes_by_string[text]
+        except KeyError:
+            code = self._codes_by_string[text] = len(self.dictionary)
+            self.dictionary.append(text)
+        self.codes.append(code)
+
+    def code(self, text):
+        """Return the code of a string, or None if it never appears."""
+        return self._codes_by_string.get(text)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, row):
+        return self.dictionary[self.codes[row]]
+
+    def __repr__(self):
+        return '<StringColumn: %d rows, %d strings>' % (len(self.codes), len(self.dictionary))
+
+
+def iter_entries(configfile):
+    """Iterate over the (line number, section, key, value) of a file's data lines.
+
+    Line numbers start at 1 and match the output of ConfigFile.write().
+    """
+    section = None
+    for lineno, line in enumerate(configfile, 1):
+        if line.kind == ConfigLine.KIND_HEADER:
+            section = line.header
+        elif line.kind == ConfigLine.KIND_DATA and section is not None:
+            yield lineno, section, line.key, line.value
+
+
+class ColumnarConfigs(object):
+    """The data lines of many config files, stored by column.
+
+    Attributes:
+        names (str list): the name of each file, indexed by file id
+        file_ids (int array): the file of each row
+        sections, keys, values (StringColumn): the content of each row
+        linenos (int array): the line number of each row in its file
+    """
+
+    def __init__(self):
+        self.names = []
+        self.file_ids = array.array(ARRAY_TYPECODE)
+        self.sections = StringColumn()
+        self.keys = StringColumn()
+        self.values = StringColumn()
+        self.linenos = array.array(ARRAY_TYPECODE)
+
+    @classmethod
+    def from_configfiles(cls, configfiles, names=None):
+        """Build columns from ConfigFile (or FrozenConfigFile) objects.
+
+        Args:
+            configfiles (iterable): the files to export
+            names (iterable): the name of each file; defaults to its position
+        """
+        columns = cls()
+        names = iter(names) if names is not None else None
+        for configfile in configfiles:
+            name = next(names) if names is not None else str(len(columns.names))
+            columns.add(configfile, name)
+        return columns
+
+    def add(self, configfile, name):
+        """Append the rows of a file.
+
+        Returns:
+            int: the id of the file
+        """
+        file_id = len(self.names)
+        self.names.append(name)
+        for lineno, section, key, value in iter_entries(configfile):
+            self.file_ids.append(file_id)
+            self.sections.append(section)
+            self.keys.append(key)
+            self.values.append(value)
+            self.linenos.append(lineno)
+        return file_id
+
+    def __len__(self):
+        return len(self.file_ids)
+
+    def row(self, i):
+        """Retrieve a row, as a (file name, section, key, value, line number) tuple."""
+        return (self.names[self.file_ids[i]], self.sections[i], self.keys[i],
+            self.values[i], self.linenos[i])
+
+    def select(self, section=None, key=None, value=None):
+        """Find the rows matching the given section, key and value.
+
+        Returns:
+            int list: the matching row numbers
+        """
+        criteria = []
+        for column, text in ((self.sections, section), (self.keys, key), (self.values, value)):
+            if text is None:
+                continue
+            code = column.code(text)
+            if code is None:
+                return []
+            criteria.append((column.codes, code))
+
+        if not criteria:
+            return list(range(len(self)))
+
+        if numpy is not None:
+            mask = numpy.ones(len(self), dtype=bool)
+            for codes, code in criteria:
+                mask &= _as_numpy(codes) == code
+            return numpy.flatnonzero(mask).tolist()
+
+        (codes, code), others = criteria[0], criteria[1:]
+        rows = [i for i, c in enumerate(codes) if c == code]
+        for codes, code in others:
+            rows = [i for i in rows if codes[i] == code]
+        return rows
+
+    def value_counts(self, section, key):
+        """Count the files setting each value of a section/key.
+
+        Returns:
+            dict(value => int)
+        """
+        files_by_value = {}
+        for i in self.select(section=section, key=key):
+            files_by_value.setdefault(self.values.codes[i], set()).add(self.file_ids[i])
+        return dict(
+            (self.values.dictionary[code], len(file_ids))
+            for code, file_ids in files_by_value.items())
+
+    def to_numpy(self):
+        """Expose the columns as NumPy arrays, without copying them.
+
+        The integer arrays share their memory with the columns: no file may
+        be added while they are in use.
+
+        Returns:
+            dict: integer arrays 'file_id', 'section', 'key', 'value' and
+            'lineno', and object arrays 'names', 'section_dictionary',
+            'key_dictionary' and 'value_dictionary' to decode them.
+
+        Raises:
+            ConfigError: if NumPy isn't installed.
+        """
+        if numpy is None:
+            raise ConfigError("Exporting to NumPy requires the numpy package.")
+        return {
+            'file_id': _as_numpy(self.file_ids),
+            'section': _as_numpy(self.sections.codes),
+            'key': _as_numpy(self.keys.codes),
+            'value': _as_numpy(self.values.codes),
+            'lineno': _as_numpy(self.linenos),
+            'names': numpy.array(self.names, dtype=object),
+            'section_dictionary': numpy.array(self.sections.dictionary, dtype=object),
+            'key_dictionary': numpy.array(self.keys.dictionary, dtype=object),
+            'value_dictionary': numpy.array(self.values.dictionary, dtype=object),
+        }
+
+    def __repr__(self):
+        return '<ColumnarConfigs: %d files, %d rows>' % (len(self.names), len(self))
+
+
+def _as_numpy(values):
+    """View an array.array as a NumPy array."""
+    return numpy.frombuffer(values, dtype=values.typecode)
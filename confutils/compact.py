@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+# This code is distributed under the two-clause BSD license.
+# Copyright (c) 2012-2013 Raphaël Barrois
+
+from __future__ import absolute_import, unicode_literals
+
+
+"""A compact, read-only, representation of a ConfigFile.
+
+A :class:`CompactConfig` holds a handful of large objects: one string table
+and a few integer arrays. It is meant for pre-fork servers: once the
+configuration has been loaded in the master, reading it from the workers
+doesn't touch per-line objects, and thus doesn't dirty copy-on-write pages::
+
+    config = CompactConfig.from_configfile(load_config())
+    prepare_fork()
+    os.fork()
+"""
+
+
+import array
+import bisect
+import gc
+
+
+ARRAY_TYPECODE = str('L')
+
+
+class StringTable(object):
+    """A sorted table of strings, stored as a single UTF-8 blob.
+
+    String ``i`` is ``blob[offsets[i]:offsets[i + 1]]``; since strings are
+    sorted, they can be looked up through a binary search.
+    """
+
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    @classmethod
+    def from_strings(cls, strings):
+        """Build a table from a set of strings.
+
+        Returns:
+            (StringTable, dict(str => int)): the table, and the id of each string
+        """
+        encoded = sorted(set(s.encode('utf-8') for s in strings))
+        offsets = array.array(ARRAY_TYPECODE, [0])
+        for raw in encoded:
+            offsets.append(offsets[-1] + len(raw))
+        ids = dict((raw.decode('utf-8'), i) for i, raw in enumerate(encoded))
+        return cls(b''.join(encoded), offsets), ids
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        """Retrieve the raw (UTF-8) bytes of a string."""
+        return bytes(self.blob[self.offsets[i]:self.offsets[i + 1]])
+
+    def string(self, i):
+        return self[i].decode('utf-8')
+
+    def find(self, text):
+        """Return the id of a string, or None."""
+        raw = text.encode('utf-8')
+        i = bisect.bisect_left(self, raw)
+        if i < len(self) and self[i] == raw:
+            return i
+        return None
+
+
+class CompactConfig(object):
+    """Read-only config, stored as a string table and arrays of string ids.
+
+    Attributes:
+        strings (StringTable): all strings of the config
+        section_ids (int array): sorted ids of section names
+        entry_sections, entry_keys, entry_values (int arrays): data lines,
+            sorted by section, key then position in the section
+        item_order (int array): indexes of entries, sorted by section then
+            position in the section
+        text_ids (int array): the text of each line of the file, in order
+    """
+
+    def __init__(self, strings, section_ids, entry_sections, entry_keys,
+            entry_values, item_order, text_ids):
+        self.strings = strings
+        self.section_ids = section_ids
+        self.entry_sections = entry_sections
+        self.entry_keys = entry_keys
+        self.entry_values = entry_values
+        self.item_order = item_order
+        self.text_ids = text_ids
+
+    @classmethod
+    def from_configfile(cls, configfile):
+        lines = list(configfile)
+        sections = sorted(configfile.sections)
+        items = dict((name, list(configfile.items(name))) for name in sections)
+
+        strings = set(sections)
+        strings.update(line.text for line in lines)
+        for section_items in items.values():
+            for key, value in section_items:
+                strings.add(key)
+                strings.add(value)
+        table, ids = StringTable.from_strings(strings)
+
+        entries = []
+        for name in sections:
+            for position, (key, value) in enumerate(items[name]):
+                entries.append((ids[name], ids[key], position, ids[value]))
+        entries.sort()
+        item_order = sorted(range(len(entries)),
+            key=lambda i: (entries[i][0], entries[i][2]))
+
+        def make_array(values):
+            return array.array(ARRAY_TYPECODE, values)
+
+        return cls(
+            strings=table,
+            section_ids=make_array(sorted(ids[name] for name in sections)),
+            entry_sections=make_array(e[0] for e in entries),
+            entry_keys=make_array(e[1] for e in entries),
+            entry_values=make_array(e[3] for e in entries),
+            item_order=make_array(item_order),
+            text_ids=make_array(ids[line.text] for line in lines),
+        )
+
+    def _section_range(self, section):
+        """Find the range of entries for a section."""
+        section_id = self.strings.find(section)
+        if section_id is None:
+            return 0, 0
+        lo = bisect.bisect_left(self.entry_sections, section_id)
+        hi = bisect.bisect_right(self.entry_sections, section_id, lo)
+        return lo, hi
+
+    def _key_range(self, section, key):
+        lo, hi = self._section_range(section)
+        key_id = self.strings.find(key)
+        if lo == hi or key_id is None:
+            return 0, 0
+        key_lo = bisect.bisect_left(self.entry_keys, key_id, lo, hi)
+        key_hi = bisect.bisect_right(self.entry_keys, key_id, key_lo, hi)
+        return key_lo, key_hi
+
+    def __contains__(self, name):
+        """Check whether a given name is a known section."""
+        section_id = self.strings.find(name)
+        if section_id is None:
+            return False
+        i = bisect.bisect_left(self.section_ids, section_id)
+        return i < len(self.section_ids) and self.section_ids[i] == section_id
+
+    def sections(self):
+        """Iterate over section names, sorted."""
+        for section_id in self.section_ids:
+            yield self.strings.string(section_id)
+
+    def items(self, section):
+        """Retrieve all key/value pairs for a given section."""
+        lo, hi = self._section_range(section)
+        for i in range(lo, hi):
+            entry = self.item_order[i]
+            yield (self.strings.string(self.entry_keys[entry]),
+                self.strings.string(self.entry_values[entry]))
+
+    def get(self, section, key):
+        """Return the 'value' of all lines matching the section/key."""
+        lo, hi = self._key_range(section, key)
+        for i in range(lo, hi):
+            yield self.strings.string(self.entry_values[i])
+
+    def get_one(self, section, key):
+        """Retrieve the first value for a section/key.
+
+        Raises:
+            KeyError: If no line match the given section/key.
+        """
+        lo, hi = self._key_range(section, key)
+        if lo == hi:
+            raise KeyError("Key %s not found in %s" % (key, section))
+        return self.strings.string(self.entry_values[lo])
+
+    def __iter__(self):
+        """Iterate over the text of the lines of the file."""
+        for text_id in self.text_ids:
+            yield self.strings.string(text_id)
+
+    def write(self, fd):
+        """Write to an open file-like object."""
+        for text in self:
+            fd.write('%s\n' % text)
+
+    def __repr__(self):
+        return '<CompactConfig: %d strings, %d entries>' % (
+            len(self.strings), len(self.entry_keys))
+
+
+def prepare_fork():
+    """Prepare the current heap for sharing with forked children.
+
+    Runs a full collection, then moves all surviving objects to the
+    permanent generation (``gc.freeze()``, on Python 3.7+), so that garbage
+    collections in the children don't write to their pages.
+
+    Call this in the master, right before forking.
+    """
+    gc.collect()
+    if hasattr(gc, 'freeze'):
+        gc.freeze()
@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+# This code is distributed under the two-clause BSD license.
+# Copyright (c) 2012-2013 Raphaël Barrois
+
+from __future__ import absolute_import, unicode_literals
+
+
+"""Structural comparison of two ConfigFile objects.
+
+:func:`diff` reports added and removed sections, keys whose values changed,
+and data lines which moved within their section::
+
+    changes = diff(old, new)
+    for change in changes.changes:
+        print(change.section, change.key, change.old_values, change.new_values)
+
+Comments and blank lines are ignored. Sections with the same fingerprint
+are skipped without looking at their content; within other sections, blocks
+with the same digest are skipped, and only the lines of differing blocks are
+compared. Digests are cached, and shared with snapshots
+(:meth:`~configfile.ConfigFile.snapshot`).
+
+Key changes can be shipped as a :class:`Patch`, and replayed on other files
+with :meth:`~configfile.ConfigFile.apply_patch`::
+
+    text = make_patch(old, new).dumps()
+    host_config.apply_patch(Patch.loads(text))
+"""
+
+
+import collections
+import difflib
+import json
+
+from .configfile import ConfigLine
+
+
+KeyChange = collections.namedtuple('KeyChange',
+    ['section', 'key', 'old_values', 'new_values'])
+
+LineMove = collections.namedtuple('LineMove',
+    ['section', 'key', 'value', 'old_index', 'new_index'])
+
+
+class ConfigDiff(object):
+    """The differences between two config files.
+
+    Attributes:
+        added_sections (str list): sections only in the new file, sorted
+        removed_sections (str list): sections only in the old file, sorted
+        changes (KeyChange list): keys whose list of values changed, by
+            section then key order; values are [] for missing keys
+        moves (LineMove list): data lines found at another position among
+            the data lines of their section, with unchanged values
+    """
+
+    def __init__(self, added_sections=(), removed_sections=(), changes=(), moves=()):
+        self.added_sections = list(added_sections)
+        self.removed_sections = list(removed_sections)
+        self.changes = list(changes)
+        self.moves = list(moves)
+
+    def __bool__(self):
+        return bool(self.added_sections or self.removed_sections or self.changes or self.moves)
+
+    __nonzero__ = __bool__
+
+    def __repr__(self):
+        return '<ConfigDiff: +%d -%d sections, %d changed keys, %d moved lines>' % (
+            len(self.added_sections), len(self.removed_sections),
+            len(self.changes), len(self.moves))
+
+
+def _data_lines(blocks):
+    return [(line.key, line.value)
+        for block in blocks
+        for line in block.lines
+        if line.kind == ConfigLine.KIND_DATA]
+
+
+def _offsets(blocks):
+    """Position of the first data line of each block, among those of the section."""
+    offsets = [0]
+    for block in blocks:
+        offsets.append(offsets[-1] + block.data_line_count())
+    return offsets
+
+
+def _changed_runs(old_section, new_section):
+    """Pair the blocks of two versions of a section by digest.
+
+    Identical blocks are skipped without reading their lines.
+
+    Returns:
+        list: (old_lines, old_offset, new_lines, new_offset) for each run of
+            differing blocks; offsets are positions among the data lines of
+            the section
+    """
+    old_blocks = old_section.ordered_blocks()
+    new_blocks = new_section.ordered_blocks()
+    matcher = difflib.SequenceMatcher(None,
+        [block.digest() for block in old_blocks],
+        [block.digest() for block in new_blocks],
+        autojunk=False)
+    old_offsets = _offsets(old_blocks)
+    new_offsets = _offsets(new_blocks)
+
+    runs = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            continue
+        runs.append((
+            _data_lines(old_blocks[i1:i2]), old_offsets[i1],
+            _data_lines(new_blocks[j1:j2]), new_offsets[j1],
+        ))
+    return runs
+
+
+def _key_changes(name, old_index, new_index, keys=None):
+    """Compare the values of keys, restricted to ``keys`` if provided."""
+    candidates = [key for key in old_index.keys if keys is None or key in keys]
+    candidates.extend(key for key in new_index.keys
+        if key not in old_index.values and (keys is None or key in keys))
+    for key in candidates:
+        old_values = old_index.values.get(key, [])
+        new_values = new_index.values.get(key, [])
+        if old_values != new_values:
+            yield KeyChange(name, key, list(old_values), list(new_values))
+
+
+def _line_moves(name, runs, changed_keys):
+    """Find data lines removed from one position, and added at another.
+
+    Lines are only matched within the runs of differing blocks; a line may
+    move from one run to another.
+    """
+    removed = {}
+    added = {}
+    for old_lines, old_offset, new_lines, new_offset in runs:
+        matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag in ('delete', 'replace'):
+                for i in range(i1, i2):
+                    removed.setdefault(old_lines[i], []).append(old_offset + i)
+            if tag in ('insert', 'replace'):
+                for j in range(j1, j2):
+                    added.setdefault(new_lines[j], []).append(new_offset + j)
+
+    moves = []
+    for line, old_positions in removed.items():
+        if line[0] in changed_keys:
+            continue
+        for old_index, new_index in zip(old_positions, added.get(line, ())):
+            moves.append(LineMove(name, line[0], line[1], old_index, new_index))
+    moves.sort(key=lambda move: move.old_index)
+    return moves
+
+
+def diff(old, new):
+    """Compare two ConfigFile objects.
+
+    Either may also be an :class:`~configfile.OverlayConfigFile`; sections
+    it didn't modify are shared with its base, and skipped.
+
+    Returns:
+        ConfigDiff: the changes turning ``old`` into ``new``
+    """
+    old_names = set(old.sections)
+    new_names = set(new.sections)
+    result = ConfigDiff(
+        added_sections=sorted(new_names - old_names),
+        removed_sections=sorted(old_names - new_names),
+    )
+
+    for name in sorted(old_names | new_names):
+        old_section = old.sections.get(name)
+        new_section = new.sections.get(name)
+        if old_section is None:
+            result.changes.extend(_key_changes(name, old.section_index(name), new_section.index()))
+            continue
+        elif new_section is None:
+            result.changes.extend(_key_changes(name, old_section.index(), new.section_index(name)))
+            continue
+
+        if old_section is new_section or old_section.fingerprint() == new_section.fingerprint():
+            continue
+
+        runs = _changed_runs(old_section, new_section)
+        keys = set(line[0]
+            for old_lines, _old_offset, new_lines, _new_offset in runs
+            for line in old_lines + new_lines)
+        changes = list(_key_changes(name, old_section.index(), new_section.index(), keys))
+        result.changes.extend(changes)
+        changed_keys = set(change.key for change in changes)
+        result.moves.extend(_line_moves(name, runs, changed_keys))
+
+    return result
+
+
+class Patch(object):
+    """A list of key changes, to apply with ConfigFile.apply_patch().
+
+    Each entry is a KeyChange; its old_values must match the values of the
+    patched file, and are replaced with its new_values.
+    """
+
+    def __init__(self, entries=()):
+        self.entries = []
+        seen = set()
+        for entry in entries:
+            entry = KeyChange(*entry)
+            if (entry.section, entry.key) in seen:
+                raise ValueError("Duplicate patch entry for %s.%s" % (entry.section, entry.key))
+            seen.add((entry.section, entry.key))
+            self.entries.append(entry)
+
+    def dumps(self):
+        """Serialize to JSON."""
+        return json.dumps([
+            {'section': e.section, 'key': e.key, 'old': e.old_values, 'new': e.new_values}
+            for e in self.entries
+        ], sort_keys=True)
+
+    @classmethod
+    def loads(cls, text):
+        """Load a patch serialized by :meth:`dumps`."""
+        return cls(
+            KeyChange(item['section'], item['key'], item['old'], item['new'])
+            for item in json.loads(text))
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __eq__(self, other):
+        if not isinstance(other, Patch):
+            return NotImplemented
+        return self.entries == other.entries
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return '<Patch: %d entries>' % len(self.entries)
+
+
+def make_patch(old, new):
+    """Build the Patch turning ``old`` into ``new``."""
+    return Patch(diff(old, new).changes)
@@ -4,6 +4,12 @@
 
 from __future__ import absolute_import, unicode_literals
 
+import bisect
+import collections
+import contextlib
+import fnmatch
+import functools
+import hashlib
 import os
 import re
 
@@ -22,6 +28,18 @@ class ConfigWritingError(ConfigError):
     """Errors encountered when writing a config file."""
 
 
+class PatchConflict(ConfigError):
+    """A patch doesn't apply to the current values of a file.
+
+    Attributes:
+        conflicts (list): (entry, current values) for each conflicting entry
+    """
+    def __init__(self, conflicts):
+        self.conflicts = conflicts
+        super(PatchConflict, self).__init__("Patch conflicts on %s." % ', '.join(
+            '%s.%s' % (entry[0], entry[1]) for entry, _values in conflicts))
+
+
 class Parser(object):
     """Lex file lines into ConfigLine objects."""
     re_section_header = re.compile(r'^\[([\w._-]+)\]\s*(#.*)?$')
@@ -66,6 +84,23 @@ class ConfigLine(object):
         if not self.text:
             self.text = str(self)
 
+    def matcher(self):
+        """Compile a predicate matching the lines ``l`` for which ``l.match(self)``.
+
+        Scans should compile their query line once, rather than calling
+        :meth:`match` on each line.
+        """
+        if self.kind == self.KIND_DATA:
+            return match_key(self.key, self.value)
+        elif self.kind == self.KIND_HEADER:
+            header = self.header
+            kind = self.KIND_HEADER
+            return lambda line: line.header == header and line.kind == kind
+        else:
+            text = self.text.strip()
+            kind = self.KIND_BLANK
+            return lambda line: line.kind == kind and line.text.strip() == text
+
     def match(self, other):
         if other.kind != self.kind:
             return False
@@ -99,34 +134,160 @@ class ConfigLine(object):
         return hash((self.kind, self.text, self.key, self.value, self.header))
 
 
+# Matchers
+# ========
+# Predicates over ConfigLine objects, for find_lines(), remove_where()...
+# Only data lines have a key.
+
+
+def match_key(key, value=None):
+    """Match data lines with a given key, and value if not None."""
+    if value is None:
+        return lambda line: line.key == key
+    return lambda line: line.value == value and line.key == key
+
+
+def match_key_prefix(prefix):
+    """Match data lines whose key starts with ``prefix``."""
+    return lambda line: line.key is not None and line.key.startswith(prefix)
+
+
+def match_key_regex(regex):
+    """Match data lines whose key matches a regexp (from its start)."""
+    if not hasattr(regex, 'match'):
+        regex = re.compile(regex)
+    match = regex.match
+    return lambda line: line.key is not None and match(line.key) is not None
+
+
 class ConfigLineList(object):
-    """A list of ConfigLine."""
+    """A list of ConfigLine.
+
+    The digest of the lines is cached until they change: lines must be
+    modified through the methods of the list, or by assigning a new list to
+    ``lines``.
+    """
     def __init__(self, *lines):
         self.lines = list(lines)
 
+    @property
+    def lines(self):
+        return self._lines
+
+    @lines.setter
+    def lines(self, lines):
+        self._lines = lines
+        self._digest = None
+        self._data_lines = None
+
     def append(self, line):
-        self.lines.append(line)
+        self._lines.append(line)
+        self._digest = None
+
+    def extend(self, lines):
+        self._lines.extend(lines)
+        self._digest = None
+
+    def digest(self):
+        """Return the SHA-1 digest of the text of the lines."""
+        if self._digest is None:
+            digest = hashlib.sha1()
+            data_lines = 0
+            for line in self._lines:
+                digest.update(line.text.encode('utf-8'))
+                digest.update(b'\n')
+                if line.kind == ConfigLine.KIND_DATA:
+                    data_lines += 1
+            self._digest = digest.digest()
+            self._data_lines = data_lines
+        return self._digest
+
+    def data_line_count(self):
+        """Return the number of data lines, cached along with the digest."""
+        self.digest()
+        return self._data_lines
 
     def find_lines(self, line):
         """Find all lines matching a given line."""
+        return self.find_where(line.matcher())
+
+    def find_where(self, predicate):
+        """Find all lines for which ``predicate(line)`` is true."""
         for other_line in self.lines:
-            if other_line.match(line):
+            if predicate(other_line):
                 yield other_line
 
-    def remove(self, line):
+    def remove(self, line, changes=None):
+        """Remove all lines matching a given line.
+
+        If a ``changes`` list is provided, (block, index, old_line, None)
+        tuples are appended to it for each removed line; the index accounts
+        for the previous removals.
+        """
+        return self.remove_where(line.matcher(), changes=changes)
+
+    def remove_where(self, predicate, changes=None):
+        """Remove all lines for which ``predicate(line)`` is true.
+
+        If a ``changes`` list is provided, (block, index, old_line, None)
+        tuples are appended to it for each removed line; the index accounts
+        for the previous removals.
+        """
         old_len = len(self.lines)
-        self.lines = [l for l in self.lines if not l.match(line)]
+        if changes is None:
+            self.lines = [l for l in self.lines if not predicate(l)]
+        else:
+            kept = []
+            for l in self.lines:
+                if predicate(l):
+                    changes.append((self, len(kept), l, None))
+                else:
+                    kept.append(l)
+            self.lines = kept
         return old_len - len(self.lines)
 
-    def update(self, old_line, new_line, once=False):
+    def rewrite_where(self, predicate, fn, changes=None):
+        """Replace each line for which ``predicate(line)`` is true by ``fn(line)``.
+
+        If a ``changes`` list is provided, (block, index, old_line, new_line)
+        tuples are appended to it for each replaced line.
+        """
+        nb = 0
+        for i, line in enumerate(self.lines):
+            if predicate(line):
+                new_line = fn(line)
+                if new_line is line:
+                    continue
+                self.lines[i] = new_line
+                if changes is not None:
+                    changes.append((self, i, line, new_line))
+                nb += 1
+        if nb:
+            self._digest = None
+        return nb
+
+    def update(self, old_line, new_line, once=False, changes=None):
         """Replace all lines matching `old_line` with `new_line`.
 
         If ``once`` is set to True, remove only the first instance.
+
+        If a ``changes`` list is provided, (block, index, old_line, new_line)
+        tuples are appended to it for each updated line.
+        """
+        return self.update_where(old_line.matcher(), new_line, once=once, changes=changes)
+
+    def update_where(self, predicate, new_line, once=False, changes=None):
+        """Replace all lines for which ``predicate(line)`` is true with `new_line`.
+
+        See :meth:`update`.
         """
         nb = 0
         for i, line in enumerate(self.lines):
-            if line.match(old_line):
+            if predicate(line):
                 self.lines[i] = new_line
+                self._digest = None
+                if changes is not None:
+                    changes.append((self, i, line, new_line))
                 nb += 1
                 if once:
                     return nb
@@ -162,76 +323,759 @@ class SectionBlock(ConfigLineList):
     """A section block.
 
     A section's content may be spread across many such blocks in the file.
+
+    Attributes:
+        section (Section): the section holding the block, if any; updates of
+            the block are reported to it (see :meth:`Section.report_changes`)
     """
     def __init__(self, name, *args):
         self.name = name
+        self.section = None
         super(SectionBlock, self).__init__(*args)
 
+    def _tracking(self, changes):
+        if changes is None and self.section is not None:
+            return self.section.report_changes()
+        return changes, False
+
+    def _updated(self, changes, report):
+        if self.section is not None:
+            self.section.touch()
+            if report and changes:
+                self.section.configfile._changed(self.section.name, changes)
+
+    def append(self, line, changes=None):
+        changes, report = self._tracking(changes)
+        super(SectionBlock, self).append(line)
+        if changes is not None:
+            changes.append((self, len(self.lines) - 1, None, line))
+        self._updated(changes, report)
+
+    def extend(self, lines, changes=None):
+        lines = list(lines)
+        changes, report = self._tracking(changes)
+        if changes is not None:
+            changes.extend((self, index, None, line)
+                for index, line in enumerate(lines, len(self.lines)))
+        super(SectionBlock, self).extend(lines)
+        if lines:
+            self._updated(changes, report)
+
+    def remove_where(self, predicate, changes=None):
+        changes, report = self._tracking(changes)
+        nb = super(SectionBlock, self).remove_where(predicate, changes=changes)
+        if nb:
+            self._updated(changes, report)
+        return nb
+
+    def rewrite_where(self, predicate, fn, changes=None):
+        changes, report = self._tracking(changes)
+        nb = super(SectionBlock, self).rewrite_where(predicate, fn, changes=changes)
+        if nb:
+            self._updated(changes, report)
+        return nb
+
+    def update_where(self, predicate, new_line, once=False, changes=None):
+        changes, report = self._tracking(changes)
+        nb = super(SectionBlock, self).update_where(predicate, new_line, once=once, changes=changes)
+        if nb:
+            self._updated(changes, report)
+        return nb
+
     def header_line(self):
         return ConfigLine(ConfigLine.KIND_HEADER, header=self.name,
                 text='[%s]' % self.name)
 
+    def copy(self):
+        block = SectionBlock(self.name, *self.lines)
+        block.section = self.section
+        block._digest = self._digest
+        block._data_lines = self._data_lines
+        return block
+
     def __repr__(self):
         return 'SectionBlock(%r, %r)' % (self.name, self.lines)
 
 
+def _block_layout(blocks):
+    """Digest the names of the non-empty blocks, in written order.
+
+    Returns:
+        (bytes, str list): the digest, and the names of the sections in the
+            order of their first non-empty block
+    """
+    digest = hashlib.sha1()
+    names = []
+    seen = set()
+    for block in blocks:
+        if not block:
+            continue
+        digest.update(block.name.encode('utf-8'))
+        digest.update(b'\0')
+        if block.name not in seen:
+            seen.add(block.name)
+            names.append(block.name)
+    return digest.digest(), names
+
+
+def _combine_fingerprints(header, layout, sections):
+    """Combine a file fingerprint from its parts.
+
+    Args:
+        header (bytes): the digest of the file header
+        layout ((bytes, str list)): the layout of its blocks, from
+            :func:`_block_layout`
+        sections (dict(name => Section)): the sections of the file
+    """
+    layout_digest, names = layout
+    digest = hashlib.sha1(header)
+    digest.update(layout_digest)
+    for name in names:
+        digest.update(sections[name].fingerprint().encode('ascii'))
+    return digest.hexdigest()
+
+
+def _query_sections(sections, key_pattern, section_pattern):
+    """Yield (section, key, value) for a name => Section mapping; see ConfigFile.query()."""
+    if glob_prefix(section_pattern) == section_pattern:
+        names = [section_pattern] if section_pattern in sections else []
+    else:
+        names = sorted(name for name in sections
+            if fnmatch.fnmatchcase(name, section_pattern))
+
+    for name in names:
+        index = sections[name].index()
+        for key in index.match_keys(key_pattern):
+            for value in index.values[key]:
+                yield name, key, value
+
+
+def glob_prefix(pattern):
+    """Return the part of a glob pattern before its first wildcard."""
+    for i, char in enumerate(pattern):
+        if char in '*?[':
+            return pattern[:i]
+    return pattern
+
+
+class SectionIndex(object):
+    """Key-based index of the data lines of a section.
+
+    Attributes:
+        keys (str list): distinct keys, in order of first appearance
+        values (dict(key => str list)): values of each key, in order
+    """
+    def __init__(self, lines=()):
+        self.keys = []
+        self.values = {}
+        self._sorted_keys = None
+        for line in lines:
+            if line.kind != ConfigLine.KIND_DATA:
+                continue
+            try:
+                self.values[line.key].append(line.value)
+            except KeyError:
+                self.keys.append(line.key)
+                self.values[line.key] = [line.value]
+
+    def sorted_keys(self):
+        """Return the list of distinct keys, sorted; built on first call."""
+        if self._sorted_keys is None:
+            self._sorted_keys = sorted(self.keys)
+        return self._sorted_keys
+
+    def match_keys(self, pattern):
+        """Find the keys matching a glob pattern (``db.*``), sorted.
+
+        Only keys sharing the literal prefix of the pattern are tested.
+        """
+        prefix = glob_prefix(pattern)
+        if prefix == pattern:
+            return [pattern] if pattern in self.values else []
+
+        keys = self.sorted_keys()
+        matching = []
+        for i in range(bisect.bisect_left(keys, prefix), len(keys)):
+            key = keys[i]
+            if not key.startswith(prefix):
+                break
+            if fnmatch.fnmatchcase(key, pattern):
+                matching.append(key)
+        return matching
+
+    def __repr__(self):
+        return '<SectionIndex: %d keys>' % len(self.keys)
+
+
 class Section(object):
     """A section.
 
     A section has a ``name`` and lines spread around the file.
+
+    Updating methods accept an optional ``changes`` list, to which they
+    append a (block, index, old_line, new_line) tuple for each line added
+    (old_line is None), updated or removed (new_line is None). The index is
+    the position of the line in the block when applying the changes in
+    order: a removal shifts the following lines. Creating a new block
+    appends a (block, None, None, None) tuple.
+
+    When no ``changes`` list is provided, changes are reported to the
+    ConfigFile holding the section, if it tracks them: see
+    :meth:`report_changes`.
+
+    Attributes:
+        generation (int): incremented whenever the section's lines change
+        configfile (ConfigFile): the file holding the section, if any
     """
     def __init__(self, name):
         self.name = name
+        self.configfile = None
         self.blocks = []
         self.extra_block = None
+        self.generation = 0
+        self._index = None
+        self._index_generation = None
+        self._fingerprint = None
+        self._fingerprint_generation = None
+
+    def touch(self):
+        """Mark the section's content as modified."""
+        self.generation += 1
+
+    def report_changes(self):
+        """Prepare reporting a direct update to the file's observers and journal.
+
+        Updates made through the ConfigFile collect their own changes; this
+        lets updates called directly on a Section or SectionBlock reach the
+        observers too. Reported changes bump the file's generation.
+
+        Returns:
+            (list, bool): the list to collect changes in (None if the file
+            doesn't track them), and whether they must be reported
+            through :meth:`_report` once the update is complete.
+        """
+        if self.configfile is None:
+            return None, False
+        changes = self.configfile._changes()
+        return changes, changes is not None
+
+    def _report(self, changes, report):
+        if report and changes:
+            self.configfile._changed(self.name, changes)
+
+    def copy(self):
+        """Copy the section, sharing its blocks."""
+        section = Section(self.name)
+        section.configfile = self.configfile
+        section.blocks = list(self.blocks)
+        section.extra_block = self.extra_block
+        section.generation = self.generation
+        section._index = self._index
+        section._index_generation = self._index_generation
+        section._fingerprint = self._fingerprint
+        section._fingerprint_generation = self._fingerprint_generation
+        return section
 
     def new_block(self, **kwargs):
         block = SectionBlock(self.name, **kwargs)
+        block.section = self
         self.blocks.append(block)
         return block
 
     def find_block(self, line):
         """Find the first block containing a line."""
+        matcher = line.matcher()
         for block in self.blocks:
-            if line in block:
-                return block
+            for block_line in block.lines:
+                if matcher(block_line):
+                    return block
+
+    def index(self):
+        """Return a SectionIndex of the section, rebuilt only after changes."""
+        if self._index is None or self._index_generation != self.generation:
+            self._index = SectionIndex(line for block in self.blocks for line in block)
+            self._index_generation = self.generation
+        return self._index
+
+    def fingerprint(self):
+        """Return a hex digest of the section's lines.
+
+        It combines the digests of its (non-empty) blocks, which are only
+        recomputed for modified blocks; the result is cached until the
+        section changes.
+        """
+        if self._fingerprint is None or self._fingerprint_generation != self.generation:
+            digest = hashlib.sha1()
+            for block in self.ordered_blocks():
+                if block:
+                    digest.update(block.digest())
+            self._fingerprint = digest.hexdigest()
+            self._fingerprint_generation = self.generation
+        return self._fingerprint
 
     def find_lines(self, line):
+        return self.find_where(line.matcher())
+
+    def find_where(self, predicate):
         for block in self.blocks:
-            for block_line in block:
-                if block_line.match(line):
+            for block_line in block.lines:
+                if predicate(block_line):
                     yield block_line
 
-    def insert(self, line):
+    def _new_extra_block(self, changes=None):
+        """Create the block holding lines added after the last block."""
+        block = self.extra_block = self.new_block()
+        if changes is not None:
+            changes.append((block, None, None, None))
+        return block
+
+    def insert(self, line, changes=None):
+        if changes is None:
+            changes, report = self.report_changes()
+        else:
+            report = False
         block = self.find_block(line)
         if not block:
             if self.blocks:
                 block = self.blocks[-1]
             else:
-                block = self.extra_block = self.new_block()
-        block.append(line)
+                block = self._new_extra_block(changes)
+        ConfigLineList.append(block, line)
+        if changes is not None:
+            changes.append((block, len(block) - 1, None, line))
+        self.touch()
+        self._report(changes, report)
         return block
 
-    def update(self, old_line, new_line, once=False):
+    def update(self, old_line, new_line, once=False, changes=None):
         """Replace all lines matching `old_line` with `new_line`.
 
         If ``once`` is set to True, remove only the first instance.
         """
+        if changes is None:
+            changes, report = self.report_changes()
+        else:
+            report = False
+        matcher = old_line.matcher()
         nb = 0
         for block in self.blocks:
-            nb += block.update(old_line, new_line, once=once)
+            nb += block.update_where(matcher, new_line, once=once, changes=changes)
             if nb and once:
-                return nb
+                break
+        if nb:
+            self.touch()
+        self._report(changes, report)
         return nb
 
-    def remove(self, line):
+    def remove(self, line, changes=None):
         """Delete all lines matching the given line."""
+        return self.remove_where(line.matcher(), changes=changes)
+
+    def remove_where(self, predicate, changes=None):
+        """Delete all lines for which ``predicate(line)`` is true."""
+        if changes is None:
+            changes, report = self.report_changes()
+        else:
+            report = False
+        nb = 0
+        for block in self.blocks:
+            nb += block.remove_where(predicate, changes=changes)
+
+        if nb:
+            self.touch()
+        self._report(changes, report)
+        return nb
+
+    def rewrite_where(self, predicate, fn, changes=None):
+        """Replace all lines for which ``predicate(line)`` is true by ``fn(line)``."""
+        if changes is None:
+            changes, report = self.report_changes()
+        else:
+            report = False
         nb = 0
         for block in self.blocks:
-            nb += block.remove(line)
+            nb += block.rewrite_where(predicate, fn, changes=changes)
+
+        if nb:
+            self.touch()
+        self._report(changes, report)
+        return nb
+
+    def plan_operations(self, operations):
+        """Compute the effect of a sequence of operations, in a single pass.
+
+        Args:
+            operations (list): (action, old_line, new_line, once) tuples, where
+                action is one of:
+                - 'add': insert new_line, as :meth:`insert`
+                - 'update': replace lines matching old_line, as :meth:`update`
+                - 'remove': remove lines matching old_line, as :meth:`remove`
+                - 'add_or_update': replace lines matching old_line with
+                  new_line, or insert new_line if none matched
+                - 'replace': set the values of old_line's key to those of
+                  new_line, a list of lines, as :meth:`replace_values`
+                All lines of a tuple must be data lines for the same key.
+
+        Returns:
+            (list, list, int): the changes for each modified block, as
+            (block, {index: new line or None}, appended lines) tuples; lines
+            to insert in a new extra block; the number of lines added,
+            updated or removed.
+        """
+        operations_by_key = {}
+        for seq, (action, old_line, new_line, once) in enumerate(operations):
+            key = (old_line or new_line).key
+            operations_by_key.setdefault(key, []).append(
+                (seq, action, old_line, new_line, once))
+
+        # Slots are [block, index, current line]; lines appended by the
+        # operations have no index, and None as block for a new extra block.
+        slots = dict((key, []) for key in operations_by_key)
+        for block in self.blocks:
+            for index, line in enumerate(block.lines):
+                if line.kind == ConfigLine.KIND_DATA and line.key in slots:
+                    slots[line.key].append([block, index, line])
+
+        last_block = self.blocks[-1] if self.blocks else None
+        added = []
+        for key, key_operations in operations_by_key.items():
+            key_slots = slots[key]
+            for seq, action, old_line, new_line, once in key_operations:
+                if action in ('update', 'add_or_update'):
+                    matched = False
+                    matcher = old_line.matcher()
+                    for slot in key_slots:
+                        if slot[2] is not None and matcher(slot[2]):
+                            slot[2] = new_line
+                            matched = True
+                            if once:
+                                break
+                    if matched or action == 'update':
+                        continue
+
+                elif action == 'remove':
+                    matcher = old_line.matcher()
+                    for slot in key_slots:
+                        if slot[2] is not None and matcher(slot[2]):
+                            slot[2] = None
+                    continue
+
+                elif action == 'replace':
+                    expected = frozenset(line.value for line in new_line)
+                    seen = set()
+                    for slot in key_slots:
+                        if slot[2] is None:
+                            continue
+                        if slot[2].value in expected:
+                            seen.add(slot[2].value)
+                        else:
+                            slot[2] = None
+                    for line in new_line:
+                        if line.value not in seen:
+                            seen.add(line.value)
+                            slot = [last_block, None, line]
+                            key_slots.append(slot)
+                            added.append((seq, slot))
+                    continue
+
+                target = last_block
+                matcher = new_line.matcher()
+                for slot in key_slots:
+                    if slot[2] is not None and matcher(slot[2]):
+                        target = slot[0]
+                        break
+                slot = [target, None, new_line]
+                key_slots.append(slot)
+                added.append((seq, slot))
+
+        changes = {}
+        nb = 0
+        for key_slots in slots.values():
+            for block, index, line in key_slots:
+                if index is None:
+                    continue
+                if line is not block.lines[index]:
+                    changes.setdefault(id(block), (block, {}, []))[1][index] = line
+                    nb += 1
+
+        extra_lines = []
+        added.sort(key=lambda item: item[0])
+        for _seq, (block, _index, line) in added:
+            if line is None:
+                continue
+            nb += 1
+            if block is None:
+                extra_lines.append(line)
+            else:
+                changes.setdefault(id(block), (block, {}, []))[2].append(line)
+
+        return list(changes.values()), extra_lines, nb
+
+    def commit_plan(self, plan, changes=None):
+        """Apply the result of :meth:`plan_operations`."""
+        if changes is None:
+            changes, report = self.report_changes()
+        else:
+            report = False
+        block_changes, extra_lines, nb = plan
+        for block, replaced, appended in block_changes:
+            lines = []
+            for index, line in enumerate(block.lines):
+                new_line = replaced.get(index, line)
+                if changes is not None and new_line is not line:
+                    changes.append((block, len(lines), line, new_line))
+                if new_line is not None:
+                    lines.append(new_line)
+            if changes is not None:
+                for index, line in enumerate(appended, len(lines)):
+                    changes.append((block, index, None, line))
+            lines.extend(appended)
+            block.lines = lines
+
+        if extra_lines:
+            block = self._new_extra_block(changes)
+            block.lines = list(extra_lines)
+            if changes is not None:
+                for index, line in enumerate(extra_lines):
+                    changes.append((block, index, None, line))
+        if nb:
+            self.touch()
+        self._report(changes, report)
+        return nb
+
+    def apply_operations(self, operations, changes=None):
+        """Apply a sequence of operations in a single pass.
+
+        See :meth:`plan_operations` for the format of operations.
+
+        Returns:
+            int: the number of lines added, updated or removed
+        """
+        return self.commit_plan(self.plan_operations(operations), changes=changes)
+
+    def replace_values(self, lines_by_key, changes=None):
+        """Set the lines for some keys, in a single pass over the blocks.
+
+        Args:
+            lines_by_key (dict(key => ConfigLine list)): the expected data
+                lines for each key. Lines whose value isn't expected are
+                removed; expected lines not yet present are added.
+
+        Returns:
+            int: the number of lines removed or added
+        """
+        if changes is None:
+            changes, report = self.report_changes()
+        else:
+            report = False
+        expected = dict(
+            (key, frozenset(line.value for line in lines))
+            for key, lines in lines_by_key.items())
+        seen = dict((key, set()) for key in lines_by_key)
+
+        nb = 0
+        for block in self.blocks:
+            kept = []
+            for line in block.lines:
+                if line.kind == ConfigLine.KIND_DATA and line.key in expected:
+                    if line.value not in expected[line.key]:
+                        if changes is not None:
+                            changes.append((block, len(kept), line, None))
+                        continue
+                    seen[line.key].add(line.value)
+                kept.append(line)
+            if len(kept) != len(block.lines):
+                nb += len(block.lines) - len(kept)
+                block.lines = kept
+
+        added = []
+        for key, lines in lines_by_key.items():
+            for line in lines:
+                if line.value not in seen[key]:
+                    seen[key].add(line.value)
+                    added.append(line)
+
+        if added:
+            if self.blocks:
+                block = self.blocks[-1]
+            else:
+                block = self._new_extra_block(changes)
+            if changes is not None:
+                for index, line in enumerate(added, len(block.lines)):
+                    changes.append((block, index, None, line))
+            ConfigLineList.extend(block, added)
+            nb += len(added)
+
+        if nb:
+            self.touch()
+        self._report(changes, report)
+        return nb
+
+    def patch_values(self, lines_by_key, changes=None):
+        """Set the lines of some keys, editing current lines in place.
+
+        For each key, the n-th current line is replaced by the n-th expected
+        line, unless their values are equal; extra current lines are
+        removed, and extra expected lines are inserted after the last line
+        of the key (or at the end of the section).
+
+        Args:
+            lines_by_key (dict(key => ConfigLine list)): the expected data
+                lines for each key
+
+        Returns:
+            int: the number of lines added, updated or removed
+        """
+        if changes is None:
+            changes, report = self.report_changes()
+        else:
+            report = False
+        slots = dict((key, []) for key in lines_by_key)
+        for block in self.blocks:
+            for index, line in enumerate(block.lines):
+                if line.kind == ConfigLine.KIND_DATA and line.key in slots:
+                    slots[line.key].append((block, index))
 
+        # id(block) => (block, {index: new line or None}, {index: inserted lines})
+        edits = {}
+        appended = []
+        nb = 0
+        for key, lines in lines_by_key.items():
+            key_slots = slots[key]
+            for position, (block, index) in enumerate(key_slots):
+                if position < len(lines):
+                    new_line = lines[position]
+                    if new_line.value == block.lines[index].value:
+                        continue
+                else:
+                    new_line = None
+                edits.setdefault(id(block), (block, {}, {}))[1][index] = new_line
+                nb += 1
+
+            extra = lines[len(key_slots):]
+            if extra and key_slots:
+                block, index = key_slots[-1]
+                edits.setdefault(id(block), (block, {}, {}))[2].setdefault(index, []).extend(extra)
+            else:
+                appended.extend(extra)
+            nb += len(extra)
+
+        if appended:
+            if self.blocks:
+                block = self.blocks[-1]
+            else:
+                block = self._new_extra_block(changes)
+            inserted = edits.setdefault(id(block), (block, {}, {}))[2]
+            inserted.setdefault(len(block.lines) - 1, []).extend(appended)
+
+        for block, replaced, inserted in edits.values():
+            lines = []
+            for index in range(-1, len(block.lines)):
+                if index >= 0:
+                    line = block.lines[index]
+                    new_line = replaced.get(index, line)
+                    if changes is not None and new_line is not line:
+                        changes.append((block, len(lines), line, new_line))
+                    if new_line is not None:
+                        lines.append(new_line)
+                for line in inserted.get(index, ()):
+                    if changes is not None:
+                        changes.append((block, len(lines), None, line))
+                    lines.append(line)
+            block.lines = lines
+
+        if nb:
+            self.touch()
+        self._report(changes, report)
         return nb
 
+    def ordered_blocks(self):
+        """List blocks in the order they are written: the extra block last."""
+        blocks = [block for block in self.blocks if block is not self.extra_block]
+        if self.extra_block is not None:
+            blocks.append(self.extra_block)
+        return blocks
+
+    def compact(self, dedup=False, changes=None):
+        """Merge all blocks into the first one.
+
+        Lines keep their order; comments and blank lines move along with the
+        data lines following them. Lines ending a block stay after its last
+        data line, except for the blank lines ending the first block: they
+        remain last, separating the section from the next one.
+
+        If ``dedup`` is True, repeated data lines are dropped along with their
+        leading comments, unless those comments differ from the ones
+        preceding the kept line.
+
+        Returns:
+            SectionBlock list: the blocks merged into the first one
+        """
+        if changes is None:
+            changes, report = self.report_changes()
+        else:
+            report = False
+        blocks = self.ordered_blocks()
+        if not blocks or (len(blocks) == 1 and not dedup):
+            return []
+        target, merged = blocks[0], blocks[1:]
+
+        # Group lines with the comments preceding them
+        groups = []
+        separator = []
+        for block in blocks:
+            pending = []
+            for index, line in enumerate(block.lines):
+                pending.append((block, index, line))
+                if line.kind == ConfigLine.KIND_DATA:
+                    groups.append(pending)
+                    pending = []
+            if block is target:
+                end = len(pending)
+                while end and not pending[end - 1][2].text.strip():
+                    end -= 1
+                pending, separator = pending[:end], pending[end:]
+            if pending:
+                groups.append(pending)
+        if separator:
+            groups.append(separator)
+
+        lines = []
+        seen = {}
+        for group in groups:
+            last = group[-1][2]
+            if dedup and last.kind == ConfigLine.KIND_DATA:
+                comments = tuple(line.text.strip() for _b, _i, line in group[:-1]
+                    if line.text.strip())
+                key = (last.key, last.value)
+                if key not in seen:
+                    seen[key] = comments
+                elif not comments or comments == seen[key]:
+                    # Duplicate, drop the group.
+                    if changes is not None:
+                        for block, _index, line in group:
+                            # Lines of merged blocks are all removed, in order.
+                            index = len(lines) if block is target else 0
+                            changes.append((block, index, line, None))
+                    continue
+
+            for block, _index, line in group:
+                if block is not target and changes is not None:
+                    changes.append((block, 0, line, None))
+                    changes.append((target, len(lines), None, line))
+                lines.append(line)
+
+        if not merged and len(lines) == len(target.lines):
+            return []
+
+        target.lines = lines
+        self.blocks = [target]
+        if self.extra_block is not None and self.extra_block is not target:
+            self.extra_block = None
+        self.touch()
+        self._report(changes, report)
+        return merged
+
     def __iter__(self):
         return iter(self.blocks)
 
@@ -254,26 +1098,66 @@ class BaseSectionView(helpers.DictMixin):
         """Add a new value for a key."""
         self[key] = value
 
+    def _index(self):
+        return self.configfile.section_index(self.name)
+
+    def _value(self, values):
+        """Convert the list of values of a key into the exposed value."""
+        raise NotImplementedError()
+
+    def __contains__(self, key):
+        return key in self._index().values
+
+    def __len__(self):
+        return len(self._index().keys)
+
+    def __iter__(self):
+        return iter(self._index().keys)
+
+    iterkeys = __iter__
+
+    def iteritems(self):
+        index = self._index()
+        for key in index.keys:
+            yield key, self._value(index.values[key])
+
+    def itervalues(self):
+        index = self._index()
+        for key in index.keys:
+            yield self._value(index.values[key])
+
+    def keys(self):
+        return list(self._index().keys)
+
+    def values(self):
+        index = self._index()
+        return [self._value(index.values[key]) for key in index.keys]
+
     def __repr__(self):
         return '<%s: %r->%s>' % (self.__class__.__name__,
             self.configfile, self.name)
 
 
 class SingleValuedSectionView(BaseSectionView):
+    """A SectionView exposing the first value of each key."""
+
+    def _value(self, values):
+        return values[0]
 
     def __getitem__(self, key):
-        return self.configfile.get_one(self.name, key)
+        try:
+            return self._index().values[key][0]
+        except KeyError:
+            raise KeyError("Key %s not found in %s" % (key, self.name))
 
     def __setitem__(self, key, value):
         self.configfile.add_or_update(self.name, key, value)
 
     def __delitem__(self, key):
-        removed = self.configfile.remove(self.name, key)
-        if not removed:
+        # Within a batch, remove() is buffered and returns None.
+        if key not in self:
             raise KeyError("No line matching %r in %r" % (key, self))
-
-    def iteritems(self):
-        return self.configfile.items(self.name)
+        self.configfile.remove(self.name, key)
 
 
 class MultiValuedSectionView(BaseSectionView):
@@ -281,19 +1165,35 @@ class MultiValuedSectionView(BaseSectionView):
 
     Always provide the list of expected values when setting.
     """
+    def _value(self, values):
+        return list(values)
+
     def __getitem__(self, key):
-        entries = list(self.configfile.get(self.name, key))
-        if not entries:
+        try:
+            return list(self._index().values[key])
+        except KeyError:
             raise KeyError("No value defined for key %r in %r" % (key, self))
-        return entries
 
     def __setitem__(self, key, values):
-        old_values = frozenset(self.get(key, []))
-        new_values = frozenset(values)
-        for removed in old_values - new_values:
-            self.configfile.remove(self.name, key, removed)
-        for added in new_values - old_values:
-            self.configfile.add(self.name, key, added)
+        self.replace(key, values)
+
+    def replace(self, key, values):
+        """Set the list of values for a key.
+
+        Lines whose value is still expected are kept untouched.
+
+        Returns:
+            int: the number of lines removed or added
+        """
+        return self.replace_many({key: values})
+
+    def replace_many(self, values_by_key):
+        """Set the list of values for several keys at once.
+
+        Returns:
+            int: the number of lines removed or added
+        """
+        return self.configfile.replace_values(self.name, values_by_key)
 
     def add(self, key, value):
         """Add a new value for a key.
@@ -305,19 +1205,14 @@ class MultiValuedSectionView(BaseSectionView):
         self.configfile.add(self.name, key, value)
 
     def __delitem__(self, key):
-        removed = self.configfile.remove(self.name, key)
-        if not removed:
+        # Within a batch, remove() is buffered and returns None.
+        if key not in self:
             raise KeyError("No value defined for key %r in %r" % (key, self))
+        self.configfile.remove(self.name, key)
 
-    def iteritems(self):
-        values = dict()
-        order = []
-        for k, v in self.configfile.items(self.name):
-            values.setdefault(k, []).append(v)
-            if k not in order:
-                order.append(k)
-        for k in order:
-            yield k, values[k]
+
+JournalEntry = collections.namedtuple('JournalEntry',
+    ['generation', 'section', 'old_line', 'new_line', 'block', 'index'])
 
 
 class ConfigFile(object):
@@ -328,13 +1223,41 @@ class ConfigFile(object):
         blocks (SectionBlock list): blocks from the file
         header (ConfigLineList): list of lines before the first section
         current_block (SectionBlock): current block being read
+        generation (int): incremented by each update of the file
+        journal (JournalEntry deque): the last changes, if enabled through
+            :meth:`enable_journal`
     """
 
+    CHANGE_BLOCK = 'block'
+    CHANGE_MOVE = 'move'
+    CHANGE_ADD = 'add'
+    CHANGE_UPDATE = 'update'
+    CHANGE_REMOVE = 'remove'
+
     def __init__(self):
         self.sections = dict()
         self.blocks = []
         self.header = ConfigLineList()
         self.current_block = None
+        # Copy-on-write state, see snapshot()
+        self._shared = False
+        self._shared_sections = set()
+        # Buffered operations, by section, see batch()
+        self._batch = None
+        # section => rank of its first buffered operation creating it
+        self._batch_creations = None
+        self.generation = 0
+        self.journal = None
+        self._observers = []
+        # (section, changes) recorded by the current update, see _grouped()
+        self._pending_changes = None
+        # See fingerprint()
+        self._fingerprint = None
+        self._fingerprint_header = None
+        # Cleared when blocks are moved or removed
+        self._layout = None
+        # name => (section, generation, emptiness of its blocks)
+        self._section_states = {}
 
     def _get_section(self, name, create=True):
         """Retrieve a section by name. Create it on first access."""
@@ -345,6 +1268,7 @@ class ConfigFile(object):
                 raise
 
             section = Section(name)
+            section.configfile = self
             self.sections[name] = section
             return section
 
@@ -352,6 +1276,173 @@ class ConfigFile(object):
         """Check whether a given name is a known section."""
         return name in self.sections
 
+    # Change tracking
+    # ===============
+
+    def enable_journal(self, size=1000):
+        """Record the last ``size`` line changes in :attr:`journal`.
+
+        Each JournalEntry holds the generation of the change, the section
+        name (None for the file header), the old line (None for additions),
+        the new line (None for removals), and the position of the line: its
+        block and index in that block. Entries can be replayed in order:
+        each index accounts for the previous entries.
+
+        Moving a block (:meth:`move_section`) is recorded with both lines
+        set to None, and the index of the block in :attr:`blocks` once
+        removed from its previous position and inserted again.
+        """
+        self.journal = collections.deque(maxlen=size)
+
+    def observe(self, callback):
+        """Call ``callback(kind, entry)`` after each change of the file.
+
+        ``kind`` is one of CHANGE_BLOCK (a new block was created),
+        CHANGE_MOVE (a block was moved), CHANGE_ADD, CHANGE_UPDATE or
+        CHANGE_REMOVE; ``entry`` is a JournalEntry describing the change, as
+        in :attr:`journal` (for CHANGE_BLOCK, both lines and the index are
+        None).
+
+        Callbacks are called once the updating method completed, with all
+        of its changes. Updates called directly on the file's Section and
+        SectionBlock objects are reported too, as long as those objects
+        are part of the file.
+
+        Exceptions raised by callbacks propagate to the caller of the
+        updating method, once the change has been applied.
+        """
+        self._observers.append(callback)
+
+    def unobserve(self, callback):
+        """Stop calling a callback registered through :meth:`observe`.
+
+        Raises:
+            ValueError: if the callback wasn't registered.
+        """
+        self._observers.remove(callback)
+
+    def _changes(self):
+        """Return a list to collect changes in, if they are tracked."""
+        if self.journal is not None or self._observers:
+            return []
+        return None
+
+    def _changed(self, section, changes=None):
+        """Record a change of the file, and notify observers.
+
+        Within :meth:`_grouped`, the change is recorded when leaving the
+        group.
+        """
+        pending = self._pending_changes
+        if pending is None:
+            self._record([(section, changes)])
+        elif changes is not None:
+            pending.append((section, changes))
+        elif not pending:
+            # Untracked changes only need to bump the generation once.
+            pending.append((section, None))
+
+    @contextlib.contextmanager
+    def _grouped(self):
+        """Record all changes made within the block as a single generation."""
+        if self._pending_changes is not None:
+            yield
+            return
+
+        self._pending_changes = pending = []
+        try:
+            yield
+        finally:
+            self._pending_changes = None
+            if pending:
+                self._record(pending)
+
+    def _record(self, section_changes):
+        """Bump the generation, journal changes and notify observers.
+
+        Args:
+            section_changes (list): (section name, changes) pairs
+        """
+        self.generation += 1
+        entries = []
+        for section, changes in section_changes:
+            for block, index, old_line, new_line in changes or ():
+                entry = JournalEntry(self.generation, section, old_line, new_line, block, index)
+                if old_line is None and new_line is None:
+                    kind = self.CHANGE_BLOCK if index is None else self.CHANGE_MOVE
+                elif old_line is None:
+                    kind = self.CHANGE_ADD
+                elif new_line is None:
+                    kind = self.CHANGE_REMOVE
+                else:
+                    kind = self.CHANGE_UPDATE
+                if kind != self.CHANGE_BLOCK and self.journal is not None:
+                    self.journal.append(entry)
+                entries.append((kind, entry))
+
+        if not entries:
+            return
+        for callback in list(self._observers):
+            for kind, entry in entries:
+                callback(kind, entry)
+
+    # Copy-on-write
+    # =============
+
+    def snapshot(self):
+        """Return an independent copy of the file, in constant time.
+
+        Both files share their structure until one of them is modified: the
+        first update copies the list of blocks and sections, and updating a
+        section then copies the blocks of that section only.
+        """
+        other = self.__class__()
+        other.sections = self.sections
+        other.blocks = self.blocks
+        other.header = self.header
+        other.current_block = self.current_block
+        other.generation = self.generation
+        self._shared = other._shared = True
+        return other
+
+    def _unshare(self):
+        """Take ownership of the list of blocks and sections.
+
+        The blocks themselves remain shared until their section is updated.
+        """
+        if not self._shared:
+            return
+        self.sections = dict(
+            (name, section.copy()) for name, section in self.sections.items())
+        for section in self.sections.values():
+            section.configfile = self
+        self.blocks = list(self.blocks)
+        self.header = ConfigLineList(*self.header)
+        self._shared_sections = set(self.sections)
+        self._shared = False
+
+    def _writable_section(self, name, create=True):
+        """Retrieve a section, ensuring its blocks can be updated in place.
+
+        Raises:
+            KeyError: if the section doesn't exist and create is False.
+        """
+        self._unshare()
+        section = self._get_section(name, create=create)
+        if name in self._shared_sections:
+            self._shared_sections.discard(name)
+            copies = {}
+            for i, block in enumerate(section.blocks):
+                copies[id(block)] = section.blocks[i] = block.copy()
+                section.blocks[i].section = section
+            if section.extra_block is not None:
+                section.extra_block = copies[id(section.extra_block)]
+            for i, block in enumerate(self.blocks):
+                self.blocks[i] = copies.get(id(block), block)
+            if self.current_block is not None:
+                self.current_block = copies.get(id(self.current_block), self.current_block)
+        return section
+
     # Accessing values
     # ================
 
@@ -382,17 +1473,41 @@ class ConfigFile(object):
 
     def enter_block(self, name):
         """Mark 'entering a block'."""
+        self._check_not_batching('enter_block')
+        self._unshare()
         section = self._get_section(name)
         block = self.current_block = section.new_block()
         self.blocks.append(block)
+        changes = self._changes()
+        if changes is not None:
+            changes.append((block, None, None, None))
+        self._changed(name, changes)
         return block
 
     def insert_line(self, line):
         """Insert a new line"""
-        if self.current_block is not None:
-            self.current_block.append(line)
+        if self._batch is not None:
+            self._check_not_batching('insert_line')
+        block = self.current_block
+        if block is not None:
+            section = block.section
+            if section is None or self._shared or block.name in self._shared_sections:
+                section = self._writable_section(block.name)
+                block = self.current_block
+            section.generation += 1  # section.touch(), inlined for parse()
         else:
-            self.header.append(line)
+            self._unshare()
+            section = None
+            block = self.header
+
+        # Changes are collected here, not by SectionBlock.append()
+        block._lines.append(line)
+        block._digest = None
+        if self.journal is not None or self._observers:
+            self._changed(section and section.name, [(block, len(block) - 1, None, line)])
+        elif not self._pending_changes:
+            # Within a group, the generation bump is already recorded.
+            self._changed(section and section.name)
 
     def handle_line(self, line):
         """Read one line."""
@@ -405,8 +1520,9 @@ class ConfigFile(object):
         """Fill from a file-like object."""
         self.current_block = None  # Reset current block
         parser = parser or Parser()
-        for line in parser.parse(fileobj, name_hint=name_hint):
-            self.handle_line(line)
+        with self._grouped():
+            for line in parser.parse(fileobj, name_hint=name_hint):
+                self.handle_line(line)
 
     def parse_file(self, filename, skip_unreadable=False, **kwargs):
         """Parse a file from its name (instead of fds).
@@ -429,7 +1545,11 @@ class ConfigFile(object):
 
         Returns the SectionBlock containing that new line.
         """
-        return self._get_section(section).insert(line)
+        self._check_not_batching('add_line')
+        changes = self._changes()
+        block = self._writable_section(section).insert(line, changes=changes)
+        self._changed(section, changes)
+        return block
 
     def update_line(self, section, old_line, new_line, once=False):
         """Replace all lines matching `old_line` with `new_line`.
@@ -439,11 +1559,16 @@ class ConfigFile(object):
         Returns:
             int: the number of updates performed
         """
+        self._check_not_batching('update_line')
         try:
-            s = self._get_section(section, create=False)
+            s = self._writable_section(section, create=False)
         except KeyError:
             return 0
-        return s.update(old_line, new_line, once=once)
+        changes = self._changes()
+        nb = s.update(old_line, new_line, once=once, changes=changes)
+        if nb:
+            self._changed(section, changes)
+        return nb
 
     def remove_line(self, section, line):
         """Remove all instances of a line.
@@ -451,13 +1576,18 @@ class ConfigFile(object):
         Returns:
             int: the number of lines removed
         """
+        self._check_not_batching('remove_line')
         try:
-            s = self._get_section(section, create=False)
+            s = self._writable_section(section, create=False)
         except KeyError:
             # No such section, skip.
             return 0
 
-        return s.remove(line)
+        changes = self._changes()
+        nb = s.remove(line, changes=changes)
+        if nb:
+            self._changed(section, changes)
+        return nb
 
     # High-level API
     # ==============
@@ -477,8 +1607,15 @@ class ConfigFile(object):
         Yields:
             values for matching lines.
         """
-        line = self._make_line(key)
-        for line in self.get_line(section, line):
+        return self._values(section, key)
+
+    def _values(self, section, key):
+        """Lazily yield the values of a section/key, without locking."""
+        try:
+            s = self._get_section(section, create=False)
+        except KeyError:
+            return
+        for line in s.find_where(match_key(key)):
             yield line.value
 
     def get_one(self, section, key):
@@ -487,14 +1624,32 @@ class ConfigFile(object):
         Raises:
             KeyError: If no line match the given section/key.
         """
-        lines = iter(self.get(section, key))
+        lines = self._values(section, key)
         try:
             return next(lines)
         except StopIteration:
             raise KeyError("Key %s not found in %s" % (key, section))
 
+    def query(self, key_pattern, section_pattern='*'):
+        """Retrieve values whose section and key match glob patterns.
+
+        Lookups rely on the index of each matching section: a sorted list of
+        its keys, built lazily and dropped whenever the section changes.
+
+        Args:
+            key_pattern (str): a glob pattern over keys (``worker_*_threads``)
+            section_pattern (str): a glob pattern over section names
+
+        Yields:
+            (section, key, value) tuples, sorted by section then key; values
+            of a key are in file order.
+        """
+        return _query_sections(self.sections, key_pattern, section_pattern)
+
     def add(self, section, key, value):
         line = self._make_line(key, value)
+        if self._batch is not None:
+            return self._buffer(section, 'add', None, line)
         return self.add_line(section, line)
 
     def add_or_update(self, section, key, value):
@@ -503,6 +1658,9 @@ class ConfigFile(object):
         Returns:
             int: Number of updated lines.
         """
+        if self._batch is not None:
+            return self._buffer(section, 'add_or_update',
+                self._make_line(key), self._make_line(key, value))
         updates = self.update(section, key, value)
         if updates == 0:
             self.add(section, key, value)
@@ -511,26 +1669,469 @@ class ConfigFile(object):
     def update(self, section, key, new_value, old_value=None, once=False):
         old_line = self._make_line(key, old_value)
         new_line = self._make_line(key, new_value)
+        if self._batch is not None:
+            return self._buffer(section, 'update', old_line, new_line, once)
         return self.update_line(section, old_line, new_line, once=once)
 
     def remove(self, section, key, value=None):
         line = self._make_line(key, value)
+        if self._batch is not None:
+            return self._buffer(section, 'remove', line, None)
         return self.remove_line(section, line)
 
-    # Views
-    # =====
-
-    def section_view(self, section, multi_value=False):
-        view_class = MultiValuedSectionView if multi_value else SingleValuedSectionView
-        return view_class(self, section)
+    def replace_values(self, section, values_by_key):
+        """Set the values of several keys of a section.
 
-    # Regenerating file
-    # =================
+        Lines whose value is still listed are kept; other lines for those keys
+        are removed, and new values are added at the end of the section.
+        All changes are performed in a single pass over the section.
 
-    def __iter__(self):
-        # First, the header
-        for line in self.header:
-            yield line
+        Args:
+            values_by_key (dict(key => value list)): the new values
+
+        Returns:
+            int: the number of lines removed or added
+        """
+        lines_by_key = dict(
+            (key, [self._make_line(key, value) for value in values])
+            for key, values in values_by_key.items())
+        if self._batch is not None:
+            for key, lines in lines_by_key.items():
+                self._buffer(section, 'replace', self._make_line(key), lines)
+            return None
+        create = any(lines_by_key.values())
+        try:
+            s = self._writable_section(section, create=create)
+        except KeyError:
+            return 0
+        changes = self._changes()
+        nb = s.replace_values(lines_by_key, changes=changes)
+        if nb:
+            self._changed(section, changes)
+        return nb
+
+    def compact(self, section=None, dedup=False):
+        """Merge the blocks of a section into a single block.
+
+        The lines of the section are gathered at the position of its first
+        block. See :meth:`Section.compact`.
+
+        Args:
+            section (str): the section to compact; all sections if None
+            dedup (bool): whether to drop repeated data lines
+
+        Returns:
+            int: the number of blocks removed
+        """
+        self._check_not_batching('compact')
+        if section is None:
+            names = list(self.sections)
+        else:
+            names = [section]
+
+        removed = set()
+        with self._grouped():
+            for name in names:
+                try:
+                    s = self._writable_section(name, create=False)
+                except KeyError:
+                    continue
+                changes = self._changes()
+                generation = s.generation
+                removed.update(id(block) for block in s.compact(dedup=dedup, changes=changes))
+                if s.generation != generation:
+                    self._changed(name, changes)
+
+                if self.current_block is not None and id(self.current_block) in removed:
+                    self.current_block = s.blocks[0]
+
+        if removed:
+            self.blocks = [block for block in self.blocks if id(block) not in removed]
+            self._layout = None
+        return len(removed)
+
+    def _edit_where(self, operation, sections, edit):
+        """Call ``edit(section, changes)`` on some sections.
+
+        Returns:
+            int: the total of the values returned by ``edit``
+        """
+        self._check_not_batching(operation)
+        if sections is None:
+            sections = list(self.sections)
+
+        total = 0
+        with self._grouped():
+            for name in sections:
+                try:
+                    s = self._writable_section(name, create=False)
+                except KeyError:
+                    continue
+                changes = self._changes()
+                nb = edit(s, changes)
+                if nb:
+                    self._changed(name, changes)
+                    total += nb
+        return total
+
+    def remove_where(self, predicate, sections=None):
+        """Remove all lines for which ``predicate(line)`` is true.
+
+        Each block is visited once, whatever the number of lines removed.
+        The predicate is called for every line of the visited sections,
+        including comments and blank lines.
+
+        Args:
+            predicate (ConfigLine => bool): whether to remove a line
+            sections (str iterable): the sections to visit; all if None
+
+        Returns:
+            int: the number of lines removed
+        """
+        return self._edit_where('remove_where', sections,
+            lambda s, changes: s.remove_where(predicate, changes=changes))
+
+    def rewrite_where(self, predicate, fn, sections=None):
+        """Replace all lines for which ``predicate(line)`` is true by ``fn(line)``.
+
+        Each block is visited once. ``fn`` must return a ConfigLine; returning
+        the line itself leaves it untouched.
+
+        Args:
+            predicate (ConfigLine => bool): whether to rewrite a line
+            fn (ConfigLine => ConfigLine): computes the replacement of a line
+            sections (str iterable): the sections to visit; all if None
+
+        Returns:
+            int: the number of lines replaced
+        """
+        return self._edit_where('rewrite_where', sections,
+            lambda s, changes: s.rewrite_where(predicate, fn, changes=changes))
+
+    def apply_patch(self, patch):
+        """Apply a patch, in a single pass per section.
+
+        All entries are first checked against the current values; nothing is
+        modified if any of them conflicts. Lines whose value doesn't change
+        are left untouched, with their formatting and comments.
+
+        Args:
+            patch (iterable): (section, key, old_values, new_values) entries,
+                such as a :class:`~configdiff.Patch`
+
+        Returns:
+            int: the number of lines added, updated or removed
+
+        Raises:
+            PatchConflict: if the values of a section/key differ from the
+                entry's old_values
+        """
+        self._check_not_batching('apply_patch')
+
+        conflicts = []
+        by_section = {}
+        for entry in patch:
+            section, key, old_values, new_values = entry
+            current = self.section_index(section).values.get(key, [])
+            if list(current) != list(old_values):
+                conflicts.append((entry, list(current)))
+            by_section.setdefault(section, {})[key] = [
+                self._make_line(key, value) for value in new_values]
+        if conflicts:
+            raise PatchConflict(conflicts)
+
+        total = 0
+        with self._grouped():
+            for section, lines_by_key in by_section.items():
+                create = any(lines_by_key.values())
+                try:
+                    s = self._writable_section(section, create=create)
+                except KeyError:
+                    continue
+                changes = self._changes()
+                nb = s.patch_values(lines_by_key, changes=changes)
+                if nb:
+                    self._changed(section, changes)
+                    total += nb
+        return total
+
+    # Whole sections
+    # ==============
+
+    def remove_section(self, section):
+        """Remove a section, and all its blocks.
+
+        Returns:
+            int: the number of lines removed
+        """
+        self._check_not_batching('remove_section')
+        try:
+            s = self._writable_section(section, create=False)
+        except KeyError:
+            return 0
+
+        del self.sections[section]
+        s.configfile = None
+        blocks = set(id(block) for block in s.blocks)
+        self.blocks = [block for block in self.blocks if id(block) not in blocks]
+        self._layout = None
+        if self.current_block is not None and id(self.current_block) in blocks:
+            self.current_block = None
+
+        changes = self._changes()
+        nb = 0
+        for block in s.blocks:
+            if changes is not None:
+                changes.extend((block, 0, line, None) for line in block.lines)
+            nb += len(block)
+        self._changed(section, changes)
+        return nb
+
+    def rename_section(self, section, new_name):
+        """Rename a section, keeping its blocks in place.
+
+        Raises:
+            KeyError: if the section doesn't exist
+            ConfigError: if a section named ``new_name`` already exists
+        """
+        self._check_not_batching('rename_section')
+        if new_name in self.sections:
+            raise ConfigError("Unable to rename %s: section %s already exists." % (section, new_name))
+        s = self._writable_section(section, create=False)
+
+        del self.sections[section]
+        s.name = new_name
+        for block in s.blocks:
+            block.name = new_name
+        self.sections[new_name] = s
+        self._layout = None
+        s.touch()
+
+        changes = self._changes()
+        if changes is None:
+            self._changed(new_name)
+        else:
+            # Lines leave the old section, and come back in the new one.
+            with self._grouped():
+                self._changed(section, [
+                    (block, 0, line, None) for block in s.blocks for line in block.lines])
+                self._changed(new_name, [
+                    (block, index, None, line)
+                    for block in s.blocks for index, line in enumerate(block.lines)])
+
+    def move_section(self, section, before=None):
+        """Move all blocks of a section, in order, before another section.
+
+        Args:
+            section (str): the section to move
+            before (str): the section whose first block should follow the
+                moved blocks; if None, move them to the end of the file (lines
+                added outside of any block are still written after them).
+
+        Raises:
+            KeyError: if the section doesn't exist
+            ConfigError: if ``before`` is the moved section or doesn't exist
+        """
+        self._check_not_batching('move_section')
+        if before == section:
+            raise ConfigError("Unable to move section %s before itself." % section)
+        if before is not None and before not in self.sections:
+            raise ConfigError("Unable to move section %s before unknown section %s." % (section, before))
+        s = self._get_section(section, create=False)
+        self._unshare()
+
+        moved = set(id(block) for block in s.blocks)
+        blocks = [block for block in self.blocks if id(block) not in moved]
+        position = len(blocks)
+        if before is not None:
+            for i, block in enumerate(blocks):
+                if block.name == before:
+                    position = i
+                    break
+        blocks[position:position] = [block for block in self.blocks if id(block) in moved]
+        if blocks == self.blocks:
+            return
+
+        changes = self._changes()
+        if changes is not None:
+            # Replay the move one block at a time, recording the index at
+            # which each block is inserted back.
+            end = position + len(moved)
+            anchor = blocks[end] if end < len(blocks) else None
+            current = list(self.blocks)
+            previous = None
+            for block in blocks[position:end]:
+                del current[current.index(block)]
+                if previous is not None:
+                    index = current.index(previous) + 1
+                elif anchor is not None:
+                    index = current.index(anchor)
+                else:
+                    index = len(current)
+                current.insert(index, block)
+                changes.append((block, index, None, None))
+                previous = block
+        self.blocks = blocks
+        self._layout = None
+        self._changed(section, changes)
+
+    # Batches
+    # =======
+
+    @contextlib.contextmanager
+    def batch(self):
+        """Buffer updates, and apply them when leaving the block.
+
+        Within the block, calls to :meth:`add`, :meth:`update`,
+        :meth:`remove`, :meth:`add_or_update` and :meth:`replace_values` are
+        recorded and return None; reads still see the previous content. On
+        exit, operations are applied with a single pass over each modified
+        section.
+
+        Other updating methods (:meth:`add_line`, :meth:`remove_where`,
+        :meth:`compact`, :meth:`remove_section`, :meth:`apply_patch`...)
+        raise a ConfigError within the block.
+
+        If the block raises an exception, no operation is applied.
+
+        Nested batches are merged into the outermost one.
+        """
+        if self._batch is not None:
+            yield
+            return
+
+        self._batch = batch = {}
+        self._batch_creations = creations = {}
+        try:
+            yield
+        finally:
+            self._batch = None
+            self._batch_creations = None
+        self._apply_batch(batch, creations)
+
+    def _check_not_batching(self, operation):
+        """Forbid updates which aren't buffered while in a batch.
+
+        Raises:
+            ConfigError: if a batch is in progress.
+        """
+        if self._batch is not None:
+            raise ConfigError("%s() can't be called within a batch." % operation)
+
+    def _buffer(self, section, action, old_line, new_line, once=False):
+        self._batch.setdefault(section, []).append((action, old_line, new_line, once))
+        if action in ('add', 'add_or_update') or (action == 'replace' and new_line):
+            self._batch_creations.setdefault(section, len(self._batch_creations))
+
+    def _apply_batch(self, batch, creations):
+        """Apply buffered operations; nothing is modified if planning fails.
+
+        Missing sections are created in the order of their first creating
+        operation, as they would be without a batch.
+        """
+        plans = []
+        for name in sorted(batch, key=lambda name: creations.get(name, -1)):
+            try:
+                section = self._writable_section(name, create=name in creations)
+            except KeyError:
+                continue
+            plans.append((section, section.plan_operations(batch[name])))
+
+        with self._grouped():
+            for section, plan in plans:
+                changes = self._changes()
+                if section.commit_plan(plan, changes=changes):
+                    self._changed(section.name, changes)
+
+    # Views
+    # =====
+
+    def section_index(self, section):
+        """Retrieve the SectionIndex of a section.
+
+        The index is cached until the section is modified; it must not be
+        altered by callers.
+        """
+        try:
+            s = self._get_section(section, create=False)
+        except KeyError:
+            return SectionIndex()
+        return s.index()
+
+    def section_fingerprint(self, section):
+        """Return a hex digest of the lines of a section, or None if unknown.
+
+        See :meth:`Section.fingerprint`.
+        """
+        try:
+            s = self._get_section(section, create=False)
+        except KeyError:
+            return None
+        return s.fingerprint()
+
+    def fingerprint(self):
+        """Return a hex digest of the content of the file.
+
+        Two files with the same fingerprint write the same text. The
+        fingerprint combines the digest of the header, the names of the
+        (non-empty) blocks in written order, and the cached fingerprint of
+        each section: after an update, only the fingerprints of modified
+        sections are recomputed. The list of names is only rebuilt when
+        blocks are added, moved or removed, or become empty or non-empty.
+        """
+        states = self._section_states
+        changed = layout_changed = self._layout is None
+        for name, section in self.sections.items():
+            state = states.get(name)
+            if state is not None and state[0] is section and state[1] == section.generation:
+                continue
+            emptiness = tuple(not block for block in section.blocks)
+            if state is None or state[0] is not section or state[2] != emptiness:
+                layout_changed = True
+            states[name] = (section, section.generation, emptiness)
+            changed = True
+
+        if layout_changed:
+            for name in [name for name in states if name not in self.sections]:
+                del states[name]
+            blocks = list(self.blocks)
+            blocks.extend(
+                section.extra_block for section in self.sections.values()
+                if section.extra_block is not None)
+            self._layout = _block_layout(blocks)
+
+        header = self.header.digest()
+        if changed or self._fingerprint is None or header != self._fingerprint_header:
+            self._fingerprint = _combine_fingerprints(header, self._layout, self.sections)
+            self._fingerprint_header = header
+        return self._fingerprint
+
+    def section_generation(self, section):
+        """Return a token changing whenever the section's content changes.
+
+        Tokens can only be compared for equality.
+        """
+        try:
+            s = self._get_section(section, create=False)
+        except KeyError:
+            return None
+        return (s, s.generation)
+
+    def section_view(self, section, multi_value=False):
+        view_class = MultiValuedSectionView if multi_value else SingleValuedSectionView
+        return view_class(self, section)
+
+    def freeze(self):
+        """Return an immutable, read-optimized FrozenConfigFile snapshot."""
+        return FrozenConfigFile(self)
+
+    # Regenerating file
+    # =================
+
+    def __iter__(self):
+        # First, the header
+        for line in self.header:
+            yield line
 
         # Then the content of blocks
         for block in self.blocks:
@@ -553,3 +2154,653 @@ class ConfigFile(object):
         """Write to an open file-like object."""
         for line in self:
             fd.write('%s\n' % line.text)
+
+
+# Run a ThreadSafeConfigFile method under the shared lock; generators are
+# consumed while holding the lock.
+_reading = helpers.read_locked
+_reading_iter = helpers.read_locked_iter
+
+
+def _writing(method):
+    """Run a ThreadSafeConfigFile method under the exclusive lock."""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        self.lock.acquire_write()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self.lock.release_write()
+    return wrapper
+
+
+class ThreadSafeConfigFile(ConfigFile):
+    """A ConfigFile which may be shared between threads.
+
+    Reading methods run concurrently, under a shared lock; methods updating
+    the file run alone, under an exclusive lock.
+
+    Since locks can't be held across yields, reading methods return iterators
+    over a list of results instead of lazy generators.
+
+    Attributes:
+        lock (helpers.RWLock): the readers/writer lock
+    """
+
+    def __init__(self):
+        super(ThreadSafeConfigFile, self).__init__()
+        self.lock = helpers.RWLock()
+
+    # Accessing values
+    __contains__ = _reading(ConfigFile.__contains__)
+    get_line = _reading_iter(ConfigFile.get_line)
+    iter_lines = _reading_iter(ConfigFile.iter_lines)
+    items = _reading_iter(ConfigFile.items)
+    get = _reading_iter(ConfigFile.get)
+    get_one = _reading(ConfigFile.get_one)
+    query = _reading_iter(ConfigFile.query)
+    section_index = _reading(ConfigFile.section_index)
+    section_generation = _reading(ConfigFile.section_generation)
+    section_fingerprint = _reading(ConfigFile.section_fingerprint)
+    fingerprint = _reading(ConfigFile.fingerprint)
+    freeze = _reading(ConfigFile.freeze)
+    snapshot = _reading(ConfigFile.snapshot)
+    __iter__ = _reading_iter(ConfigFile.__iter__)
+    write = _reading(ConfigFile.write)
+
+    # Filling from lines
+    enter_block = _writing(ConfigFile.enter_block)
+    insert_line = _writing(ConfigFile.insert_line)
+    handle_line = _writing(ConfigFile.handle_line)
+    parse = _writing(ConfigFile.parse)
+
+    # Updating config content
+    add_line = _writing(ConfigFile.add_line)
+    update_line = _writing(ConfigFile.update_line)
+    remove_line = _writing(ConfigFile.remove_line)
+    add = _writing(ConfigFile.add)
+    add_or_update = _writing(ConfigFile.add_or_update)
+    update = _writing(ConfigFile.update)
+    remove = _writing(ConfigFile.remove)
+    replace_values = _writing(ConfigFile.replace_values)
+    compact = _writing(ConfigFile.compact)
+    remove_section = _writing(ConfigFile.remove_section)
+    remove_where = _writing(ConfigFile.remove_where)
+    rewrite_where = _writing(ConfigFile.rewrite_where)
+    apply_patch = _writing(ConfigFile.apply_patch)
+    rename_section = _writing(ConfigFile.rename_section)
+    move_section = _writing(ConfigFile.move_section)
+    enable_journal = _writing(ConfigFile.enable_journal)
+    observe = _writing(ConfigFile.observe)
+    unobserve = _writing(ConfigFile.unobserve)
+
+    @contextlib.contextmanager
+    def batch(self):
+        """Buffer updates, holding the exclusive lock until they are applied."""
+        self.lock.acquire_write()
+        try:
+            with super(ThreadSafeConfigFile, self).batch():
+                yield
+        finally:
+            self.lock.release_write()
+
+
+class FrozenConfigFile(object):
+    """An immutable snapshot of a ConfigFile.
+
+    All lookups are precomputed at creation: reading a value is a plain dict
+    lookup.
+
+    Attributes:
+        lines (ConfigLine tuple): the lines of the file, as written
+        sections (frozenset): names of the sections
+    """
+
+    def __init__(self, configfile):
+        self.lines = tuple(configfile)
+        self.sections = frozenset(configfile.sections)
+        self._first_values = {}
+        self._all_values = {}
+        self._items = {}
+        for name in self.sections:
+            index = configfile.section_index(name)
+            self._first_values[name] = dict(
+                (key, values[0]) for key, values in index.values.items())
+            self._all_values[name] = dict(
+                (key, tuple(values)) for key, values in index.values.items())
+            self._items[name] = tuple(configfile.items(name))
+        self._hash = hash(self.lines)
+
+    def __contains__(self, name):
+        """Check whether a given name is a known section."""
+        return name in self.sections
+
+    def items(self, section):
+        """Retrieve all key/value pairs for a given section."""
+        return iter(self._items.get(section, ()))
+
+    def get(self, section, key):
+        """Return the 'value' of all lines matching the section/key."""
+        return iter(self._all_values.get(section, {}).get(key, ()))
+
+    def get_one(self, section, key):
+        """Retrieve the first value for a section/key.
+
+        Raises:
+            KeyError: If no line match the given section/key.
+        """
+        try:
+            return self._first_values[section][key]
+        except KeyError:
+            raise KeyError("Key %s not found in %s" % (key, section))
+
+    def section_values(self, section, multi_value=False):
+        """Retrieve the (read-only) dict of a section's values.
+
+        With multi_value, each key maps to the tuple of all its values;
+        otherwise, to its first value.
+        """
+        values = self._all_values if multi_value else self._first_values
+        return values.get(section, {})
+
+    def thaw(self):
+        """Build a new, editable, ConfigFile from this snapshot."""
+        configfile = ConfigFile()
+        for line in self.lines:
+            configfile.handle_line(line)
+        return configfile
+
+    def __iter__(self):
+        return iter(self.lines)
+
+    def write(self, fd):
+        """Write to an open file-like object."""
+        for line in self.lines:
+            fd.write('%s\n' % line.text)
+
+    def __eq__(self, other):
+        if not isinstance(other, FrozenConfigFile):
+            return NotImplemented
+        return self._hash == other._hash and self.lines == other.lines
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return not equal
+
+    def __hash__(self):
+        return self._hash
+
+    def __repr__(self):
+        return '<FrozenConfigFile: %d lines>' % len(self.lines)
+
+
+class OverlayConfigFile(object):
+    """A config file stored as changes over a shared base ConfigFile.
+
+    Only lines added, updated or removed through the overlay are stored;
+    reads and :meth:`write` resolve them against the base. Many overlays may
+    share a single base.
+
+    The overlay reads from a :meth:`~ConfigFile.snapshot` of the base, taken
+    at creation: later updates of the base aren't visible.
+
+    Its read API matches the one of :class:`ConfigFile`: overlays may be
+    compared with :func:`~confutils.configdiff.diff`, exposed through
+    section views, and patched with :meth:`apply_patch`.
+    """
+
+    def __init__(self, base):
+        self._base = base.snapshot()
+        # id(block) => {index: ConfigLine, or None for removed lines}
+        # The blocks are kept alive, and never modified, by self._base.
+        self._replaced = {}
+        # id(block) => ConfigLine list, written after the lines of a base block
+        self._appended = {}
+        # section => ConfigLine list, for sections without blocks in the base
+        self._added = {}
+        # name => Section, built on first access to self.sections
+        self._sections = None
+        # Sections modified since self._sections was last refreshed
+        self._stale = set()
+        # Bumped on each update of the overlay
+        self.generation = 0
+        # section => number of updates, see section_generation()
+        self._section_generations = {}
+        self._fingerprint = None
+        self._fingerprint_generation = None
+
+    @property
+    def base(self):
+        """A snapshot of the base file; updating it doesn't affect the overlay."""
+        return self._base.snapshot()
+
+    def _make_line(self, key, value=None):
+        return ConfigLine(ConfigLine.KIND_DATA, key=key, value=value)
+
+    def _block_lines(self, block):
+        """Resolve the lines of a base block, with the lines appended to it."""
+        replaced = self._replaced.get(id(block))
+        if not replaced:
+            lines = list(block.lines)
+        else:
+            lines = []
+            for index, line in enumerate(block.lines):
+                line = replaced.get(index, line)
+                if line is not None:
+                    lines.append(line)
+        lines.extend(self._appended.get(id(block), ()))
+        return lines
+
+    def _resolve_block(self, block):
+        """Return the resolved version of a base block.
+
+        Untouched blocks are returned as is, sharing their cached digest.
+        """
+        if not self._replaced.get(id(block)) and not self._appended.get(id(block)):
+            return block
+        return SectionBlock(block.name, *self._block_lines(block))
+
+    def _resolve_section(self, name):
+        """Build the resolved Section of a name, or None if unknown."""
+        base_section = self._base.sections.get(name)
+        if base_section is None:
+            if name not in self._added:
+                return None
+            blocks = []
+        else:
+            blocks = [self._resolve_block(block) for block in base_section.ordered_blocks()]
+        if not blocks and name in self._added:
+            blocks = [SectionBlock(name, *self._added[name])]
+        section = Section(name)
+        section.blocks = blocks
+        return section
+
+    def _touch(self, section):
+        self._stale.add(section)
+        self.generation += 1
+        self._section_generations[section] = self._section_generations.get(section, 0) + 1
+
+    @property
+    def sections(self):
+        """Map section names to their resolved Section.
+
+        Sections untouched by the overlay are the ones of the base; others
+        are rebuilt after updates, sharing their unchanged blocks with the
+        base. They must not be modified.
+        """
+        if self._sections is None:
+            self._sections = dict(self._base.sections)
+        for name in self._stale:
+            section = self._resolve_section(name)
+            if section is not None:
+                self._sections[name] = section
+        self._stale.clear()
+        return self._sections
+
+    def __contains__(self, name):
+        """Check whether a given name is a known section."""
+        return name in self._base.sections or name in self._added
+
+    # Reading values
+    # ==============
+
+    def get_line(self, section, line):
+        """Retrieve all lines compatible with a given line."""
+        s = self.sections.get(section)
+        if s is None:
+            return []
+        return s.find_lines(line)
+
+    def _slots(self, section):
+        """Iterate over the lines of a section, in the order of Section.blocks.
+
+        Yields:
+            (slot, ConfigLine): the slot of a line may be passed to
+                :meth:`_store`; it is a (block id, index) pair for lines of the
+                base, and a (list, index) pair for lines added by the overlay.
+        """
+        s = self._base.sections.get(section)
+        if s is not None:
+            for block in s.blocks:
+                replaced = self._replaced.get(id(block), {})
+                for index, line in enumerate(block.lines):
+                    line = replaced.get(index, line)
+                    if line is not None:
+                        yield (id(block), index), line
+                appended = self._appended.get(id(block), ())
+                for index, line in enumerate(appended):
+                    if line is not None:
+                        yield (appended, index), line
+        added = self._added.get(section, ())
+        for index, line in enumerate(added):
+            if line is not None:
+                yield (added, index), line
+
+    def iter_lines(self, section):
+        """Iterate over all lines in a section."""
+        for _slot, line in self._slots(section):
+            yield line
+
+    def items(self, section):
+        """Retrieve all key/value pairs for a given section."""
+        for line in self.iter_lines(section):
+            if line.kind == ConfigLine.KIND_DATA:
+                yield line.key, line.value
+
+    def get(self, section, key):
+        """Return the 'value' of all lines matching the section/key."""
+        matcher = match_key(key)
+        for line in self.iter_lines(section):
+            if matcher(line):
+                yield line.value
+
+    def get_one(self, section, key):
+        """Retrieve the first value for a section/key.
+
+        Raises:
+            KeyError: If no line match the given section/key.
+        """
+        for value in self.get(section, key):
+            return value
+        raise KeyError("Key %s not found in %s" % (key, section))
+
+    def query(self, key_pattern, section_pattern='*'):
+        """Retrieve values whose section and key match glob patterns.
+
+        See :meth:`ConfigFile.query`.
+        """
+        return _query_sections(self.sections, key_pattern, section_pattern)
+
+    def section_index(self, section):
+        """Retrieve the SectionIndex of a section.
+
+        The index is cached until the section is modified; it must not be
+        altered by callers.
+        """
+        s = self.sections.get(section)
+        if s is None:
+            return SectionIndex()
+        return s.index()
+
+    def section_fingerprint(self, section):
+        """Return a hex digest of the lines of a section, or None if unknown.
+
+        See :meth:`Section.fingerprint`.
+        """
+        s = self.sections.get(section)
+        if s is None:
+            return None
+        return s.fingerprint()
+
+    def fingerprint(self):
+        """Return a hex digest of the content of the file.
+
+        It is equal to the fingerprint of :meth:`flatten`, and cached until
+        the overlay changes; the fingerprints of the sections it didn't
+        modify are the ones of the base.
+        """
+        if self._fingerprint is None or self._fingerprint_generation != self.generation:
+            self._fingerprint = _combine_fingerprints(
+                self._base.header.digest(),
+                _block_layout(self._written_blocks()),
+                self.sections)
+            self._fingerprint_generation = self.generation
+        return self._fingerprint
+
+    def section_generation(self, section):
+        """Return a token changing whenever the section's content changes.
+
+        Tokens can only be compared for equality.
+        """
+        if section not in self:
+            return None
+        return (self, section, self._section_generations.get(section, 0))
+
+    def section_view(self, section, multi_value=False):
+        view_class = MultiValuedSectionView if multi_value else SingleValuedSectionView
+        return view_class(self, section)
+
+    # Updating values
+    # ===============
+
+    def _store(self, slot, line):
+        """Replace (or remove, if line is None) the line of a slot.
+
+        Removed lines added by the overlay are left as None until
+        :meth:`_compact` is called.
+        """
+        store, index = slot
+        if isinstance(store, list):
+            store[index] = line
+        else:
+            self._replaced.setdefault(store, {})[index] = line
+
+    def _compact(self, section):
+        """Drop the removed lines from those added to a section."""
+        s = self._base.sections.get(section)
+        lists = [self._appended.get(id(block)) for block in s.blocks] if s is not None else []
+        lists.append(self._added.get(section))
+        for lines in lists:
+            if lines and None in lines:
+                lines[:] = [line for line in lines if line is not None]
+
+    def _edit(self, section, predicate, new_line, once=False):
+        """Replace (or remove, if new_line is None) lines matching a predicate."""
+        nb = 0
+        for slot, line in self._slots(section):
+            if predicate(line):
+                self._store(slot, new_line)
+                nb += 1
+                if once:
+                    break
+        if nb:
+            if new_line is None:
+                self._compact(section)
+            self._touch(section)
+        return nb
+
+    def _insert(self, section, line):
+        """Add a line where ConfigFile would: see :meth:`Section.insert`.
+
+        The line goes at the end of the first block holding a matching line,
+        or else of the last block of the section.
+        """
+        s = self._base.sections.get(section)
+        if s is None or not s.blocks:
+            self._added.setdefault(section, []).append(line)
+            return
+        matcher = line.matcher()
+        target = s.blocks[-1]
+        for block in s.blocks:
+            if any(matcher(block_line) for block_line in self._block_lines(block)):
+                target = block
+                break
+        self._appended.setdefault(id(target), []).append(line)
+
+    def add(self, section, key, value):
+        """Add a line to a section, placed as by :meth:`ConfigFile.add`."""
+        self._insert(section, self._make_line(key, value))
+        self._touch(section)
+
+    def update(self, section, key, new_value, old_value=None, once=False):
+        """Replace the value of matching lines.
+
+        Returns:
+            int: Number of updated lines.
+        """
+        matcher = match_key(key, old_value)
+        return self._edit(section, matcher, self._make_line(key, new_value), once=once)
+
+    def add_or_update(self, section, key, value):
+        """Update the key or, if no previous value existed, add it.
+
+        Returns:
+            int: Number of updated lines.
+        """
+        updates = self.update(section, key, value)
+        if updates == 0:
+            self.add(section, key, value)
+        return updates
+
+    def remove(self, section, key, value=None):
+        """Remove matching lines.
+
+        Returns:
+            int: Number of removed lines.
+        """
+        return self._edit(section, match_key(key, value), None)
+
+    def replace_values(self, section, values_by_key):
+        """Set the values of several keys of a section.
+
+        Lines whose value is still listed are kept; other lines for those keys
+        are removed, and new values are added at the end of the section.
+
+        Args:
+            values_by_key (dict(key => value list)): the new values
+
+        Returns:
+            int: the number of lines removed or added
+        """
+        nb = 0
+        for key, values in values_by_key.items():
+            matcher = match_key(key)
+            expected = frozenset(values)
+            nb += self._edit(section,
+                lambda line: matcher(line) and line.value not in expected, None)
+            seen = set(self.get(section, key))
+            for value in values:
+                if value not in seen:
+                    seen.add(value)
+                    self.add(section, key, value)
+                    nb += 1
+        return nb
+
+    def _set_values(self, section, key, values):
+        """Set the n-th value of a key to values[n], editing lines in place.
+
+        Extra lines are removed; extra values are inserted after the last
+        line of the key, as by :meth:`Section.patch_values`.
+        """
+        matcher = match_key(key)
+        remaining = list(values)
+        nb = 0
+        last = None
+        for slot, line in self._slots(section):
+            if not matcher(line):
+                continue
+            last = slot
+            if remaining and remaining[0] == line.value:
+                remaining.pop(0)
+                continue
+            self._store(slot, self._make_line(key, remaining.pop(0)) if remaining else None)
+            nb += 1
+
+        if remaining:
+            lines = [self._make_line(key, value) for value in remaining]
+            if last is None:
+                for line in lines:
+                    self._insert(section, line)
+            elif isinstance(last[0], list):
+                last[0][last[1] + 1:last[1] + 1] = lines
+            else:
+                # Lines can't be inserted between those of a base block:
+                # put them first among the lines appended to it.
+                self._appended.setdefault(last[0], [])[:0] = lines
+            nb += len(remaining)
+        if nb:
+            self._compact(section)
+            self._touch(section)
+        return nb
+
+    def apply_patch(self, patch):
+        """Apply a patch to the overlay; the base is left untouched.
+
+        All entries are first checked against the current values; nothing is
+        modified if any of them conflicts. As with
+        :meth:`ConfigFile.apply_patch`, the n-th line of a key is replaced by
+        its n-th new value; new values beyond the current lines follow the
+        last line of the key (or, if it comes from the base, the end of its
+        block).
+
+        Args:
+            patch (iterable): (section, key, old_values, new_values) entries,
+                such as a :class:`~configdiff.Patch`
+
+        Returns:
+            int: the number of lines added, updated or removed
+
+        Raises:
+            PatchConflict: if the values of a section/key differ from the
+                entry's old_values
+        """
+        entries = list(patch)
+        conflicts = []
+        for entry in entries:
+            section, key, old_values, _new_values = entry
+            current = self.section_index(section).values.get(key, [])
+            if list(current) != list(old_values):
+                conflicts.append((entry, list(current)))
+        if conflicts:
+            raise PatchConflict(conflicts)
+
+        return sum(
+            self._set_values(section, key, new_values)
+            for section, key, _old_values, new_values in entries)
+
+    # Regenerating file
+    # =================
+
+    def _written_blocks(self):
+        """Iterate over the resolved blocks, in written order."""
+        blocks = list(self._base.blocks)
+        blocks.extend(
+            section.extra_block for section in self._base.sections.values()
+            if section.extra_block is not None)
+        names = set()
+        for block in blocks:
+            names.add(block.name)
+            yield self._resolve_block(block)
+
+        for name, lines in self._added.items():
+            if name not in names:
+                yield SectionBlock(name, *lines)
+
+    def __iter__(self):
+        for line in self._base.header:
+            yield line
+
+        for block in self._written_blocks():
+            if not block:
+                continue
+            yield block.header_line()
+            for line in block.lines:
+                yield line
+
+    def write(self, fd):
+        """Write to an open file-like object."""
+        for line in self:
+            fd.write('%s\n' % line.text)
+
+    def flatten(self):
+        """Build a standalone ConfigFile with the resolved content."""
+        configfile = ConfigFile()
+        for line in self._base.header:
+            configfile.insert_line(line)
+        for block in self._written_blocks():
+            configfile.enter_block(block.name)
+            for line in block.lines:
+                configfile.insert_line(line)
+        return configfile
+
+    def freeze(self):
+        """Return an immutable, read-optimized FrozenConfigFile snapshot."""
+        return FrozenConfigFile(self)
+
+    def __repr__(self):
+        return '<OverlayConfigFile: %d replaced, %d added lines>' % (
+            sum(len(replaced) for replaced in self._replaced.values()),
+            sum(len(lines) for lines in self._appended.values())
+            + sum(len(lines) for lines in self._added.values()))
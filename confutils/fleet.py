@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+# This code is distributed under the two-clause BSD license.
+# Copyright (c) 2012-2013 Raphaël Barrois
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+
+"""Index a tree of config files into a persistent, searchable database.
+
+The index is a SQLite file mapping (section, key) and values to the files
+and line numbers where they appear. Updating it only parses files whose
+modification time or size changed since the previous run::
+
+    index = FleetIndex('configs.db')
+    index.update('/etc/hosts.d')
+    index.find(key='legacy_mode')  # => [FleetEntry(path=..., lineno=12, ...)]
+
+It is also available from the command line::
+
+    python -m confutils.fleet configs.db update /etc/hosts.d --pattern '*.conf'
+    python -m confutils.fleet configs.db find --key 'legacy_*'
+"""
+
+
+import argparse
+import collections
+import fnmatch
+import io
+import os
+import sqlite3
+import sys
+
+from .configfile import ConfigLine, Parser, glob_prefix
+
+
+FleetEntry = collections.namedtuple('FleetEntry',
+    ['path', 'lineno', 'section', 'key', 'value'])
+
+FleetUpdate = collections.namedtuple('FleetUpdate',
+    ['indexed', 'unchanged', 'removed', 'errors'])
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    mtime INTEGER NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS entries (
+    file_id INTEGER NOT NULL REFERENCES files(id),
+    lineno INTEGER NOT NULL,
+    section TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_section_key ON entries(section, key);
+CREATE INDEX IF NOT EXISTS entries_key ON entries(key);
+CREATE INDEX IF NOT EXISTS entries_value ON entries(value);
+CREATE INDEX IF NOT EXISTS entries_file ON entries(file_id);
+"""
+
+
+def read_entries(path, parser=None):
+    """Extract (lineno, section, key, value) tuples from a config file.
+
+    Line numbers start at 1; data lines before the first section are ignored,
+    as in ConfigFile.items().
+    """
+    parser = parser or Parser()
+    section = None
+    entries = []
+    with io.open(path, 'rt', encoding='utf-8') as f:
+        for rank, line in enumerate(parser.parse(f, name_hint=path)):
+            if line.kind == ConfigLine.KIND_HEADER:
+                section = line.header
+            elif line.kind == ConfigLine.KIND_DATA and section is not None:
+                entries.append((rank + 1, section, line.key, line.value))
+    return entries
+
+
+def _stat(path):
+    stat = os.stat(path)
+    mtime = getattr(stat, 'st_mtime_ns', None)
+    if mtime is None:  # Python 2
+        mtime = int(stat.st_mtime * 1e9)
+    return mtime, stat.st_size
+
+
+class FleetIndex(object):
+    """A persistent index of the entries of many config files.
+
+    Attributes:
+        path (str): the SQLite database file (':memory:' for a transient one)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+
+    def _remove_file(self, file_id):
+        self.connection.execute('DELETE FROM entries WHERE file_id = ?', (file_id,))
+        self.connection.execute('DELETE FROM files WHERE id = ?', (file_id,))
+
+    def update(self, root, pattern='*'):
+        """Index all files below ``root`` whose name matches ``pattern``.
+
+        Files unchanged since the last update are skipped; files which
+        disappeared from ``root`` are dropped from the index.
+
+        Returns:
+            FleetUpdate: the number of files indexed, unchanged and removed,
+            and a list of (path, error message) for unreadable files.
+        """
+        root = os.path.abspath(root)
+        known = dict(
+            (path, (file_id, mtime, size))
+            for file_id, path, mtime, size in self.connection.execute(
+                'SELECT id, path, mtime, size FROM files'))
+
+        indexed = unchanged = 0
+        errors = []
+        seen = set()
+        with self.connection:
+            for dirpath, _dirnames, filenames in os.walk(root):
+                for filename in filenames:
+                    if not fnmatch.fnmatch(filename, pattern):
+                        continue
+                    path = os.path.join(dirpath, filename)
+                    seen.add(path)
+                    try:
+                        mtime, size = _stat(path)
+                    except OSError as e:
+                        errors.append((path, str(e)))
+                        continue
+
+                    previous = known.get(path)
+                    if previous is not None and previous[1:] == (mtime, size):
+                        unchanged += 1
+                        continue
+
+                    try:
+                        entries = read_entries(path)
+                    except (IOError, OSError, ValueError) as e:
+                        # Unreadable or invalid: keep the previous entries.
+                        errors.append((path, str(e)))
+                        continue
+
+                    if previous is not None:
+                        self._remove_file(previous[0])
+                    cursor = self.connection.execute(
+                        'INSERT INTO files (path, mtime, size) VALUES (?, ?, ?)',
+                        (path, mtime, size))
+                    file_id = cursor.lastrowid
+                    self.connection.executemany(
+                        'INSERT INTO entries (file_id, lineno, section, key, value) VALUES (?, ?, ?, ?, ?)',
+                        [(file_id,) + entry for entry in entries])
+                    indexed += 1
+
+            removed = 0
+            prefix = os.path.join(root, '')
+            for path, (file_id, _mtime, _size) in known.items():
+                if path.startswith(prefix) and path not in seen:
+                    self._remove_file(file_id)
+                    removed += 1
+
+        return FleetUpdate(indexed, unchanged, removed, errors)
+
+    def find(self, section=None, key=None, value=None):
+        """Find entries by section, key and/or value.
+
+        Each criterion is either an exact string, or a glob pattern
+        (``legacy_*``).
+
+        Returns:
+            FleetEntry list, sorted by path and line number
+        """
+        clauses = []
+        params = []
+        for column, criterion in (('section', section), ('key', key), ('value', value)):
+            if criterion is None:
+                continue
+            operator = '=' if glob_prefix(criterion) == criterion else 'GLOB'
+            clauses.append('entries.%s %s ?' % (column, operator))
+            params.append(criterion)
+
+        query = ('SELECT files.path, entries.lineno, entries.section, entries.key, entries.value'
+            ' FROM entries JOIN files ON files.id = entries.file_id')
+        if clauses:
+            query += ' WHERE ' + ' AND '.join(clauses)
+        query += ' ORDER BY files.path, entries.lineno'
+        return [FleetEntry(*row) for row in self.connection.execute(query, params)]
+
+    def files(self):
+        """List the indexed files, sorted."""
+        return [path for (path,) in self.connection.execute('SELECT path FROM files ORDER BY path')]
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __repr__(self):
+        return '<FleetIndex: %s>' % self.path
+
+
+def main(argv=None, stdout=None):
+    """Command line entry point."""
+    stdout = stdout or sys.stdout
+    parser = argparse.ArgumentParser(prog='python -m confutils.fleet',
+        description="Index and search many config files.")
+    parser.add_argument('database', help="the index file")
+    commands = parser.add_subparsers(dest='command')
+
+    update_parser = commands.add_parser('update', help="index a directory tree")
+    update_parser.add_argument('root')
+    update_parser.add_argument('--pattern', default='*', help="file names to index (glob)")
+
+    find_parser = commands.add_parser('find', help="search the index")
+    find_parser.add_argument('--section', help="exact section name, or glob")
+    find_parser.add_argument('--key', help="exact key, or glob")
+    find_parser.add_argument('--value', help="exact value, or glob")
+
+    args = parser.parse_args(argv)
+    if args.command is None:
+        parser.error("A command is required.")
+
+    with FleetIndex(args.database) as index:
+        if args.command == 'update':
+            result = index.update(args.root, pattern=args.pattern)
+            for path, message in result.errors:
+                print("%s: %s" % (path, message), file=sys.stderr)
+            print("%d indexed, %d unchanged, %d removed, %d errors" % (
+                result.indexed, result.unchanged, result.removed, len(result.errors)), file=stdout)
+            return 1 if result.errors else 0
+
+        for entry in index.find(section=args.section, key=args.key, value=args.value):
+            print("%s:%d: [%s] %s: %s" % entry, file=stdout)
+        return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
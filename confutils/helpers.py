@@ -2,6 +2,14 @@
 # This code is distributed under the two-clause BSD license.
 # Copyright (c) 2012-2013 Raphaël Barrois
 
+import functools
+import threading
+
+try:
+    from threading import get_ident
+except ImportError:  # pragma: no cover
+    from thread import get_ident
+
 
 class DictMixin(object):
     """Help implementing dict-like classes from a limited set of methods.
@@ -78,3 +86,158 @@ class DictMixin(object):
     def values(self):
         return list(self.itervalues())
 
+
+class RWLock(object):
+    """A reentrant readers/writer lock.
+
+    Any number of threads may hold the lock for reading, or a single thread
+    for writing. Waiting writers have precedence over new readers.
+
+    A thread holding the lock may acquire it again for reading; the writer
+    may also acquire it again for writing. Upgrading a read lock to a write
+    lock is not supported.
+
+    While no writer holds or waits for the lock, readers don't touch the
+    underlying mutex: they register in a dict keyed by thread id, then check
+    again that no writer arrived in the meantime. Writers count themselves
+    before checking for registered readers, so that either side always sees
+    the other.
+    """
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        # thread id => depth of its read locks
+        self._readers = {}
+        # Number of writers holding or waiting for the lock
+        self._writers = 0
+        self._writer = None
+        self._writer_depth = 0
+        # Read locks taken by the writer, which don't count as readers
+        self._writer_reads = 0
+
+    def acquire_read(self, me=None):
+        if me is None:
+            me = get_ident()
+        depth = self._readers.get(me)
+        if depth:
+            self._readers[me] = depth + 1
+            return
+        if self._writer == me:
+            self._writer_reads += 1
+            return
+
+        # Fast path: no writer around.
+        if not self._writers:
+            self._readers[me] = 1
+            if not self._writers:
+                return
+            # A writer came in: step back, and let it proceed.
+            self._step_back(me)
+
+        with self._cond:
+            while self._writers:
+                self._cond.wait()
+            self._readers[me] = 1
+
+    def _step_back(self, me):
+        """Unregister a reader which found a writer after registering."""
+        with self._cond:
+            del self._readers[me]
+            self._cond.notify_all()
+
+    def _wake(self):
+        with self._cond:
+            self._cond.notify_all()
+
+    def release_read(self, me=None):
+        if me is None:
+            me = get_ident()
+        depth = self._readers.get(me)
+        if depth is None:
+            if self._writer == me and self._writer_reads:
+                self._writer_reads -= 1
+                return
+            raise RuntimeError("Cannot release an unacquired read lock.")
+        if depth > 1:
+            self._readers[me] = depth - 1
+            return
+
+        del self._readers[me]
+        if self._writers:
+            self._wake()
+
+    def acquire_write(self):
+        me = get_ident()
+        if self._writer == me:
+            self._writer_depth += 1
+            return
+        if me in self._readers:
+            raise RuntimeError("Cannot upgrade a read lock to a write lock.")
+
+        with self._cond:
+            self._writers += 1
+            try:
+                while self._writer is not None or self._readers:
+                    self._cond.wait()
+            except BaseException:
+                self._writers -= 1
+                self._cond.notify_all()
+                raise
+            self._writer = me
+            self._writer_depth = 1
+
+    def release_write(self):
+        if self._writer != get_ident():
+            raise RuntimeError("Cannot release a write lock held by another thread.")
+        self._writer_depth -= 1
+        if self._writer_depth:
+            return
+
+        with self._cond:
+            self._writer = None
+            self._writers -= 1
+            self._cond.notify_all()
+
+
+def read_locked(method):
+    """Run a method under the read lock of its object's ``lock`` RWLock.
+
+    The uncontended path of :meth:`RWLock.acquire_read` and
+    :meth:`RWLock.release_read` is inlined: most calls only register the
+    thread in the lock's dict of readers, and unregister it.
+    """
+    ident = get_ident
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        lock = self.lock
+        me = ident()
+        readers = lock._readers
+        if not lock._writers and me not in readers:
+            readers[me] = 1
+            if not lock._writers:
+                try:
+                    return method(self, *args, **kwargs)
+                finally:
+                    del readers[me]
+                    if lock._writers:
+                        lock._wake()
+            lock._step_back(me)
+
+        lock.acquire_read(me)
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            lock.release_read(me)
+    return wrapper
+
+
+def read_locked_iter(method):
+    """Like :func:`read_locked`, for methods returning an iterator.
+
+    Since locks can't be held across yields, the iterator is consumed under
+    the lock, and an iterator over the list of results is returned.
+    """
+    @functools.wraps(method)
+    def consume(self, *args, **kwargs):
+        return iter(list(method(self, *args, **kwargs)))
+    return read_locked(consume)
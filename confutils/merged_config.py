@@ -77,17 +77,136 @@ class DictNamespace(dict):
 class MergedConfig(object):
     """A merged configuration holder.
 
-    Merges options from a set of dicts."""
+    Merges options from a set of dicts.
+
+    Callers may :meth:`subscribe` to a key; they will be notified whenever
+    adding, replacing or reloading an option group changes the value for that
+    key.
+    """
 
     def __init__(self, *options, **kwargs):
         self.options = []
+        # The mappings provided by callers, normalized again on reload
+        self._sources = []
+        # normalized key => value, for each option group, as of the last refresh
+        self._layer_values = []
+        self._subscriptions = {}
         for option in options:
             self.add_options(option)
 
     def add_options(self, options, normalize=True):
+        self._sources.append((options, normalize))
         if normalize:
             options = NormalizedDict(options)
         self.options.append(options)
+        self._layer_values.append(self._values_of(options, normalize))
+        self._refresh(self._layer_values[-1])
+
+    def replace_options(self, index, options, normalize=True):
+        """Replace the option group at the given index."""
+        self._sources[index] = (options, normalize)
+        if normalize:
+            options = NormalizedDict(options)
+        old_values = self._layer_values[index]
+        self.options[index] = options
+        self._layer_values[index] = self._values_of(options, normalize)
+        self._refresh(self._changed_keys(old_values, self._layer_values[index]))
+
+    def reload_options(self, index):
+        """Signal that the option group at the given index has been modified.
+
+        The mapping passed to :meth:`add_options` (or :meth:`replace_options`)
+        is read again, and normalized if it was at the time.
+
+        Subscribers to keys whose value was added, removed or changed in that
+        group are notified if their (merged) value changed.
+        """
+        source, normalize = self._sources[index]
+        if normalize:
+            # Update the normalized copy in place, with changed keys only
+            options = self.options[index]
+            changed = set()
+            seen = set()
+            for key, value in source.items():
+                key = normalize_key(key)
+                seen.add(key)
+                if key not in options or not options[key] == value:
+                    options[key] = value
+                    changed.add(key)
+            for key in [key for key in options if key not in seen]:
+                del options[key]
+                changed.add(key)
+        else:
+            old_values = self._layer_values[index]
+            self._layer_values[index] = self._values_of(source, normalize)
+            changed = self._changed_keys(old_values, self._layer_values[index])
+        self._refresh(changed)
+
+    def _values_of(self, options, normalize):
+        """Map normalized keys to values; normalized groups are their own copy."""
+        if normalize:
+            return options
+        return dict((normalize_key(key), value) for key, value in options.items())
+
+    def _changed_keys(self, old_values, new_values):
+        """Keys added, removed, or whose value changed, between two groups."""
+        changed = set(key for key in new_values if key not in old_values)
+        for key, value in old_values.items():
+            if key not in new_values or not new_values[key] == value:
+                changed.add(key)
+        return changed
+
+    # Subscriptions
+    # =============
+
+    def subscribe(self, key, callback):
+        """Register a callback for changes of a key.
+
+        The callback will be called as ``callback(key, old_value, new_value)``,
+        with the normalized key; a missing value is reported as
+        :class:`NoDefault`.
+        """
+        key = normalize_key(key)
+        try:
+            subscription = self._subscriptions[key]
+        except KeyError:
+            subscription = self._subscriptions[key] = [self.get(key), []]
+        subscription[1].append(callback)
+
+    def unsubscribe(self, key, callback):
+        """Remove a callback registered through :meth:`subscribe`.
+
+        Raises:
+            KeyError: if the callback wasn't registered for the key.
+        """
+        key = normalize_key(key)
+        try:
+            callbacks = self._subscriptions[key][1]
+            callbacks.remove(callback)
+        except (KeyError, ValueError):
+            raise KeyError("No subscription for %r on %r" % (callback, key))
+        if not callbacks:
+            del self._subscriptions[key]
+
+    def _refresh(self, keys):
+        """Recompute subscribed keys among ``keys``, and notify changes."""
+        if not self._subscriptions:
+            return
+
+        if len(keys) > len(self._subscriptions):
+            keys = [key for key in self._subscriptions if key in keys]
+        else:
+            keys = [key for key in keys if key in self._subscriptions]
+
+        for key in keys:
+            subscription = self._subscriptions[key]
+            old_value = subscription[0]
+            new_value = self.get(key)
+            if new_value == old_value:
+                continue
+            subscription[0] = new_value
+            for callback in list(subscription[1]):
+                callback(key, old_value, new_value)
 
     def get(self, key, default=NoDefault):
         """Retrieve a value from its key.
@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+# This code is distributed under the two-clause BSD license.
+# Copyright (c) 2012-2013 Raphaël Barrois
+
+from __future__ import absolute_import, unicode_literals
+
+
+"""Declarative, typed access to configuration values.
+
+A :class:`Schema` lists the expected options, with their type and default;
+compiling it against a :class:`~merged_config.MergedConfig` or a section view
+returns an accessor exposing converted values as attributes::
+
+    schema = Schema(
+        Option('workers', int, default=4),
+        Option('timeout', 'duration', default=datetime.timedelta(seconds=30)),
+    )
+    options = schema.compile(merged)
+    options.workers  # => 4
+
+Converted values are cached until the underlying data changes.
+"""
+
+
+import datetime
+import re
+
+from .configfile import ConfigError
+from .merged_config import MergedConfig, NoDefault, normalize_key
+
+
+def to_bool(value):
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in ('1', 'true', 'yes', 'on'):
+        return True
+    elif text in ('0', 'false', 'no', 'off', ''):
+        return False
+    raise ValueError("Invalid boolean %r" % value)
+
+
+def to_list(value):
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+DURATION_UNITS = {
+    'ms': 0.001,
+    's': 1,
+    'm': 60,
+    'h': 3600,
+    'd': 86400,
+    'w': 604800,
+}
+
+re_duration = re.compile(r'^\s*(\d+(?:\.\d*)?)\s*(ms|s|m|h|d|w)?\s*$')
+
+
+def to_duration(value):
+    """Convert a duration ('30s', '5m', '1.5h', '100ms'...) to a timedelta.
+
+    Numbers without a unit are seconds.
+    """
+    if isinstance(value, datetime.timedelta):
+        return value
+    elif isinstance(value, (int, float)):
+        return datetime.timedelta(seconds=value)
+
+    match = re_duration.match(value)
+    if not match:
+        raise ValueError("Invalid duration %r" % value)
+    amount, unit = match.groups()
+    return datetime.timedelta(seconds=float(amount) * DURATION_UNITS[unit or 's'])
+
+
+CONVERTERS = {
+    'str': lambda value: value,
+    'int': int,
+    'float': float,
+    'bool': to_bool,
+    'list': to_list,
+    'duration': to_duration,
+}
+
+
+class Option(object):
+    """A typed option.
+
+    Attributes:
+        name (str): the attribute name on compiled accessors
+        type (str): the name of a converter from CONVERTERS
+        default (object): returned, as is, if no value is set
+        key (str): the key to look up; defaults to the name
+    """
+
+    def __init__(self, name, type='str', default=NoDefault, key=None):
+        type = getattr(type, '__name__', type)
+        if type not in CONVERTERS:
+            raise ValueError("Unknown option type %r for %s" % (type, name))
+        self.name = name
+        self.type = type
+        self.default = default
+        self.key = key or name
+        self.convert = CONVERTERS[type]
+
+    def __repr__(self):
+        return 'Option(%r, %r, default=%r)' % (self.name, self.type, self.default)
+
+
+class Schema(object):
+    """A set of options, to be compiled against a config source."""
+
+    def __init__(self, *options):
+        self.options = dict((option.name, option) for option in options)
+
+    def compile(self, source):
+        """Build an accessor for a source.
+
+        Args:
+            source: a MergedConfig, or a section view from a ConfigFile.
+        """
+        if isinstance(source, MergedConfig):
+            return MergedConfigAccessor(self, source)
+        return SectionAccessor(self, source)
+
+    def __repr__(self):
+        return 'Schema(%s)' % ', '.join(repr(o) for o in self.options.values())
+
+
+class BaseAccessor(object):
+    """Exposes options of a schema as attributes.
+
+    Internal attributes are underscore-prefixed to avoid clashing with
+    option names.
+    """
+
+    def __init__(self, schema, source):
+        self._schema = schema
+        self._source = source
+
+    def _lookup(self, key):
+        raise NotImplementedError()
+
+    def _fetch(self, name):
+        """Retrieve and convert the value for an option."""
+        try:
+            option = self._schema.options[name]
+        except KeyError:
+            raise AttributeError("No option %r in %r" % (name, self._schema))
+
+        value = self._lookup(option.key)
+        if value is NoDefault:
+            if option.default is NoDefault:
+                raise ConfigError("No value for option %s." % name)
+            return option.default
+
+        try:
+            return option.convert(value)
+        except (TypeError, ValueError) as e:
+            raise ConfigError("Invalid value %r for option %s: %s" % (value, name, e))
+
+    def __repr__(self):
+        return '<%s: %r>' % (self.__class__.__name__, self._source)
+
+
+class MergedConfigAccessor(BaseAccessor):
+    """Accessor over a MergedConfig.
+
+    Converted values are stored as plain instance attributes, and dropped when
+    the MergedConfig notifies a change of their key.
+    """
+
+    def __init__(self, schema, source):
+        super(MergedConfigAccessor, self).__init__(schema, source)
+        self._names = {}
+        for option in schema.options.values():
+            key = normalize_key(option.key)
+            if key not in self._names:
+                self._names[key] = []
+                source.subscribe(key, self._invalidate)
+            self._names[key].append(option.name)
+
+    def _lookup(self, key):
+        return self._source.get(key)
+
+    def _invalidate(self, key, old_value, new_value):
+        for name in self._names.get(key, ()):
+            self.__dict__.pop(name, None)
+
+    def _detach(self):
+        """Stop tracking changes of the MergedConfig."""
+        for key in self._names:
+            self._source.unsubscribe(key, self._invalidate)
+        self._names = {}
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        value = self._fetch(name)
+        setattr(self, name, value)
+        return value
+
+
+class SectionAccessor(BaseAccessor):
+    """Accessor over a section view.
+
+    The cache is dropped whenever the section is modified.
+    """
+
+    def __init__(self, schema, source):
+        super(SectionAccessor, self).__init__(schema, source)
+        self._cache = {}
+        self._generation = None
+
+    def _lookup(self, key):
+        return self._source.get(key, NoDefault)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        generation = self._source.configfile.section_generation(self._source.name)
+        if generation != self._generation:
+            self._cache.clear()
+            self._generation = generation
+
+        try:
+            return self._cache[name]
+        except KeyError:
+            value = self._cache[name] = self._fetch(name)
+            return value
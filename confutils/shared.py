@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+# This code is distributed under the two-clause BSD license.
+# Copyright (c) 2012-2013 Raphaël Barrois
+
+from __future__ import absolute_import, unicode_literals
+
+
+"""Share a parsed configuration between processes.
+
+A :class:`SharedConfigPublisher` writes the :class:`~compact.CompactConfig`
+layout of a config into a ``multiprocessing.shared_memory`` segment; any
+process may then open a :class:`SharedConfigReader` on the same name and read
+it in place, without parsing nor unpickling::
+
+    # Master
+    publisher = SharedConfigPublisher('myapp-config')
+    publisher.publish(configfile)
+
+    # Workers
+    reader = SharedConfigReader('myapp-config')
+    reader.current().get_one('server', 'port')
+
+Each call to :meth:`~SharedConfigPublisher.publish` writes a new generation in
+its own segment, then switches a small control segment to it: readers pick up
+complete generations only.
+
+Requires Python 3.8+.
+"""
+
+
+import struct
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # pragma: no cover
+    shared_memory = None
+
+from .compact import ARRAY_TYPECODE, CompactConfig, StringTable
+from .configfile import ConfigError
+
+
+MAGIC = b'CFU1'
+
+# Control segment: magic, current generation
+CONTROL = struct.Struct(str('=4s4xQ'))
+
+# Data segment header: magic, generation, array item size, blob size,
+# number of strings, sections, entries and lines
+HEADER = struct.Struct(str('=4s4xQQQQQQQ'))
+
+
+class SharedConfigError(ConfigError):
+    """Errors encountered when publishing or reading a shared config."""
+
+
+def _check_available():
+    if shared_memory is None:  # pragma: no cover
+        raise SharedConfigError("Shared configs require multiprocessing.shared_memory (Python 3.8+).")
+
+
+def _attach(name):
+    """Attach to an existing segment, leaving its cleanup to the publisher.
+
+    Before Python 3.13, attached segments are always registered with the
+    resource tracker; processes started through multiprocessing share the
+    publisher's tracker, which only unlinks leftover segments on shutdown.
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:  # Python < 3.13
+        return shared_memory.SharedMemory(name=name)
+
+
+def _segment_name(name, generation):
+    return '%s_%d' % (name, generation)
+
+
+def _align(size, itemsize):
+    return size + (-size % itemsize)
+
+
+def write_segment(name, generation, compact):
+    """Write a CompactConfig into a new shared memory segment."""
+    strings = compact.strings
+    blob = bytes(strings.blob)
+    arrays = [
+        strings.offsets,
+        compact.section_ids,
+        compact.entry_sections,
+        compact.entry_keys,
+        compact.entry_values,
+        compact.item_order,
+        compact.text_ids,
+    ]
+    itemsize = compact.strings.offsets.itemsize
+    size = _align(HEADER.size + len(blob), itemsize)
+    size += sum(len(a) for a in arrays) * itemsize
+
+    segment = shared_memory.SharedMemory(name=name, create=True, size=size)
+    buf = segment.buf
+    HEADER.pack_into(buf, 0, MAGIC, generation, itemsize, len(blob),
+        len(strings), len(compact.section_ids), len(compact.entry_keys),
+        len(compact.text_ids))
+    position = HEADER.size
+    buf[position:position + len(blob)] = blob
+    position = _align(position + len(blob), itemsize)
+    for values in arrays:
+        raw = values.tobytes()
+        buf[position:position + len(raw)] = raw
+        position += len(raw)
+    return segment
+
+
+def read_segment(segment, generation=None):
+    """Build a CompactConfig reading from a shared memory segment in place."""
+    buf = segment.buf
+    (magic, segment_generation, itemsize, blob_size, nb_strings, nb_sections,
+        nb_entries, nb_lines) = HEADER.unpack_from(buf, 0)
+    if magic != MAGIC:
+        raise SharedConfigError("Invalid shared config segment %s." % segment.name)
+    if generation is not None and generation != segment_generation:
+        raise SharedConfigError("Segment %s holds generation %d instead of %d." % (
+            segment.name, segment_generation, generation))
+    if itemsize != struct.calcsize(ARRAY_TYPECODE):
+        raise SharedConfigError("Segment %s was written by an incompatible platform." % segment.name)
+
+    position = HEADER.size
+    blob = buf[position:position + blob_size]
+    position = _align(position + blob_size, itemsize)
+
+    arrays = []
+    for length in (nb_strings + 1, nb_sections, nb_entries, nb_entries,
+            nb_entries, nb_entries, nb_lines):
+        end = position + length * itemsize
+        arrays.append(buf[position:end].cast(ARRAY_TYPECODE))
+        position = end
+
+    offsets, section_ids, entry_sections, entry_keys, entry_values, item_order, text_ids = arrays
+    return CompactConfig(
+        strings=StringTable(blob, offsets),
+        section_ids=section_ids,
+        entry_sections=entry_sections,
+        entry_keys=entry_keys,
+        entry_values=entry_values,
+        item_order=item_order,
+        text_ids=text_ids,
+    )
+
+
+class SharedConfigPublisher(object):
+    """Publish successive generations of a config under a name.
+
+    Attributes:
+        name (str): the name of the control segment
+        generation (int): the last published generation
+    """
+
+    def __init__(self, name):
+        _check_available()
+        self.name = name
+        self.generation = 0
+        self.control = shared_memory.SharedMemory(name=name, create=True, size=CONTROL.size)
+        CONTROL.pack_into(self.control.buf, 0, MAGIC, 0)
+        self._segment = None
+
+    def publish(self, config):
+        """Publish a new generation.
+
+        Args:
+            config (ConfigFile or CompactConfig): the config to publish
+
+        Returns:
+            int: the new generation
+        """
+        if not isinstance(config, CompactConfig):
+            config = CompactConfig.from_configfile(config)
+
+        generation = self.generation + 1
+        segment = write_segment(_segment_name(self.name, generation), generation, config)
+        CONTROL.pack_into(self.control.buf, 0, MAGIC, generation)
+
+        previous, self._segment = self._segment, segment
+        self.generation = generation
+        if previous is not None:
+            # Readers already attached keep their mapping.
+            previous.close()
+            previous.unlink()
+        return generation
+
+    def close(self):
+        """Stop publishing, and remove all segments."""
+        for segment in (self._segment, self.control):
+            if segment is not None:
+                segment.close()
+                segment.unlink()
+        self._segment = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __repr__(self):
+        return '<SharedConfigPublisher: %s@%d>' % (self.name, self.generation)
+
+
+class SharedConfigReader(object):
+    """Read the latest generation published under a name.
+
+    Attributes:
+        name (str): the name of the control segment
+        generation (int): the generation currently attached
+    """
+
+    max_attempts = 10
+
+    def __init__(self, name):
+        _check_available()
+        self.name = name
+        self.generation = None
+        self.control = _attach(name)
+        self._config = None
+        self._segment = None
+        self._retired = []
+
+    def _published_generation(self):
+        magic, generation = CONTROL.unpack_from(self.control.buf, 0)
+        if magic != MAGIC:
+            raise SharedConfigError("Invalid shared config control segment %s." % self.name)
+        return generation
+
+    def current(self):
+        """Return the latest published CompactConfig.
+
+        Raises:
+            SharedConfigError: if nothing has been published yet.
+        """
+        for _attempt in range(self.max_attempts):
+            generation = self._published_generation()
+            if generation == 0:
+                raise SharedConfigError("Nothing published under %s yet." % self.name)
+            if generation == self.generation:
+                return self._config
+            try:
+                segment = _attach(_segment_name(self.name, generation))
+            except FileNotFoundError:
+                # Replaced in the meantime, try again.
+                continue
+            self._switch(segment, generation)
+            return self._config
+
+        raise SharedConfigError("Unable to attach to a stable generation of %s." % self.name)
+
+    def _switch(self, segment, generation):
+        config = read_segment(segment, generation)
+        if self._segment is not None:
+            self._retired.append(self._segment)
+        self._segment, self._config, self.generation = segment, config, generation
+        self._release_retired()
+
+    def _release_retired(self):
+        """Close previous segments, once no config built on them is in use."""
+        retired = []
+        for segment in self._retired:
+            try:
+                segment.close()
+            except BufferError:
+                retired.append(segment)
+        self._retired = retired
+
+    def close(self):
+        """Detach from all segments.
+
+        CompactConfig objects returned by :meth:`current` must no longer be
+        in use.
+        """
+        self._config = None
+        if self._segment is not None:
+            self._retired.append(self._segment)
+            self._segment = None
+        self._release_retired()
+        self.control.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __repr__(self):
+        return '<SharedConfigReader: %s@%s>' % (self.name, self.generation)
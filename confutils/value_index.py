@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+# This code is distributed under the two-clause BSD license.
+# Copyright (c) 2012-2013 Raphaël Barrois
+
+from __future__ import absolute_import, unicode_literals
+
+
+"""Reverse lookups, from values to the sections and keys holding them.
+
+A :class:`ValueIndex` is built once from a ConfigFile, then kept up to date
+through :meth:`~configfile.ConfigFile.observe`::
+
+    index = ValueIndex(configfile, tokenize=value_tokens)
+    index.sections('db1.example.org')  # => ['app', 'backup']
+"""
+
+
+import contextlib
+import re
+
+from .configfile import ConfigLine
+
+
+re_token = re.compile(r'[\w.-]+', re.UNICODE)
+
+
+def value_tokens(value):
+    """Split a value into host names, numbers, words...
+
+    >>> value_tokens('postgres://db1.example.org:5432/app')
+    ['postgres', 'db1.example.org', '5432', 'app']
+    """
+    return re_token.findall(value)
+
+
+class ValueIndex(object):
+    """Maps values (or tokens of values) to the (section, key) pairs using them.
+
+    The index follows all changes of its ConfigFile until :meth:`close` is
+    called. With a ThreadSafeConfigFile, lookups hold the file's read lock.
+
+    Attributes:
+        configfile (ConfigFile): the indexed file
+        tokenize (callable): splits a value into the tokens to index; if
+            None, whole values are indexed
+    """
+
+    def __init__(self, configfile, tokenize=None):
+        self.configfile = configfile
+        self.tokenize = tokenize
+        # token => {(section, key): number of lines}
+        self._locations = {}
+        with self._locked('write'):
+            for name, section in configfile.sections.items():
+                for block in section.blocks:
+                    for line in block.lines:
+                        self._add(name, line)
+            configfile.observe(self._on_change)
+
+    @contextlib.contextmanager
+    def _locked(self, mode):
+        lock = getattr(self.configfile, 'lock', None)
+        if lock is None:
+            yield
+            return
+        getattr(lock, 'acquire_%s' % mode)()
+        try:
+            yield
+        finally:
+            getattr(lock, 'release_%s' % mode)()
+
+    def _tokens(self, value):
+        if self.tokenize is None:
+            return (value,)
+        return set(self.tokenize(value))
+
+    def _add(self, section, line):
+        if line.kind != ConfigLine.KIND_DATA:
+            return
+        location = (section, line.key)
+        for token in self._tokens(line.value):
+            locations = self._locations.setdefault(token, {})
+            locations[location] = locations.get(location, 0) + 1
+
+    def _remove(self, section, line):
+        if line.kind != ConfigLine.KIND_DATA:
+            return
+        location = (section, line.key)
+        for token in self._tokens(line.value):
+            locations = self._locations[token]
+            if locations[location] == 1:
+                del locations[location]
+                if not locations:
+                    del self._locations[token]
+            else:
+                locations[location] -= 1
+
+    def _on_change(self, kind, entry):
+        if entry.section is None:
+            # File header
+            return
+        if entry.old_line is not None:
+            self._remove(entry.section, entry.old_line)
+        if entry.new_line is not None:
+            self._add(entry.section, entry.new_line)
+
+    def lookup(self, token):
+        """Return the sorted list of (section, key) pairs using a token."""
+        with self._locked('read'):
+            return sorted(self._locations.get(token, ()))
+
+    def sections(self, token):
+        """Return the sorted list of sections using a token."""
+        with self._locked('read'):
+            return sorted(set(section for section, _key in self._locations.get(token, ())))
+
+    def __contains__(self, token):
+        with self._locked('read'):
+            return token in self._locations
+
+    def close(self):
+        """Stop following changes of the ConfigFile."""
+        self.configfile.unobserve(self._on_change)
+
+    def __repr__(self):
+        return '<ValueIndex: %d tokens>' % len(self._locations)
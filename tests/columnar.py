@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+# This code is distributed under the two-clause BSD license.
+# Copyright (c) 2012-2013 Raphaël Barrois
+
+from __future__ import unicode_literals
+
+from .compat import unittest
+
+from confutils import columnar
+from confutils import configfile
+
+
+def make_configfile(lines):
+    cf = configfile.ConfigFile()
+    cf.parse(lines)
+    return cf
+
+
+class StringColumnTestCase(unittest.TestCase):
+    def test_encoding(self):
+        column = columnar.StringColumn()
+        for text in ['foo', 'bar', 'foo', 'baz']:
+            column.append(text)
+        self.assertEqual([0, 1, 0, 2], list(column.codes))
+        self.assertEqual(['foo', 'bar', 'baz'], column.dictionary)
+        self.assertEqual(['foo', 'bar', 'foo', 'baz'], [column[i] for i in range(len(column))])
+        self.assertEqual(1, column.code('bar'))
+        self.assertIsNone(column.code('qux'))
+
+
+class ColumnarConfigsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.configs = [
+            make_configfile(['# web1', '[server]', 'port: 80', 'legacy: on']),
+            make_configfile(['[server]', 'port: 8080', '[client]', 'port: 80']),
+            make_configfile(['[server]', 'port: 80']),
+        ]
+        self.columns = columnar.ColumnarConfigs.from_configfiles(self.configs,
+            names=['web1', 'web2', 'web3'])
+
+    def test_iter_entries(self):
+        cf = make_configfile(['# header', '[foo]', 'x: 1', '[bar]', 'y: 2', '[foo]', 'z: 3'])
+        cf.add('baz', 't', '4')
+        self.assertEqual([
+            (3, 'foo', 'x', '1'),
+            (5, 'bar', 'y', '2'),
+            (7, 'foo', 'z', '3'),
+            (9, 'baz', 't', '4'),
+        ], list(columnar.iter_entries(cf)))
+        self.assertEqual(list(columnar.iter_entries(cf)), list(columnar.iter_entries(cf.freeze())))
+
+    def test_rows(self):
+        self.assertEqual(5, len(self.columns))
+        self.assertEqual(['web1', 'web2', 'web3'], self.columns.names)
+        self.assertEqual(('web1', 'server', 'port', '80', 3), self.columns.row(0))
+        self.assertEqual(('web2', 'client', 'port', '80', 4), self.columns.row(3))
+        self.assertEqual([0, 0, 1, 1, 2], list(self.columns.file_ids))
+        self.assertEqual(['server', 'client'], self.columns.sections.dictionary)
+
+    def test_default_names(self):
+        columns = columnar.ColumnarConfigs.from_configfiles(self.configs)
+        self.assertEqual(['0', '1', '2'], columns.names)
+
+    def test_select(self):
+        self.assertEqual([0, 2, 4], self.columns.select(section='server', key='port'))
+        self.assertEqual([0, 3, 4], self.columns.select(value='80'))
+        self.assertEqual([3], self.columns.select(section='client', value='80'))
+        self.assertEqual([], self.columns.select(key='unknown'))
+        self.assertEqual(list(range(5)), self.columns.select())
+
+    def test_value_counts(self):
+        self.assertEqual({'80': 2, '8080': 1}, self.columns.value_counts('server', 'port'))
+        self.assertEqual({}, self.columns.value_counts('server', 'unknown'))
+
+    @unittest.skipIf(columnar.numpy is None, "Requires numpy")
+    def test_to_numpy(self):
+        arrays = self.columns.to_numpy()
+        self.assertEqual([0, 0, 1, 1, 2], arrays['file_id'].tolist())
+        values = arrays['value_dictionary'][arrays['value']]
+        self.assertEqual(['80', 'on', '8080', '80', '80'], values[:5].tolist())
+
+    @unittest.skipUnless(columnar.numpy is None, "Requires numpy to be missing")
+    def test_to_numpy_unavailable(self):
+        self.assertRaises(configfile.ConfigError, self.columns.to_numpy)
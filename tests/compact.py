@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+# This code is distributed under the two-clause BSD license.
+# Copyright (c) 2012-2013 Raphaël Barrois
+
+from __future__ import unicode_literals
+
+import gc
+
+from .compat import io
+from .compat import unittest
+
+from confutils import compact
+from confutils import configfile
+
+
+class StringTableTestCase(unittest.TestCase):
+    def test_from_strings(self):
+        table, ids = compact.StringTable.from_strings(['foo', 'bar', 'été', 'foo'])
+        self.assertEqual(3, len(table))
+        self.assertEqual(['bar', 'foo', 'été'], [table.string(i) for i in range(3)])
+        self.assertEqual({'bar': 0, 'foo': 1, 'été': 2}, ids)
+
+    def test_find(self):
+        table, ids = compact.StringTable.from_strings(['foo', 'bar', 'été', ''])
+        for text, i in ids.items():
+            self.assertEqual(i, table.find(text))
+        self.assertIsNone(table.find('baz'))
+        self.assertIsNone(table.find('zzz'))
+
+    def test_empty(self):
+        table, ids = compact.StringTable.from_strings([])
+        self.assertEqual(0, len(table))
+        self.assertIsNone(table.find('foo'))
+
+
+class CompactConfigTestCase(unittest.TestCase):
+    def setUp(self):
+        self.lines = [
+            '# header',
+            '[foo]',
+            'x: 13',
+            'y = 14',
+            '',
+            '[bar]',
+            'x: 42',
+            '[foo]',
+            '# comment',
+            'x: 15',
+            'a: 1',
+            '[empty]',
+        ]
+        self.cf = configfile.ConfigFile()
+        self.cf.parse(self.lines)
+        self.compact = compact.CompactConfig.from_configfile(self.cf)
+
+    def test_sections(self):
+        self.assertEqual(['bar', 'empty', 'foo'], list(self.compact.sections()))
+        self.assertIn('foo', self.compact)
+        self.assertIn('empty', self.compact)
+        self.assertNotIn('x', self.compact)
+        self.assertNotIn('baz', self.compact)
+
+    def test_items(self):
+        for section in ('foo', 'bar', 'empty', 'baz'):
+            self.assertEqual(list(self.cf.items(section)),
+                list(self.compact.items(section)))
+
+    def test_get(self):
+        self.assertEqual(['13', '15'], list(self.compact.get('foo', 'x')))
+        self.assertEqual(['1'], list(self.compact.get('foo', 'a')))
+        self.assertEqual(['42'], list(self.compact.get('bar', 'x')))
+        self.assertEqual([], list(self.compact.get('bar', 'y')))
+        self.assertEqual([], list(self.compact.get('foo', 'z')))
+        self.assertEqual([], list(self.compact.get('baz', 'x')))
+
+    def test_get_one(self):
+        self.assertEqual('13', self.compact.get_one('foo', 'x'))
+        self.assertRaises(KeyError, self.compact.get_one, 'foo', 'z')
+        self.assertRaises(KeyError, self.compact.get_one, 'empty', 'x')
+
+    def test_write(self):
+        f = io.StringIO()
+        self.compact.write(f)
+        self.assertEqual(''.join(l + '\n' for l in self.lines[:-1]), f.getvalue())
+
+    def test_empty(self):
+        c = compact.CompactConfig.from_configfile(configfile.ConfigFile())
+        self.assertEqual([], list(c.sections()))
+        self.assertEqual([], list(c.items('foo')))
+        self.assertEqual([], list(c))
+
+
+class PrepareForkTestCase(unittest.TestCase):
+    def test_prepare_fork(self):
+        compact.prepare_fork()
+        if hasattr(gc, 'unfreeze'):
+            self.assertTrue(gc.get_freeze_count() > 0)
+            gc.unfreeze()
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+# This code is distributed under the two-clause BSD license.
+# Copyright (c) 2012-2013 Raphaël Barrois
+
+from __future__ import unicode_literals
+
+from .compat import unittest
+
+import confutils
+from confutils import configdiff
+from confutils import configfile
+
+
+def make_configfile(lines):
+    cf = configfile.ConfigFile()
+    cf.parse(lines)
+    return cf
+
+
+class DiffTestCase(unittest.TestCase):
+    def setUp(self):
+        self.old = make_configfile([
+            '# Main config',
+            '[server]',
+            'host: web1',
+            'port: 80',
+            'alias: www',
+            'alias: web',
+            '[legacy]',
+            'mode: on',
+            '[server]',
+            'workers: 4',
+        ])
+
+    def test_identical(self):
+        result = configdiff.diff(self.old, self.old)
+        self.assertFalse(result)
+        self.assertEqual([], result.changes)
+
+        other = make_configfile(['[server]', 'host: web1', 'port: 80', 'alias: www', 'alias: web',
+            '[legacy]', 'mode: on', '[server]', 'workers: 4'])
+        self.assertFalse(configdiff.diff(self.old, other))
+
+    def test_comments_ignored(self):
+        new = self.old.snapshot()
+        new.add_line('server', configfile.ConfigLine(configfile.ConfigLine.KIND_BLANK, text='# Note'))
+        self.assertFalse(configdiff.diff(self.old, new))
+
+    def test_values(self):
+        new = self.old.snapshot()
+        new.update('server', 'port', '8080')
+        new.remove('server', 'alias', 'web')
+        new.add('server', 'timeout', '30')
+        result = configdiff.diff(self.old, new)
+        self.assertEqual([
+            configdiff.KeyChange('server', 'port', ['80'], ['8080']),
+            configdiff.KeyChange('server', 'alias', ['www', 'web'], ['www']),
+            configdiff.KeyChange('server', 'timeout', [], ['30']),
+        ], result.changes)
+        self.assertEqual([], result.moves)
+        self.assertEqual([], result.added_sections)
+
+    def test_sections(self):
+        new = self.old.snapshot()
+        new.remove_section('legacy')
+        new.add('cache', 'size', '10')
+        result = configdiff.diff(self.old, new)
+        self.assertEqual(['cache'], result.added_sections)
+        self.assertEqual(['legacy'], result.removed_sections)
+        self.assertEqual([
+            configdiff.KeyChange('cache', 'size', [], ['10']),
+            configdiff.KeyChange('legacy', 'mode', ['on'], []),
+        ], result.changes)
+
+    def test_moves(self):
+        new = make_configfile([
+            '[server]',
+            'port: 80',
+            'alias: www',
+            'alias: web',
+            '[legacy]',
+            'mode: on',
+            '[server]',
+            'workers: 4',
+            'host: web1',
+        ])
+        result = configdiff.diff(self.old, new)
+        self.assertEqual([], result.changes)
+        self.assertEqual([configdiff.LineMove('server', 'host', 'web1', 0, 4)], result.moves)
+
+    def test_shared_blocks(self):
+        new = self.old.snapshot()
+        new.add('legacy', 'mode', 'off')
+        new_server = new.sections['server']
+        self.assertIs(self.old.sections['server'].blocks[0], new_server.blocks[0])
+        result = configdiff.diff(self.old, new)
+        self.assertEqual([configdiff.KeyChange('legacy', 'mode', ['on'], ['on', 'off'])], result.changes)
+
+    def test_identical_blocks_skipped(self):
+        old = make_configfile(['[a]', 'x: 1', 'y: 2', '[b]', '[a]', 'z: 3', '[c]', '[a]', 'w: 4'])
+        new = make_configfile(['[a]', 'x: 1', 'y: 2', '[b]', '[a]', 'z: 5', '[c]', '[a]', 'w: 4'])
+        runs = configdiff._changed_runs(old.sections['a'], new.sections['a'])
+        self.assertEqual([([('z', '3')], 2, [('z', '5')], 2)], runs)
+
+        result = configdiff.diff(old, new)
+        self.assertEqual([configdiff.KeyChange('a', 'z', ['3'], ['5'])], result.changes)
+        self.assertEqual([], result.moves)
+
+    def test_moves_across_blocks(self):
+        old = make_configfile(['[a]', 'x: 1', 'y: 2', '[b]', '[a]', 'z: 3', '[c]', '[a]', 'w: 4'])
+        new = make_configfile(['[a]', 'y: 2', '[b]', '[a]', 'z: 3', '[c]', '[a]', 'w: 4', 'x: 1'])
+        runs = configdiff._changed_runs(old.sections['a'], new.sections['a'])
+        self.assertEqual(2, len(runs))
+
+        result = configdiff.diff(old, new)
+        self.assertEqual([], result.changes)
+        self.assertEqual([configdiff.LineMove('a', 'x', '1', 0, 3)], result.moves)
+
+    def test_moves_within_block(self):
+        old = make_configfile(['[a]', 'x: 1', '[b]', '[a]', 'y: 2', 'z: 3', 'w: 4'])
+        new = make_configfile(['[a]', 'x: 1', '[b]', '[a]', 'z: 3', 'w: 4', 'y: 2'])
+        result = configdiff.diff(old, new)
+        self.assertEqual([], result.changes)
+        self.assertEqual([configdiff.LineMove('a', 'y', '2', 1, 3)], result.moves)
+
+    def test_exported(self):
+        self.assertIs(configdiff.diff, confutils.diff)
+
+
+class PatchTestCase(unittest.TestCase):
+    def test_json(self):
+        patch = configdiff.Patch([
+            ('server', 'port', ['80'], ['8080']),
+            ('server', 'timeout', [], ['30']),
+        ])
+        self.assertEqual(patch, configdiff.Patch.loads(patch.dumps()))
+        self.assertEqual(configdiff.KeyChange('server', 'port', ['80'], ['8080']), list(patch)[0])
+
+    def test_duplicates(self):
+        self.assertRaises(ValueError, configdiff.Patch, [
+            ('server', 'port', ['80'], ['8080']),
+            ('server', 'port', ['8080'], ['8081']),
+        ])
+
+    def test_replay(self):
+        old = make_configfile(['[server]', 'port: 80', 'alias: www', '[legacy]', 'mode: on'])
+        new = old.snapshot()
+        new.update('server', 'port', '8080')
+        new.add('server', 'alias', 'web')
+        new.remove_section('legacy')
+        patch = configdiff.make_patch(old, new)
+        self.assertEqual(3, len(patch))
+
+        host = make_configfile([
+            '# host config',
+            '[server]',
+            'port:  80',
+            'alias:www',
+            '[legacy]',
+            'mode: on',
+            '[host]',
+            'name: web42',
+        ])
+        host.apply_patch(configdiff.Patch.loads(patch.dumps()))
+        self.assertEqual([('port', '8080'), ('alias', 'www'), ('alias', 'web')], list(host.items('server')))
+        self.assertEqual([], list(host.items('legacy')))
+        self.assertEqual(['web42'], list(host.get('host', 'name')))
+
+
+class OverlayDiffTestCase(unittest.TestCase):
+    def setUp(self):
+        self.base = make_configfile([
+            '[server]',
+            'host: web1',
+            'port: 80',
+            '[legacy]',
+            'mode: on',
+            '[server]',
+            'workers: 4',
+        ])
+        self.overlay = configfile.OverlayConfigFile(self.base)
+
+    def test_unchanged(self):
+        self.assertFalse(configdiff.diff(self.base, self.overlay))
+        self.assertFalse(configdiff.diff(self.overlay, self.base))
+
+    def test_diff(self):
+        self.overlay.update('server', 'port', '8080')
+        self.overlay.add('cache', 'size', '10')
+        result = configdiff.diff(self.base, self.overlay)
+        self.assertEqual(['cache'], result.added_sections)
+        self.assertEqual([
+            configdiff.KeyChange('cache', 'size', [], ['10']),
+            configdiff.KeyChange('server', 'port', ['80'], ['8080']),
+        ], result.changes)
+        self.assertEqual(result.changes, configdiff.diff(self.base, self.overlay.flatten()).changes)
+
+        other = configfile.OverlayConfigFile(self.base)
+        other.remove('server', 'host')
+        result = configdiff.diff(self.overlay, other)
+        self.assertEqual(['cache'], result.removed_sections)
+        self.assertEqual([
+            configdiff.KeyChange('cache', 'size', ['10'], []),
+            configdiff.KeyChange('server', 'host', ['web1'], []),
+            configdiff.KeyChange('server', 'port', ['8080'], ['80']),
+        ], result.changes)
+
+    def test_moves(self):
+        self.overlay.remove('server', 'host')
+        self.overlay.add('server', 'host', 'web1')
+        result = configdiff.diff(self.base, self.overlay)
+        self.assertEqual([], result.changes)
+        self.assertEqual([configdiff.LineMove('server', 'host', 'web1', 0, 2)], result.moves)
+
+    def test_patch(self):
+        new = self.base.snapshot()
+        new.update('server', 'workers', '8')
+        new.add('server', 'alias', 'www')
+        self.assertEqual(2, self.overlay.apply_patch(configdiff.make_patch(self.base, new)))
+        self.assertFalse(configdiff.diff(new, self.overlay))
+        self.assertEqual(['4'], list(self.base.get('server', 'workers')))
@@ -4,7 +4,11 @@
 
 from __future__ import unicode_literals
 
+import random
+import re
 import tempfile
+import threading
+import types
 
 from .compat import io
 from .compat import unittest
@@ -256,6 +260,56 @@ class ParserTestCase(unittest.TestCase):
         ])
 
 
+class MatcherTestCase(unittest.TestCase):
+    def setUp(self):
+        parser = configfile.Parser()
+        self.lines = list(parser.parse([
+            '[foo]',
+            '[bar]',
+            'x: 13',
+            'x: 14',
+            'xy: 13',
+            'y: 13',
+            '# comment',
+            '  # comment  ',
+            '',
+        ]))
+
+    def test_same_as_match(self):
+        queries = self.lines + [
+            configfile.ConfigLine(configfile.ConfigLine.KIND_DATA, key='x'),
+            configfile.ConfigLine(configfile.ConfigLine.KIND_DATA, key='z'),
+            configfile.ConfigLine(configfile.ConfigLine.KIND_DATA, key='x', value='15'),
+        ]
+        for query in queries:
+            matcher = query.matcher()
+            self.assertEqual(
+                [line.match(query) for line in self.lines],
+                [matcher(line) for line in self.lines],
+                query)
+
+    def test_match_key(self):
+        self.assertEqual(['x: 13', 'x: 14'],
+            [l.text for l in self.lines if configfile.match_key('x')(l)])
+        self.assertEqual(['x: 13'],
+            [l.text for l in self.lines if configfile.match_key('x', '13')(l)])
+
+    def test_match_key_prefix(self):
+        self.assertEqual(['x: 13', 'x: 14', 'xy: 13'],
+            [l.text for l in self.lines if configfile.match_key_prefix('x')(l)])
+
+    def test_match_key_regex(self):
+        self.assertEqual(['xy: 13', 'y: 13'],
+            [l.text for l in self.lines if configfile.match_key_regex(r'x?y$')(l)])
+        self.assertEqual(['x: 13', 'x: 14'],
+            [l.text for l in self.lines if configfile.match_key_regex(re.compile(r'x$'))(l)])
+
+    def test_find_where(self):
+        l = configfile.ConfigLineList(*self.lines)
+        self.assertEqual(['xy: 13', 'y: 13'],
+            [line.text for line in l.find_where(configfile.match_key_regex('x?y'))])
+
+
 class ConfigLineList(unittest.TestCase):
     def setUp(self):
         self.l1 = configfile.ConfigLine(configfile.ConfigLine.KIND_HEADER,
@@ -655,6 +709,49 @@ class SectionTestCase(unittest.TestCase):
         self.assertEqual([], s.blocks)
 
 
+class SectionIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.l1 = configfile.ConfigLine(configfile.ConfigLine.KIND_DATA,
+                key='x', value='13')
+        self.l2 = configfile.ConfigLine(configfile.ConfigLine.KIND_BLANK,
+                '# blah')
+        self.l3 = configfile.ConfigLine(configfile.ConfigLine.KIND_DATA,
+                key='y', value='42')
+        self.l4 = configfile.ConfigLine(configfile.ConfigLine.KIND_DATA,
+                key='x', value='14')
+
+    def test_empty(self):
+        index = configfile.SectionIndex()
+        self.assertEqual([], index.keys)
+        self.assertEqual({}, index.values)
+
+    def test_grouping(self):
+        index = configfile.SectionIndex([self.l1, self.l2, self.l3, self.l4])
+        self.assertEqual(['x', 'y'], index.keys)
+        self.assertEqual({'x': ['13', '14'], 'y': ['42']}, index.values)
+
+    def test_section_index_cached(self):
+        s = configfile.Section('foo')
+        s.insert(self.l1)
+        index = s.index()
+        self.assertIs(index, s.index())
+
+        s.insert(self.l4)
+        self.assertIsNot(index, s.index())
+        self.assertEqual({'x': ['13', '14']}, s.index().values)
+
+        s.remove(self.l1)
+        self.assertEqual({'x': ['14']}, s.index().values)
+
+    def test_section_index_no_change(self):
+        s = configfile.Section('foo')
+        s.insert(self.l1)
+        index = s.index()
+        s.remove(self.l3)
+        s.update(self.l3, self.l4)
+        self.assertIs(index, s.index())
+
+
 class ConfigFileTestCase(unittest.TestCase):
     def setUp(self):
         self.l1 = configfile.ConfigLine(configfile.ConfigLine.KIND_DATA,
@@ -1456,6 +1553,36 @@ class SingleValuedSectionViewTestCase(unittest.TestCase):
         # Didn't touch other sections
         self.assertEqual([self.l2, self.l4], list(self.nonempty_cf.blocks[1]))
 
+    def test_len(self):
+        self.assertEqual(0, len(self.empty_cf.section_view('foo')))
+        view = self.nonempty_cf.section_view('foo')
+        self.assertEqual(3, len(view))
+        self.nonempty_cf.add('foo', 'x', '42')
+        self.assertEqual(3, len(view))
+        view['t'] = '1'
+        self.assertEqual(4, len(view))
+
+    def test_contains(self):
+        view = self.nonempty_cf.section_view('foo')
+        self.assertIn('x', view)
+        self.assertNotIn('t', view)
+        self.assertNotIn('13', view)
+        self.assertNotIn('x', self.empty_cf.section_view('foo'))
+
+    def test_keys_values(self):
+        view = self.nonempty_cf.section_view('foo')
+        self.assertEqual(['x', 'y', 'z'], view.keys())
+        self.assertEqual(['x', 'y', 'z'], list(view))
+        self.assertEqual(['x', 'y', 'z'], list(view.iterkeys()))
+        self.assertEqual(['13', '14', '2'], view.values())
+        self.assertEqual(['13', '14', '2'], list(view.itervalues()))
+
+    def test_duplicated_key(self):
+        view = self.nonempty_cf.section_view('foo')
+        self.nonempty_cf.add('foo', 'x', '42')
+        self.assertEqual('13', view['x'])
+        self.assertEqual([('x', '13'), ('y', '14'), ('z', '2')], view.items())
+
     def test_del_empty(self):
         view = self.empty_cf.section_view('foo')
         with self.assertRaises(KeyError):
@@ -1593,9 +1720,1733 @@ class MultiValuedSectionViewTestCase(unittest.TestCase):
         with self.assertRaises(KeyError):
             del view['x']
 
+    def test_replace(self):
+        view = self.nonempty_cf.section_view('foo', multi_value=True)
+        self.assertEqual(2, view.replace('x', ['15', '13']))
+        self.assertEqual(['13', '13', '15'], view['x'])
+        self.assertEqual([self.l1, self.l2, self.l1], list(self.nonempty_cf.blocks[0]))
+        self.assertEqual([self.l3, self.l5], list(self.nonempty_cf.blocks[2]))
+
+    def test_replace_many(self):
+        view = self.nonempty_cf.section_view('foo', multi_value=True)
+        nb = view.replace_many({'x': ['42'], 'y': [], 't': ['1', '2', '1']})
+        self.assertEqual(5, nb)
+        self.assertEqual([
+            ('z', ['2']),
+            ('x', ['42']),
+            ('t', ['1', '2']),
+        ], view.items())
+        self.assertEqual([], list(self.nonempty_cf.blocks[0]))
+        # Didn't touch other sections
+        self.assertEqual([self.l2, self.l4], list(self.nonempty_cf.blocks[1]))
+
+    def test_replace_many_empty(self):
+        view = self.empty_cf.section_view('foo', multi_value=True)
+        self.assertEqual(0, view.replace_many({'x': []}))
+        self.assertNotIn('foo', self.empty_cf)
+
+        self.assertEqual(2, view.replace_many({'x': ['13', '42']}))
+        self.assertEqual([('x', ['13', '42'])], view.items())
+        self.assertEqual([self.l1, self.l4], list(self.empty_cf.sections['foo'].extra_block))
+
+    def test_len(self):
+        self.assertEqual(0, len(self.empty_cf.section_view('foo', multi_value=True)))
+        view = self.nonempty_cf.section_view('foo', multi_value=True)
+        self.assertEqual(3, len(view))
+        view.add('t', '1')
+        self.assertEqual(4, len(view))
+
+    def test_contains(self):
+        view = self.nonempty_cf.section_view('foo', multi_value=True)
+        self.assertIn('x', view)
+        self.assertNotIn('t', view)
+        self.assertNotIn('13', view)
+        del view['x']
+        self.assertNotIn('x', view)
+
+    def test_keys_values(self):
+        view = self.nonempty_cf.section_view('foo', multi_value=True)
+        self.assertEqual(['x', 'y', 'z'], view.keys())
+        self.assertEqual(['x', 'y', 'z'], list(view))
+        self.assertEqual([['13', '13', '42'], ['14'], ['2']], view.values())
+        self.assertEqual([['13', '13', '42'], ['14'], ['2']], list(view.itervalues()))
+
+    def test_getitem_copy(self):
+        view = self.nonempty_cf.section_view('foo', multi_value=True)
+        view['x'].append('blah')
+        self.assertEqual(['13', '13', '42'], view['x'])
+
     def test_del_nonempty(self):
         view = self.nonempty_cf.section_view('foo', multi_value=True)
         del view['x']
         self.assertEqual([self.l2], list(self.nonempty_cf.blocks[0]))
         # Didn't touch other sections
         self.assertEqual([self.l2, self.l4], list(self.nonempty_cf.blocks[1]))
+
+
+class FrozenConfigFileTestCase(unittest.TestCase):
+    def setUp(self):
+        self.lines = [
+            '# header',
+            '[foo]',
+            'x: 13',
+            'y = 14',
+            '',
+            '[bar]',
+            'x: 42',
+            '[foo]',
+            '# comment',
+            'x: 15',
+        ]
+        self.cf = configfile.ConfigFile()
+        self.cf.parse(self.lines)
+
+    def test_sections(self):
+        frozen = self.cf.freeze()
+        self.assertEqual(frozenset(['foo', 'bar']), frozen.sections)
+        self.assertIn('foo', frozen)
+        self.assertNotIn('baz', frozen)
+
+    def test_get(self):
+        frozen = self.cf.freeze()
+        self.assertEqual(['13', '15'], list(frozen.get('foo', 'x')))
+        self.assertEqual([], list(frozen.get('foo', 'z')))
+        self.assertEqual([], list(frozen.get('baz', 'x')))
+
+    def test_get_one(self):
+        frozen = self.cf.freeze()
+        self.assertEqual('13', frozen.get_one('foo', 'x'))
+        self.assertEqual('42', frozen.get_one('bar', 'x'))
+        self.assertRaises(KeyError, frozen.get_one, 'foo', 'z')
+        self.assertRaises(KeyError, frozen.get_one, 'baz', 'x')
+
+    def test_items(self):
+        frozen = self.cf.freeze()
+        self.assertEqual(list(self.cf.items('foo')), list(frozen.items('foo')))
+        self.assertEqual([], list(frozen.items('baz')))
+
+    def test_section_values(self):
+        frozen = self.cf.freeze()
+        self.assertEqual({'x': '13', 'y': '14'}, frozen.section_values('foo'))
+        self.assertEqual({'x': ('13', '15'), 'y': ('14',)},
+            frozen.section_values('foo', multi_value=True))
+        self.assertEqual({}, frozen.section_values('baz'))
+
+    def test_independent(self):
+        frozen = self.cf.freeze()
+        self.cf.update('foo', 'x', '0')
+        self.cf.add('baz', 'x', '1')
+        self.assertEqual('13', frozen.get_one('foo', 'x'))
+        self.assertNotIn('baz', frozen)
+
+    def test_write(self):
+        f = io.StringIO()
+        self.cf.freeze().write(f)
+        self.assertEqual(''.join(l + '\n' for l in self.lines), f.getvalue())
+
+    def test_eq_hash(self):
+        frozen = self.cf.freeze()
+        self.assertEqual(frozen, self.cf.freeze())
+        self.assertEqual(hash(frozen), hash(self.cf.freeze()))
+        self.assertFalse(frozen == self.lines)
+
+        self.cf.add('foo', 'x', '16')
+        self.assertNotEqual(frozen, self.cf.freeze())
+
+    def test_thaw(self):
+        cf = self.cf.freeze().thaw()
+        self.assertEqual(list(self.cf), list(cf))
+        cf.add('foo', 'z', '1')
+        self.assertEqual(['1'], list(cf.get('foo', 'z')))
+
+
+class ThreadSafeConfigFileTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cf = configfile.ThreadSafeConfigFile()
+        self.cf.parse(['[foo]', 'x: 13', 'y: 14'])
+
+    def test_api(self):
+        self.assertIn('foo', self.cf)
+        self.assertEqual('13', self.cf.get_one('foo', 'x'))
+        self.cf.add_or_update('foo', 'x', '42')
+        self.assertEqual([('x', '42'), ('y', '14')], list(self.cf.items('foo')))
+
+        view = self.cf.section_view('foo')
+        view['z'] = '1'
+        self.assertEqual(['x', 'y', 'z'], view.keys())
+
+    def test_generators_materialized(self):
+        items = self.cf.items('foo')
+        self.assertNotIsInstance(items, types.GeneratorType)
+        # Safe to update the file while iterating
+        for key, _value in items:
+            self.cf.remove('foo', key)
+        self.assertEqual([], list(self.cf.items('foo')))
+
+    def test_writer_excludes_readers(self):
+        self.cf.lock.acquire_write()
+        done = threading.Event()
+
+        def reader():
+            self.cf.get_one('foo', 'x')
+            done.set()
+
+        thread = threading.Thread(target=reader)
+        thread.daemon = True
+        thread.start()
+        self.assertFalse(done.wait(0.1))
+        self.cf.lock.release_write()
+        thread.join(5)
+        self.assertTrue(done.is_set())
+
+    def test_concurrent_updates(self):
+        def worker(n):
+            for i in range(50):
+                self.cf.add('bar', 'k%d' % n, str(i))
+                list(self.cf.items('bar'))
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        view = self.cf.section_view('bar', multi_value=True)
+        self.assertEqual(4, len(view))
+        for n in range(4):
+            self.assertEqual([str(i) for i in range(50)], view['k%d' % n])
+
+
+class SnapshotTestCase(unittest.TestCase):
+    def setUp(self):
+        self.lines = [
+            '# header',
+            '[foo]',
+            'x: 13',
+            '[bar]',
+            'x: 42',
+            '[foo]',
+            'y: 14',
+        ]
+        self.cf = configfile.ConfigFile()
+        self.cf.parse(self.lines)
+
+    def write(self, cf):
+        f = io.StringIO()
+        cf.write(f)
+        return f.getvalue().splitlines()
+
+    def test_shares_structure(self):
+        snap = self.cf.snapshot()
+        self.assertIs(self.cf.blocks, snap.blocks)
+        self.assertIs(self.cf.sections, snap.sections)
+        self.assertEqual(self.lines, self.write(snap))
+
+    def test_update_snapshot(self):
+        snap = self.cf.snapshot()
+        snap.update('foo', 'x', '0')
+        snap.add('baz', 'z', '1')
+        self.assertEqual(self.lines, self.write(self.cf))
+        self.assertEqual(['0'], list(snap.get('foo', 'x')))
+        self.assertEqual(['1'], list(snap.get('baz', 'z')))
+        self.assertNotIn('baz', self.cf)
+
+        # Untouched sections still share their blocks
+        self.assertIs(self.cf.sections['bar'].blocks[0], snap.sections['bar'].blocks[0])
+        self.assertIsNot(self.cf.sections['foo'].blocks[0], snap.sections['foo'].blocks[0])
+
+    def test_update_original(self):
+        snap = self.cf.snapshot()
+        self.cf.remove('bar', 'x')
+        self.cf.add('foo', 'x', '15')
+        self.assertEqual(self.lines, self.write(snap))
+        self.assertEqual([], list(self.cf.items('bar')))
+        self.assertEqual(['13', '15'], list(self.cf.get('foo', 'x')))
+
+    def test_insert_line_into_snapshot(self):
+        snap = self.cf.snapshot()
+        parser = configfile.Parser()
+        # Keeps filling the current block of the snapshot
+        snap.insert_line(parser.parse_line('z: 1'))
+        self.cf.insert_line(parser.parse_line('# blah'))
+        self.assertEqual(self.lines + ['z: 1'], self.write(snap))
+        self.assertEqual(self.lines + ['# blah'], self.write(self.cf))
+
+    def test_header(self):
+        cf = configfile.ConfigFile()
+        cf.parse(['# header'])
+        snap = cf.snapshot()
+        snap.parse(['# more'])
+        self.assertEqual(['# header'], self.write(cf))
+        self.assertEqual(['# header', '# more'], self.write(snap))
+
+    def test_chained_snapshots(self):
+        snap1 = self.cf.snapshot()
+        snap1.add('foo', 'z', '1')
+        snap2 = snap1.snapshot()
+        snap2.update('foo', 'z', '2')
+        snap1.update('bar', 'x', '0')
+
+        self.assertEqual(self.lines, self.write(self.cf))
+        self.assertEqual(['1'], list(snap1.get('foo', 'z')))
+        self.assertEqual(['0'], list(snap1.get('bar', 'x')))
+        self.assertEqual(['2'], list(snap2.get('foo', 'z')))
+        self.assertEqual(['42'], list(snap2.get('bar', 'x')))
+
+    def test_views(self):
+        snap = self.cf.snapshot()
+        view = snap.section_view('foo', multi_value=True)
+        view['x'] = ['1', '2']
+        self.assertEqual(['13'], self.cf.section_view('foo', multi_value=True)['x'])
+        self.assertEqual(['1', '2'], view['x'])
+
+    def test_thread_safe(self):
+        cf = configfile.ThreadSafeConfigFile()
+        cf.parse(self.lines)
+        snap = cf.snapshot()
+        self.assertIsInstance(snap, configfile.ThreadSafeConfigFile)
+        self.assertIsNot(cf.lock, snap.lock)
+        snap.add('foo', 'x', '1')
+        self.assertEqual(['13'], list(cf.get('foo', 'x')))
+
+
+class BatchTestCase(unittest.TestCase):
+    def setUp(self):
+        self.lines = [
+            '[foo]',
+            'x: 13',
+            '# comment',
+            'y: 14',
+            '[bar]',
+            'x: 42',
+            '[foo]',
+            'x: 15',
+        ]
+
+    def make_configfile(self):
+        cf = configfile.ConfigFile()
+        cf.parse(self.lines)
+        return cf
+
+    def write(self, cf):
+        f = io.StringIO()
+        cf.write(f)
+        return f.getvalue().splitlines()
+
+    def test_buffered(self):
+        cf = self.make_configfile()
+        with cf.batch():
+            self.assertIsNone(cf.add('foo', 'z', '1'))
+            self.assertIsNone(cf.update('foo', 'x', '0', old_value='13'))
+            self.assertIsNone(cf.remove('bar', 'x'))
+            self.assertIsNone(cf.add_or_update('baz', 't', '2'))
+            # Not applied yet
+            self.assertEqual(self.lines, self.write(cf))
+
+        self.assertEqual([
+            '[foo]',
+            'x: 0',
+            '# comment',
+            'y: 14',
+            '[foo]',
+            'x: 15',
+            'z: 1',
+            '[baz]',
+            't: 2',
+        ], self.write(cf))
+
+    def test_rollback(self):
+        cf = self.make_configfile()
+        with self.assertRaises(ValueError):
+            with cf.batch():
+                cf.add('foo', 'z', '1')
+                cf.remove('foo', 'x')
+                raise ValueError()
+
+        self.assertEqual(self.lines, self.write(cf))
+        # Not batching anymore
+        cf.add('foo', 'z', '1')
+        self.assertEqual(['1'], list(cf.get('foo', 'z')))
+
+    def test_nested(self):
+        cf = self.make_configfile()
+        with cf.batch():
+            cf.add('foo', 'z', '1')
+            with cf.batch():
+                cf.add('foo', 'z', '2')
+            self.assertEqual([], list(cf.get('foo', 'z')))
+        self.assertEqual(['1', '2'], list(cf.get('foo', 'z')))
+
+    def test_sequence_on_same_key(self):
+        cf = self.make_configfile()
+        with cf.batch():
+            cf.add('foo', 'z', '1')
+            cf.update('foo', 'z', '2')
+            cf.add('foo', 'z', '3')
+            cf.remove('foo', 'z', '2')
+            cf.add_or_update('foo', 'z', '4')
+            cf.add_or_update('foo', 't', '5')
+        self.assertEqual([('x', '13'), ('y', '14'), ('x', '15'), ('z', '4'), ('t', '5')],
+            list(cf.items('foo')))
+
+    def test_empty_section(self):
+        cf = configfile.ConfigFile()
+        with cf.batch():
+            cf.add('foo', 'x', '1')
+            cf.add('foo', 'y', '2')
+            cf.remove('bar', 'x')
+        self.assertEqual(['[foo]', 'x: 1', 'y: 2'], self.write(cf))
+        self.assertNotIn('bar', cf)
+
+    def test_same_as_sequential(self):
+        rng = random.Random(42)
+        keys = ['x', 'y', 'z']
+        values = ['13', '14', '15', '1']
+
+        for _i in range(200):
+            operations = []
+            for _j in range(rng.randint(1, 8)):
+                section = rng.choice(['foo', 'bar', 'baz'])
+                key = rng.choice(keys)
+                action = rng.choice(['add', 'update', 'remove', 'add_or_update', 'replace_values'])
+                if action == 'replace_values':
+                    operations.append(('replace_values',
+                        (section, {key: rng.sample(values, rng.randint(0, 2))}), {}))
+                elif action == 'add':
+                    operations.append(('add', (section, key, rng.choice(values)), {}))
+                elif action == 'add_or_update':
+                    operations.append(('add_or_update', (section, key, rng.choice(values)), {}))
+                elif action == 'remove':
+                    operations.append(('remove', (section, key, rng.choice(values + [None])), {}))
+                else:
+                    operations.append(('update', (section, key, rng.choice(values)),
+                        dict(old_value=rng.choice(values + [None]), once=rng.choice([True, False]))))
+
+            sequential = self.make_configfile()
+            batched = self.make_configfile()
+            for action, args, kwargs in operations:
+                getattr(sequential, action)(*args, **kwargs)
+            with batched.batch():
+                for action, args, kwargs in operations:
+                    getattr(batched, action)(*args, **kwargs)
+
+            self.assertEqual(self.write(sequential), self.write(batched), operations)
+
+    def test_views(self):
+        cf = self.make_configfile()
+        single = cf.section_view('foo')
+        multi = cf.section_view('foo', multi_value=True)
+        with cf.batch():
+            single['y'] = '0'
+            del single['x']
+            multi['z'] = ['1', '2']
+            multi.add('t', '3')
+            self.assertRaises(KeyError, single.__delitem__, 'unknown')
+            self.assertRaises(KeyError, multi.__delitem__, 'unknown')
+            self.assertEqual(self.lines, self.write(cf))
+
+        self.assertEqual([('y', '0'), ('z', '1'), ('z', '2'), ('t', '3')], list(cf.items('foo')))
+        with cf.batch():
+            del multi['z']
+            cf.section_view('bar', multi_value=True)['x'] = []
+        self.assertEqual([('y', '0'), ('t', '3')], list(cf.items('foo')))
+        self.assertEqual([], list(cf.items('bar')))
+
+    def test_view_rollback(self):
+        cf = self.make_configfile()
+        view = cf.section_view('foo', multi_value=True)
+        with self.assertRaises(ValueError):
+            with cf.batch():
+                view['x'] = ['0']
+                del view['y']
+                raise ValueError()
+        self.assertEqual(self.lines, self.write(cf))
+
+    def test_order(self):
+        cf = self.make_configfile()
+        with cf.batch():
+            cf.update('foo', 'x', '2')
+            cf.section_view('foo', multi_value=True)['x'] = ['3']
+            cf.add('foo', 'x', '4')
+        self.assertEqual(['3', '4'], list(cf.get('foo', 'x')))
+
+    def test_section_creation_order(self):
+        def operations(cf):
+            cf.remove('baz', 'x')
+            cf.update('qux', 'x', '1')
+            cf.section_view('quux', multi_value=True)['x'] = []
+            cf.add('qux', 'y', '2')
+            cf.section_view('quux', multi_value=True)['x'] = ['3']
+            cf.add_or_update('baz', 'z', '4')
+
+        expected = self.make_configfile()
+        operations(expected)
+        cf = self.make_configfile()
+        with cf.batch():
+            operations(cf)
+        self.assertEqual(self.write(expected), self.write(cf))
+        self.assertEqual(['[qux]', 'y: 2', '[quux]', 'x: 3', '[baz]', 'z: 4'], self.write(cf)[-6:])
+
+    def test_unbuffered_operations(self):
+        line = configfile.ConfigLine(configfile.ConfigLine.KIND_DATA, key='x', value='1')
+        operations = [
+            ('add_line', ('foo', line)),
+            ('update_line', ('foo', line, line)),
+            ('remove_line', ('foo', line)),
+            ('enter_block', ('foo',)),
+            ('insert_line', (line,)),
+            ('handle_line', (line,)),
+            ('parse', (['[foo]', 'x: 1'],)),
+            ('remove_where', (lambda line: True,)),
+            ('rewrite_where', (lambda line: True, lambda line: line)),
+            ('compact', ()),
+            ('remove_section', ('foo',)),
+            ('rename_section', ('foo', 'baz')),
+            ('move_section', ('foo',)),
+            ('apply_patch', ([('foo', 'y', ['14'], [])],)),
+        ]
+        for name, args in operations:
+            cf = self.make_configfile()
+            with self.assertRaises(configfile.ConfigError):
+                with cf.batch():
+                    cf.add('foo', 'z', '1')
+                    getattr(cf, name)(*args)
+            # Neither the buffered nor the rejected operation was applied.
+            self.assertEqual(self.lines, self.write(cf), name)
+
+    def test_snapshot(self):
+        cf = self.make_configfile()
+        snap = cf.snapshot()
+        with snap.batch():
+            snap.update('foo', 'x', '0')
+        self.assertEqual(self.lines, self.write(cf))
+        self.assertEqual(['0', '0'], list(snap.get('foo', 'x')))
+
+    def test_thread_safe(self):
+        cf = configfile.ThreadSafeConfigFile()
+        cf.parse(self.lines)
+        with cf.batch():
+            cf.add('foo', 'z', '1')
+        self.assertEqual(['1'], list(cf.get('foo', 'z')))
+
+
+class JournalTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cf = configfile.ConfigFile()
+        self.cf.parse([
+            '# header',
+            '[foo]',
+            'x: 13',
+            'y: 14',
+            '[bar]',
+            'x: 42',
+        ])
+
+    def test_generation(self):
+        generation = self.cf.generation
+        self.assertTrue(generation > 0)
+
+        self.cf.add('foo', 'z', '1')
+        self.assertEqual(generation + 1, self.cf.generation)
+        self.cf.update('foo', 'x', '0')
+        self.assertEqual(generation + 2, self.cf.generation)
+        self.cf.remove('bar', 'x')
+        self.assertEqual(generation + 3, self.cf.generation)
+        self.cf.replace_values('foo', {'y': ['1', '2']})
+        self.assertEqual(generation + 4, self.cf.generation)
+
+    def test_generation_unchanged(self):
+        generation = self.cf.generation
+        self.cf.update('foo', 'x', '0', old_value='no such value')
+        self.cf.remove('baz', 'x')
+        self.cf.remove('foo', 'z')
+        self.assertEqual(generation, self.cf.generation)
+        self.assertIsNone(self.cf.journal)
+
+    def test_batch_generation(self):
+        generation = self.cf.generation
+        with self.cf.batch():
+            self.cf.add('foo', 'z', '1')
+            self.cf.add('bar', 'z', '1')
+            self.assertEqual(generation, self.cf.generation)
+        # A single generation for the whole batch
+        self.assertEqual(generation + 1, self.cf.generation)
+
+    def test_untracked_parse(self):
+        recorded = []
+        self.cf._record = recorded.append
+        self.cf.parse(['[foo]', 'z: 1', '[baz]'] + ['t: %d' % i for i in range(100)])
+        # A single untracked change, for the generation bump
+        self.assertEqual([[('foo', None)]], recorded)
+        self.assertEqual(['1'], list(self.cf.get('foo', 'z')))
+        self.assertEqual(100, len(self.cf.section_index('baz').values['t']))
+
+    def test_journal(self):
+        self.cf.enable_journal()
+        generation = self.cf.generation
+
+        self.cf.add('foo', 'z', '1')
+        self.cf.update('foo', 'x', '0')
+        self.cf.remove('bar', 'x')
+
+        entries = list(self.cf.journal)
+        self.assertEqual(3, len(entries))
+
+        added, updated, removed = entries
+        self.assertEqual(generation + 1, added.generation)
+        self.assertEqual('foo', added.section)
+        self.assertIsNone(added.old_line)
+        self.assertEqual(('z', '1'), (added.new_line.key, added.new_line.value))
+        self.assertIs(added.new_line, added.block.lines[added.index])
+
+        self.assertEqual(generation + 2, updated.generation)
+        self.assertEqual('13', updated.old_line.value)
+        self.assertEqual('0', updated.new_line.value)
+        self.assertEqual(0, updated.index)
+
+        self.assertEqual(generation + 3, removed.generation)
+        self.assertEqual('bar', removed.section)
+        self.assertEqual('42', removed.old_line.value)
+        self.assertIsNone(removed.new_line)
+
+    def test_journal_parse(self):
+        self.cf.enable_journal()
+        self.cf.parse(['# more', '[baz]', 'x: 1'])
+        entries = list(self.cf.journal)
+        self.assertEqual([None, 'baz'], [e.section for e in entries])
+        self.assertEqual(['# more', 'x: 1'], [e.new_line.text for e in entries])
+
+    def test_journal_batch(self):
+        self.cf.enable_journal()
+        with self.cf.batch():
+            self.cf.add('foo', 'z', '1')
+            self.cf.update('foo', 'x', '0')
+        self.assertEqual(2, len(self.cf.journal))
+        self.assertEqual(1, len(set(e.generation for e in self.cf.journal)))
+
+    def test_journal_bounded(self):
+        self.cf.enable_journal(size=2)
+        for i in range(5):
+            self.cf.add('foo', 'z', str(i))
+        self.assertEqual(['3', '4'], [e.new_line.value for e in self.cf.journal])
+
+    def test_snapshot(self):
+        snap = self.cf.snapshot()
+        self.assertEqual(self.cf.generation, snap.generation)
+        snap.add('foo', 'z', '1')
+        self.assertEqual(self.cf.generation + 1, snap.generation)
+
+
+class JournalReplayTestCase(unittest.TestCase):
+    """Each updating method bumps the generation once, with replayable entries."""
+
+    def setUp(self):
+        self.cf = configfile.ConfigFile()
+        self.cf.parse([
+            '# header',
+            '[foo]',
+            'x: 13',
+            '# about y',
+            'y: 14',
+            'x: 16',
+            '[bar]',
+            'x: 42',
+            '[foo]',
+            'x: 15',
+            'y: 14',
+            '[baz]',
+            't: 1',
+        ])
+        self.cf.add('qux', 'x', '1')
+        self.cf.enable_journal()
+
+    def all_blocks(self):
+        blocks = [self.cf.header] + list(self.cf.blocks)
+        blocks.extend(s.extra_block for s in self.cf.sections.values()
+            if s.extra_block is not None and s.extra_block not in self.cf.blocks)
+        return blocks
+
+    def check(self, operation, *args, **kwargs):
+        """Call an updating method, and replay its journal entries."""
+        lines = dict((id(block), list(block.lines)) for block in self.all_blocks())
+        order = list(self.cf.blocks)
+        generation = self.cf.generation
+        self.cf.journal.clear()
+
+        if callable(operation):
+            operation()
+        else:
+            getattr(self.cf, operation)(*args, **kwargs)
+        self.assertEqual(generation + 1, self.cf.generation, operation)
+
+        for entry in self.cf.journal:
+            self.assertEqual(generation + 1, entry.generation)
+            if entry.old_line is None and entry.new_line is None:
+                order.remove(entry.block)
+                order.insert(entry.index, entry.block)
+                continue
+            block_lines = lines.setdefault(id(entry.block), [])
+            if entry.old_line is None:
+                block_lines.insert(entry.index, entry.new_line)
+            else:
+                self.assertIs(entry.old_line, block_lines[entry.index])
+                if entry.new_line is None:
+                    del block_lines[entry.index]
+                else:
+                    block_lines[entry.index] = entry.new_line
+
+        for block in self.all_blocks():
+            self.assertEqual(block.lines, lines.get(id(block), []), operation)
+        # Created and dropped blocks aren't journaled.
+        current = set(id(block) for block in self.cf.blocks)
+        known = set(id(block) for block in order)
+        self.assertEqual(
+            [block for block in order if id(block) in current],
+            [block for block in self.cf.blocks if id(block) in known], operation)
+
+    def test_line_updates(self):
+        self.check('add', 'foo', 'z', '1')
+        self.check('update', 'foo', 'x', '0')
+        self.check('remove', 'foo', 'x')
+        self.check('replace_values', 'foo', {'y': ['1', '14'], 'x': ['2']})
+
+    def test_parse(self):
+        self.check('parse', ['[foo]', 'x: 1', '[new]', 'y: 2'])
+
+    def test_predicates(self):
+        self.check('remove_where', configfile.match_key('x'))
+        self.check('rewrite_where', configfile.match_key('y'),
+            lambda line: configfile.ConfigLine(line.kind, key='z', value=line.value))
+
+    def test_batch(self):
+        def batch():
+            with self.cf.batch():
+                self.cf.remove('foo', 'x', '13')
+                self.cf.add_or_update('bar', 'x', '0')
+                self.cf.replace_values('foo', {'y': ['2'], 'x': []})
+                self.cf.add('new', 'z', '1')
+        self.check(batch)
+
+    def test_compact(self):
+        self.check('compact')
+        self.cf.parse(['[foo]', 'x: 13', '# about y', 'y: 14'])
+        self.check('compact', 'foo', dedup=True)
+
+    def test_apply_patch(self):
+        self.check('apply_patch', [
+            ('foo', 'x', ['13', '16', '15'], ['1']),
+            ('bar', 'x', ['42'], ['2', '3']),
+            ('new', 'x', [], ['4']),
+        ])
+
+    def test_whole_sections(self):
+        self.check('move_section', 'foo')
+        self.check('move_section', 'baz', before='bar')
+        self.check('move_section', 'foo', before='bar')
+        self.check('rename_section', 'foo', 'renamed')
+        self.check('remove_section', 'renamed')
+
+    def test_move_unchanged(self):
+        generation = self.cf.generation
+        self.cf.move_section('baz')
+        self.assertEqual(generation, self.cf.generation)
+        self.assertEqual([], list(self.cf.journal))
+
+
+class ObserverTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cf = configfile.ConfigFile()
+        self.cf.parse([
+            '[foo]',
+            'x: 13',
+            'y: 14',
+            '[bar]',
+            'x: 42',
+        ])
+        self.events = []
+        self.cf.observe(self.callback)
+
+    def callback(self, kind, entry):
+        self.events.append((kind, entry.section,
+            entry.old_line and entry.old_line.value,
+            entry.new_line and entry.new_line.value))
+
+    def test_updates(self):
+        self.cf.add('foo', 'z', '1')
+        self.cf.update('foo', 'x', '0')
+        self.cf.remove('bar', 'x')
+        self.assertEqual([
+            ('add', 'foo', None, '1'),
+            ('update', 'foo', '13', '0'),
+            ('remove', 'bar', '42', None),
+        ], self.events)
+
+    def test_new_blocks(self):
+        self.cf.parse(['[baz]', 'x: 1'])
+        self.cf.add('qux', 'x', '2')
+        self.assertEqual([
+            ('block', 'baz', None, None),
+            ('add', 'baz', None, '1'),
+            ('block', 'qux', None, None),
+            ('add', 'qux', None, '2'),
+        ], self.events)
+
+    def test_batch(self):
+        with self.cf.batch():
+            self.cf.add('foo', 'z', '1')
+            self.cf.remove('foo', 'x')
+            self.assertEqual([], self.events)
+        self.assertEqual([
+            ('remove', 'foo', '13', None),
+            ('add', 'foo', None, '1'),
+        ], self.events)
+
+    def test_no_change(self):
+        self.cf.remove('foo', 'z')
+        self.cf.update('baz', 'x', '1')
+        self.assertEqual([], self.events)
+
+    def test_unobserve(self):
+        self.cf.unobserve(self.callback)
+        self.cf.add('foo', 'z', '1')
+        self.assertEqual([], self.events)
+        self.assertIsNone(self.cf._changes())
+        self.assertRaises(ValueError, self.cf.unobserve, self.callback)
+
+    def make_line(self, key, value=None):
+        return configfile.ConfigLine(configfile.ConfigLine.KIND_DATA, key=key, value=value)
+
+    def test_direct_section_updates(self):
+        section = self.cf.sections['foo']
+        generation = self.cf.generation
+        section.insert(self.make_line('z', '1'))
+        section.update(self.make_line('x'), self.make_line('x', '0'))
+        section.remove(self.make_line('y'))
+        section.replace_values({'z': [self.make_line('z', '2')]})
+        self.assertEqual([
+            ('add', 'foo', None, '1'),
+            ('update', 'foo', '13', '0'),
+            ('remove', 'foo', '14', None),
+            ('remove', 'foo', '1', None),
+            ('add', 'foo', None, '2'),
+        ], self.events)
+        self.assertEqual(generation + 4, self.cf.generation)
+
+    def test_direct_block_updates(self):
+        block = self.cf.sections['bar'].blocks[0]
+        generation = self.cf.generation
+        block.append(self.make_line('y', '1'))
+        block.extend([self.make_line('z', '2')])
+        block.update(self.make_line('x'), self.make_line('x', '0'))
+        block.remove_where(configfile.match_key('y'))
+        self.assertEqual([
+            ('add', 'bar', None, '1'),
+            ('add', 'bar', None, '2'),
+            ('update', 'bar', '42', '0'),
+            ('remove', 'bar', '1', None),
+        ], self.events)
+        self.assertEqual(generation + 4, self.cf.generation)
+        # The section's index follows direct updates of its blocks.
+        self.assertEqual({'x': ['0'], 'z': ['2']}, self.cf.section_index('bar').values)
+
+    def test_direct_updates_untracked(self):
+        self.cf.unobserve(self.callback)
+        block = self.cf.sections['bar'].blocks[0]
+        block.append(self.make_line('y', '1'))
+        self.cf.sections['foo'].insert(self.make_line('z', '1'))
+        self.assertEqual(['1'], list(self.cf.get('bar', 'y')))
+        self.assertEqual([], self.events)
+
+    def test_removed_section(self):
+        section = self.cf.sections['bar']
+        self.cf.remove_section('bar')
+        del self.events[:]
+        section.insert(self.make_line('y', '1'))
+        self.assertEqual([], self.events)
+
+    def test_snapshot_direct_updates(self):
+        snap = self.cf.snapshot()
+        snap_events = []
+        snap.observe(lambda kind, entry: snap_events.append(kind))
+        snap.add('foo', 'z', '1')
+        snap.sections['foo'].blocks[0].append(self.make_line('t', '2'))
+        self.assertEqual(['add', 'add'], snap_events)
+        self.assertEqual([], self.events)
+
+    def test_secondary_index(self):
+        """Maintain a key => sections index incrementally."""
+        index = {}
+
+        def update_index(kind, entry):
+            if entry.old_line is not None:
+                index[entry.old_line.key].discard(entry.section)
+            if entry.new_line is not None:
+                index.setdefault(entry.new_line.key, set()).add(entry.section)
+
+        cf = configfile.ConfigFile()
+        cf.observe(update_index)
+        cf.parse(['[foo]', 'x: 1', '[bar]', 'x: 2', 'y: 3'])
+        self.assertEqual({'x': set(['foo', 'bar']), 'y': set(['bar'])}, index)
+        cf.remove('foo', 'x')
+        self.assertEqual({'x': set(['bar']), 'y': set(['bar'])}, index)
+
+
+class CompactTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cf = configfile.ConfigFile()
+        self.cf.parse([
+            '[foo]',
+            'x: 13',
+            '[bar]',
+            'x: 42',
+            '[foo]',
+            '# y is for yes',
+            'y: 14',
+            '[foo]',
+            'x: 13',
+            '# Another x',
+            'x: 13',
+        ])
+
+    def write(self, cf):
+        f = io.StringIO()
+        cf.write(f)
+        return f.getvalue().splitlines()
+
+    def test_compact_section(self):
+        self.assertEqual(2, self.cf.compact('foo'))
+        self.assertEqual([
+            '[foo]',
+            'x: 13',
+            '# y is for yes',
+            'y: 14',
+            'x: 13',
+            '# Another x',
+            'x: 13',
+            '[bar]',
+            'x: 42',
+        ], self.write(self.cf))
+        self.assertEqual(1, len(self.cf.sections['foo'].blocks))
+        self.assertEqual(2, len(self.cf.blocks))
+
+    def test_dedup(self):
+        self.assertEqual(2, self.cf.compact(dedup=True))
+        self.assertEqual([
+            '[foo]',
+            'x: 13',
+            '# y is for yes',
+            'y: 14',
+            '# Another x',
+            'x: 13',
+            '[bar]',
+            'x: 42',
+        ], self.write(self.cf))
+
+    def test_dedup_single_block(self):
+        cf = configfile.ConfigFile()
+        cf.parse(['[foo]', 'x: 1', 'x: 1', 'y: 2'])
+        generation = cf.generation
+        self.assertEqual(0, cf.compact(dedup=True))
+        self.assertEqual(['[foo]', 'x: 1', 'y: 2'], self.write(cf))
+        self.assertEqual(generation + 1, cf.generation)
+
+        self.assertEqual(0, cf.compact(dedup=True))
+        self.assertEqual(generation + 1, cf.generation)
+
+    def test_extra_block(self):
+        cf = configfile.ConfigFile()
+        cf.add('foo', 'x', '1')
+        cf.parse(['[foo]', 'y: 2', '[bar]', 'z: 3'])
+        self.assertEqual(1, cf.compact())
+        self.assertEqual(['[foo]', 'y: 2', 'x: 1', '[bar]', 'z: 3'], self.write(cf))
+        self.assertIsNone(cf.sections['foo'].extra_block)
+
+    def test_trailing_lines(self):
+        cf = configfile.ConfigFile()
+        cf.parse([
+            '[a]',
+            'x: 1',
+            '# trailing',
+            '',
+            '[b]',
+            'y: 2',
+            '',
+            '[a]',
+            '# about w',
+            'w: 9',
+            '# end of a',
+            '',
+            '[c]',
+            'z: 3',
+        ])
+        cf.enable_journal()
+        self.assertEqual(1, cf.compact('a'))
+        self.assertEqual([
+            '[a]',
+            'x: 1',
+            '# trailing',
+            '# about w',
+            'w: 9',
+            '# end of a',
+            '',
+            '',
+            '[b]',
+            'y: 2',
+            '',
+            '[c]',
+            'z: 3',
+        ], self.write(cf))
+
+        # Journal entries replay to the same block.
+        target = cf.sections['a'].blocks[0]
+        lines = ['x: 1', '# trailing', '']
+        for entry in cf.journal:
+            if entry.block is target:
+                lines.insert(entry.index, entry.new_line.text)
+        self.assertEqual([line.text for line in target.lines], lines)
+
+    def test_dedup_trailing_comment(self):
+        cf = configfile.ConfigFile()
+        cf.parse(['[a]', 'x: 1', '# trailing', '[a]', 'x: 1'])
+        cf.compact(dedup=True)
+        self.assertEqual(['[a]', 'x: 1', '# trailing'], self.write(cf))
+
+    def test_unknown_section(self):
+        self.assertEqual(0, self.cf.compact('baz'))
+        self.assertNotIn('baz', self.cf)
+
+    def test_keeps_parsing(self):
+        self.cf.compact()
+        self.cf.handle_line(configfile.Parser().parse_line('z: 1'))
+        self.assertEqual(['1'], list(self.cf.get('foo', 'z')))
+        self.assertIs(self.cf.current_block, self.cf.sections['foo'].blocks[0])
+
+    def test_journal(self):
+        self.cf.enable_journal()
+        self.cf.compact('foo', dedup=True)
+        removed = [e.old_line.text for e in self.cf.journal if e.new_line is None]
+        added = [e.new_line.text for e in self.cf.journal if e.old_line is None]
+        self.assertEqual(['# y is for yes', 'y: 14', 'x: 13', '# Another x', 'x: 13'], removed)
+        self.assertEqual(['# y is for yes', 'y: 14', '# Another x', 'x: 13'], added)
+
+    def test_snapshot(self):
+        snap = self.cf.snapshot()
+        snap.compact()
+        self.assertEqual(4, len(self.cf.blocks))
+        self.assertEqual(3, len(self.cf.sections['foo'].blocks))
+        self.assertEqual(2, len(snap.blocks))
+
+
+class WholeSectionTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cf = configfile.ConfigFile()
+        self.cf.parse([
+            '[foo]',
+            'x: 13',
+            '[bar]',
+            'x: 42',
+            '[foo]',
+            'y: 14',
+            '[baz]',
+            'z: 1',
+        ])
+
+    def write(self, cf):
+        f = io.StringIO()
+        cf.write(f)
+        return f.getvalue().splitlines()
+
+    def test_remove_section(self):
+        self.cf.add('foo', 'x', '2')
+        self.cf.add('qux', 't', '3')
+        self.assertEqual(3, self.cf.remove_section('foo'))
+        self.assertNotIn('foo', self.cf)
+        self.assertEqual(2, len(self.cf.blocks))
+        self.assertEqual(['[bar]', 'x: 42', '[baz]', 'z: 1', '[qux]', 't: 3'], self.write(self.cf))
+
+    def test_remove_unknown_section(self):
+        generation = self.cf.generation
+        self.assertEqual(0, self.cf.remove_section('qux'))
+        self.assertEqual(generation, self.cf.generation)
+
+    def test_remove_current_section(self):
+        self.cf.remove_section('baz')
+        self.assertIsNone(self.cf.current_block)
+
+    def test_remove_section_observed(self):
+        events = []
+        self.cf.observe(lambda kind, entry: events.append((kind, entry.section, entry.old_line.text)))
+        self.cf.remove_section('foo')
+        self.assertEqual([('remove', 'foo', 'x: 13'), ('remove', 'foo', 'y: 14')], events)
+
+    def test_rename_section(self):
+        self.cf.add('foo', 'x', '2')
+        self.cf.rename_section('foo', 'qux')
+        self.assertNotIn('foo', self.cf)
+        self.assertEqual(['13', '2'], list(self.cf.get('qux', 'x')))
+        self.assertEqual([
+            '[qux]',
+            'x: 13',
+            '[bar]',
+            'x: 42',
+            '[qux]',
+            'y: 14',
+            'x: 2',
+            '[baz]',
+            'z: 1',
+        ], self.write(self.cf))
+
+        self.cf.add('qux', 't', '3')
+        self.assertEqual(['3'], list(self.cf.get('qux', 't')))
+
+    def test_rename_section_errors(self):
+        self.assertRaises(configfile.ConfigError, self.cf.rename_section, 'foo', 'bar')
+        self.assertRaises(KeyError, self.cf.rename_section, 'qux', 'quux')
+        self.assertIn('foo', self.cf)
+
+    def test_rename_section_observed(self):
+        events = []
+        self.cf.observe(lambda kind, entry: events.append((kind, entry.section)))
+        self.cf.rename_section('bar', 'qux')
+        self.assertEqual([('remove', 'bar'), ('add', 'qux')], events)
+
+    def test_rename_snapshot(self):
+        snap = self.cf.snapshot()
+        snap.rename_section('foo', 'qux')
+        self.assertEqual(['13'], list(self.cf.get('foo', 'x')))
+        self.assertEqual('[foo]', self.write(self.cf)[0])
+        self.assertEqual('[qux]', self.write(snap)[0])
+
+    def test_move_section(self):
+        self.cf.move_section('baz', before='foo')
+        self.assertEqual([
+            '[baz]',
+            'z: 1',
+            '[foo]',
+            'x: 13',
+            '[bar]',
+            'x: 42',
+            '[foo]',
+            'y: 14',
+        ], self.write(self.cf))
+
+    def test_move_section_to_end(self):
+        self.cf.move_section('foo')
+        self.assertEqual([
+            '[bar]',
+            'x: 42',
+            '[baz]',
+            'z: 1',
+            '[foo]',
+            'x: 13',
+            '[foo]',
+            'y: 14',
+        ], self.write(self.cf))
+
+    def test_move_section_errors(self):
+        self.assertRaises(configfile.ConfigError, self.cf.move_section, 'foo', before='foo')
+        self.assertRaises(configfile.ConfigError, self.cf.move_section, 'foo', before='qux')
+        self.assertRaises(KeyError, self.cf.move_section, 'qux')
+
+    def test_move_snapshot(self):
+        snap = self.cf.snapshot()
+        snap.move_section('baz', before='bar')
+        self.assertEqual('[bar]', self.write(self.cf)[2])
+        self.assertEqual('[baz]', self.write(snap)[2])
+
+
+class PredicateEditTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cf = configfile.ConfigFile()
+        self.cf.parse([
+            '[foo]',
+            'old_x: 13',
+            '# comment',
+            'y: 14',
+            '[bar]',
+            'old_x: 42',
+            'old_y: 43',
+            '[foo]',
+            'old_z: 15',
+        ])
+
+    def write(self, cf):
+        f = io.StringIO()
+        cf.write(f)
+        return f.getvalue().splitlines()
+
+    def is_deprecated(self, line):
+        return line.kind == configfile.ConfigLine.KIND_DATA and line.key.startswith('old_')
+
+    def test_remove_where(self):
+        self.assertEqual(4, self.cf.remove_where(self.is_deprecated))
+        self.assertEqual(['[foo]', '# comment', 'y: 14'], self.write(self.cf))
+
+    def test_remove_where_sections(self):
+        self.assertEqual(2, self.cf.remove_where(self.is_deprecated, sections=['bar', 'baz']))
+        self.assertNotIn('baz', self.cf)
+        self.assertEqual(['13'], list(self.cf.get('foo', 'old_x')))
+        self.assertEqual([], list(self.cf.get('bar', 'old_x')))
+
+    def test_rewrite_where(self):
+        def rename(line):
+            return configfile.ConfigLine(line.kind, key=line.key[4:], value=line.value)
+
+        generation = self.cf.generation
+        self.assertEqual(4, self.cf.rewrite_where(self.is_deprecated, rename))
+        self.assertEqual([
+            '[foo]',
+            'x: 13',
+            '# comment',
+            'y: 14',
+            '[bar]',
+            'x: 42',
+            'y: 43',
+            '[foo]',
+            'z: 15',
+        ], self.write(self.cf))
+        # A single generation, whatever the number of modified sections
+        self.assertEqual(generation + 1, self.cf.generation)
+        self.assertEqual('13', self.cf.section_view('foo')['x'])
+
+    def test_rewrite_where_identity(self):
+        generation = self.cf.generation
+        self.assertEqual(0, self.cf.rewrite_where(self.is_deprecated, lambda line: line))
+        self.assertEqual(generation, self.cf.generation)
+
+    def test_journal(self):
+        self.cf.enable_journal()
+        self.cf.remove_where(self.is_deprecated, sections=['foo'])
+        self.assertEqual(['old_x: 13', 'old_z: 15'],
+            [entry.old_line.text for entry in self.cf.journal])
+
+    def test_snapshot(self):
+        snap = self.cf.snapshot()
+        snap.remove_where(self.is_deprecated)
+        self.assertEqual(['13'], list(self.cf.get('foo', 'old_x')))
+        self.assertEqual([], list(snap.get('foo', 'old_x')))
+
+
+class QueryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cf = configfile.ConfigFile()
+        self.cf.parse([
+            '[app]',
+            'db.host: db1',
+            'db.port: 5432',
+            'dbname: app',
+            'worker_io_threads: 4',
+            'worker_cpu_threads: 8',
+            'worker_count: 2',
+            '[app.replica]',
+            'db.host: db2',
+            '[other]',
+            'db.host: db3',
+            '[app]',
+            'db.host: db4',
+        ])
+
+    def test_match_keys(self):
+        index = self.cf.section_index('app')
+        self.assertEqual(['db.host', 'db.port'], index.match_keys('db.*'))
+        self.assertEqual(['worker_cpu_threads', 'worker_io_threads'],
+            index.match_keys('worker_*_threads'))
+        self.assertEqual(['dbname'], index.match_keys('dbname'))
+        self.assertEqual([], index.match_keys('dbname2'))
+        self.assertEqual(['db.host', 'db.port', 'dbname'], index.match_keys('db[.n]*'))
+
+    def test_glob_prefix(self):
+        self.assertEqual('db.', configfile.glob_prefix('db.*'))
+        self.assertEqual('worker_', configfile.glob_prefix('worker_?'))
+        self.assertEqual('db', configfile.glob_prefix('db[.]host'))
+        self.assertEqual('key', configfile.glob_prefix('key'))
+
+    def test_query(self):
+        self.assertEqual([
+            ('app', 'db.host', 'db1'),
+            ('app', 'db.host', 'db4'),
+            ('app', 'db.port', '5432'),
+            ('app.replica', 'db.host', 'db2'),
+            ('other', 'db.host', 'db3'),
+        ], list(self.cf.query('db.*')))
+
+    def test_query_sections(self):
+        self.assertEqual([
+            ('app', 'db.host', 'db1'),
+            ('app', 'db.host', 'db4'),
+            ('app.replica', 'db.host', 'db2'),
+        ], list(self.cf.query('db.host', 'app*')))
+        self.assertEqual([('app.replica', 'db.host', 'db2')],
+            list(self.cf.query('db.host', 'app.replica')))
+        self.assertEqual([], list(self.cf.query('db.host', 'unknown')))
+
+    def test_query_after_update(self):
+        self.assertEqual(2, len(list(self.cf.query('worker_*_threads'))))
+        self.cf.add('app', 'worker_gc_threads', '1')
+        self.cf.remove('app', 'worker_io_threads')
+        self.assertEqual([
+            ('app', 'worker_cpu_threads', '8'),
+            ('app', 'worker_gc_threads', '1'),
+        ], list(self.cf.query('worker_*_threads')))
+
+    def test_thread_safe(self):
+        cf = configfile.ThreadSafeConfigFile()
+        cf.parse(['[app]', 'db.host: db1'])
+        self.assertEqual([('app', 'db.host', 'db1')], list(cf.query('db.*')))
+
+
+class ApplyPatchTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cf = configfile.ConfigFile()
+        self.cf.parse([
+            '[server]',
+            'port: 80',
+            '# Aliases',
+            'alias:www',
+            'alias: web',
+            'host: web1',
+            '[server]',
+            'workers: 4',
+        ])
+
+    def write(self, cf):
+        f = io.StringIO()
+        cf.write(f)
+        return f.getvalue().splitlines()
+
+    def test_in_place(self):
+        nb = self.cf.apply_patch([
+            ('server', 'port', ['80'], ['8080']),
+            ('server', 'alias', ['www', 'web'], ['www', 'w3', 'web1']),
+            ('server', 'workers', ['4'], []),
+            ('cache', 'size', [], ['10']),
+        ])
+        self.assertEqual(5, nb)
+        self.assertEqual([
+            '[server]',
+            'port: 8080',
+            '# Aliases',
+            'alias:www',
+            'alias: w3',
+            'alias: web1',
+            'host: web1',
+            '[cache]',
+            'size: 10',
+        ], self.write(self.cf))
+
+    def test_append(self):
+        self.cf.apply_patch([
+            ('server', 'timeout', [], ['30', '60']),
+            ('server', 'workers', ['4'], ['4', '8']),
+        ])
+        self.assertEqual([
+            '[server]',
+            'port: 80',
+            '# Aliases',
+            'alias:www',
+            'alias: web',
+            'host: web1',
+            '[server]',
+            'workers: 4',
+            'workers: 8',
+            'timeout: 30',
+            'timeout: 60',
+        ], self.write(self.cf))
+
+    def test_conflict(self):
+        with self.assertRaises(configfile.PatchConflict) as context:
+            self.cf.apply_patch([
+                ('server', 'port', ['80'], ['8080']),
+                ('server', 'alias', ['www'], []),
+                ('server', 'missing', ['1'], []),
+            ])
+        self.assertEqual([
+            (('server', 'alias', ['www'], []), ['www', 'web']),
+            (('server', 'missing', ['1'], []), []),
+        ], context.exception.conflicts)
+        # Nothing applied
+        self.assertEqual(['80'], list(self.cf.get('server', 'port')))
+
+    def test_noop(self):
+        generation = self.cf.generation
+        self.assertEqual(0, self.cf.apply_patch([
+            ('server', 'port', ['80'], ['80']),
+            ('unknown', 'key', [], []),
+        ]))
+        self.assertEqual(generation, self.cf.generation)
+        self.assertNotIn('unknown', self.cf)
+
+    def test_journal(self):
+        self.cf.enable_journal()
+        self.cf.apply_patch([('server', 'alias', ['www', 'web'], ['w3'])])
+        self.assertEqual([('www', 'w3'), ('web', None)], [
+            (e.old_line.value, e.new_line and e.new_line.value) for e in self.cf.journal])
+
+    def test_batch(self):
+        with self.cf.batch():
+            self.assertRaises(configfile.ConfigError, self.cf.apply_patch, [])
+
+
+class FingerprintTestCase(unittest.TestCase):
+    def setUp(self):
+        self.lines = [
+            '# header',
+            '[foo]',
+            'x: 13',
+            '[bar]',
+            'y: 14',
+            '[foo]',
+            'z: 15',
+        ]
+        self.cf = configfile.ConfigFile()
+        self.cf.parse(self.lines)
+
+    def test_block_digest(self):
+        block = self.cf.blocks[0]
+        digest = block.digest()
+        self.assertEqual(digest, block.digest())
+        self.assertEqual(digest, block.copy().digest())
+
+        block.append(configfile.ConfigLine(configfile.ConfigLine.KIND_DATA, key='t', value='1'))
+        self.assertNotEqual(digest, block.digest())
+        block.remove(configfile.ConfigLine(configfile.ConfigLine.KIND_DATA, key='t'))
+        self.assertEqual(digest, block.digest())
+
+    def test_same_content(self):
+        other = configfile.ConfigFile()
+        other.parse(self.lines)
+        self.assertEqual(self.cf.fingerprint(), other.fingerprint())
+        self.assertEqual(self.cf.section_fingerprint('foo'), other.section_fingerprint('foo'))
+        self.assertIsNone(self.cf.section_fingerprint('baz'))
+
+    def test_updates(self):
+        fingerprint = self.cf.fingerprint()
+        foo = self.cf.section_fingerprint('foo')
+        bar = self.cf.section_fingerprint('bar')
+
+        self.cf.update('foo', 'x', '0')
+        self.assertNotEqual(fingerprint, self.cf.fingerprint())
+        self.assertNotEqual(foo, self.cf.section_fingerprint('foo'))
+        self.assertEqual(bar, self.cf.section_fingerprint('bar'))
+
+        self.cf.update('foo', 'x', '13')
+        self.assertEqual(fingerprint, self.cf.fingerprint())
+        self.assertEqual(foo, self.cf.section_fingerprint('foo'))
+
+    def test_structure(self):
+        fingerprint = self.cf.fingerprint()
+        snap = self.cf.snapshot()
+        snap.rename_section('bar', 'baz')
+        self.assertNotEqual(fingerprint, snap.fingerprint())
+        self.assertEqual(self.cf.section_fingerprint('bar'), snap.section_fingerprint('baz'))
+
+        snap = self.cf.snapshot()
+        snap.add('qux', 'x', '1')
+        snap.remove('qux', 'x')
+        # The empty extra block isn't written
+        self.assertEqual(fingerprint, snap.fingerprint())
+
+        snap.insert_line(configfile.ConfigLine(configfile.ConfigLine.KIND_BLANK, text='# new'))
+        self.assertNotEqual(fingerprint, snap.fingerprint())
+        self.assertEqual(fingerprint, self.cf.fingerprint())
+
+    def reparsed(self, cf):
+        f = io.StringIO()
+        cf.write(f)
+        other = configfile.ConfigFile()
+        other.parse(f.getvalue().splitlines())
+        return other
+
+    def test_direct_updates(self):
+        fingerprint = self.cf.fingerprint()
+        foo = self.cf.sections['foo']
+        foo.insert(configfile.ConfigLine(configfile.ConfigLine.KIND_DATA, key='t', value='1'))
+        self.assertNotEqual(fingerprint, self.cf.fingerprint())
+        self.assertEqual(self.reparsed(self.cf).fingerprint(), self.cf.fingerprint())
+
+        fingerprint = self.cf.fingerprint()
+        foo.blocks[1].append(configfile.ConfigLine(configfile.ConfigLine.KIND_DATA, key='u', value='2'))
+        self.assertNotEqual(fingerprint, self.cf.fingerprint())
+        self.assertEqual(self.reparsed(self.cf).fingerprint(), self.cf.fingerprint())
+
+        # Emptying a block changes the layout
+        bar = self.cf.sections['bar']
+        bar.blocks[0].remove_where(lambda line: True)
+        self.assertEqual(self.reparsed(self.cf).fingerprint(), self.cf.fingerprint())
+
+        # A new extra block
+        self.cf.sections['baz'] = section = configfile.Section('baz')
+        section.configfile = self.cf
+        section.insert(configfile.ConfigLine(configfile.ConfigLine.KIND_DATA, key='v', value='3'))
+        self.assertEqual(self.reparsed(self.cf).fingerprint(), self.cf.fingerprint())
+
+    def test_unmodified_sections_not_hashed(self):
+        self.cf.fingerprint()
+
+        def fail():
+            raise AssertionError("Unexpected digest")
+
+        for block in self.cf.sections['bar'].blocks:
+            block.digest = fail
+        self.cf.update('foo', 'x', '0')
+        self.cf.fingerprint()
+        self.cf.sections['foo'].blocks[0].append(
+            configfile.ConfigLine(configfile.ConfigLine.KIND_DATA, key='t', value='1'))
+        self.cf.fingerprint()
+
+    def test_moved_and_removed_sections(self):
+        self.cf.fingerprint()
+        self.cf.move_section('bar', before='foo')
+        self.assertEqual(self.reparsed(self.cf).fingerprint(), self.cf.fingerprint())
+        self.cf.remove_section('foo')
+        self.assertEqual(self.reparsed(self.cf).fingerprint(), self.cf.fingerprint())
+
+    def test_matches_written_text(self):
+        rng = random.Random(4)
+        for _i in range(50):
+            cf = configfile.ConfigFile()
+            cf.parse(self.lines)
+            for _j in range(5):
+                section = rng.choice(['foo', 'bar', 'baz'])
+                key = rng.choice(['x', 'y'])
+                getattr(cf, rng.choice(['add', 'add_or_update', 'update', 'remove']))(section, key, str(rng.randint(0, 2)))
+
+                f = io.StringIO()
+                cf.write(f)
+                other = configfile.ConfigFile()
+                other.parse(f.getvalue().splitlines())
+                self.assertEqual(other.fingerprint(), cf.fingerprint())
+
+
+class OverlayConfigFileTestCase(unittest.TestCase):
+    def setUp(self):
+        self.base = configfile.ConfigFile()
+        self.base.parse([
+            '# Base config',
+            '[server]',
+            'host: base',
+            'port: 80',
+            '[client]',
+            'retries: 3',
+            '[server]',
+            'workers: 4',
+        ])
+        self.overlay = configfile.OverlayConfigFile(self.base)
+
+    def write(self, cf):
+        f = io.StringIO()
+        cf.write(f)
+        return f.getvalue().splitlines()
+
+    def test_unchanged(self):
+        self.assertEqual(self.write(self.base), self.write(self.overlay))
+        self.assertEqual(['80'], list(self.overlay.get('server', 'port')))
+        self.assertEqual(set(['server', 'client']), set(self.overlay.sections))
+        self.assertIn('client', self.overlay)
+
+    def test_updates(self):
+        self.assertEqual(1, self.overlay.update('server', 'host', 'web42'))
+        self.assertEqual(1, self.overlay.remove('client', 'retries'))
+        self.overlay.add('server', 'alias', 'www')
+        self.overlay.add('cache', 'size', '10')
+        self.assertEqual(0, self.overlay.add_or_update('server', 'timeout', '30'))
+
+        self.assertEqual([
+            '# Base config',
+            '[server]',
+            'host: web42',
+            'port: 80',
+            '[server]',
+            'workers: 4',
+            'alias: www',
+            'timeout: 30',
+            '[cache]',
+            'size: 10',
+        ], self.write(self.overlay))
+        self.assertEqual('web42', self.overlay.get_one('server', 'host'))
+        self.assertRaises(KeyError, self.overlay.get_one, 'client', 'retries')
+        self.assertEqual([('size', '10')], list(self.overlay.items('cache')))
+
+        # The base is untouched
+        self.assertEqual(['base'], list(self.base.get('server', 'host')))
+        self.assertEqual(['3'], list(self.base.get('client', 'retries')))
+
+    def test_update_added_lines(self):
+        self.overlay.add('server', 'alias', 'www')
+        self.overlay.add('server', 'alias', 'web')
+        self.assertEqual(1, self.overlay.update('server', 'alias', 'w3', old_value='web'))
+        self.assertEqual(1, self.overlay.remove('server', 'alias', 'www'))
+        self.assertEqual(['w3'], list(self.overlay.get('server', 'alias')))
+
+        self.overlay.update('server', 'port', '8080')
+        self.overlay.update('server', 'port', '8081')
+        self.assertEqual(['8081'], list(self.overlay.get('server', 'port')))
+        self.assertEqual(1, self.overlay.update('server', 'alias', 'x', once=True))
+
+    def test_add_placement(self):
+        base = configfile.ConfigFile()
+        base.parse(['[a]', 'x: 1', '[b]', '[a]', 'y: 2'])
+        overlay = configfile.OverlayConfigFile(base)
+        expected = base.snapshot()
+        for cf in (overlay, expected):
+            # Next to the matching line, then at the end of the last block
+            cf.add('a', 'x', '1')
+            cf.add('a', 'z', '3')
+            cf.add('b', 'w', '4')
+            cf.add('c', 'v', '5')
+            cf.add('c', 'v', '6')
+
+        self.assertEqual([('x', '1'), ('x', '1'), ('y', '2'), ('z', '3')], list(overlay.items('a')))
+        self.assertEqual(self.write(expected), self.write(overlay))
+        self.assertEqual(expected.fingerprint(), overlay.fingerprint())
+
+        # Added lines may be updated and removed in place
+        for cf in (overlay, expected):
+            cf.remove('a', 'x', '1')
+            cf.add('a', 'x', '7')
+            cf.update('a', 'z', '8')
+        self.assertEqual(self.write(expected), self.write(overlay))
+        self.assertEqual(['[a]', 'x: 1', '[a]', 'y: 2'], self.write(base))
+
+    def test_base_updated_later(self):
+        self.overlay.update('server', 'port', '8080')
+        self.base.update('server', 'host', 'other')
+        self.base.parse(['[client]', 'timeout: 1'])
+        self.assertEqual(['base'], list(self.overlay.get('server', 'host')))
+        self.assertEqual(['8080'], list(self.overlay.get('server', 'port')))
+        self.assertEqual([], list(self.overlay.get('client', 'timeout')))
+
+    def test_shared_base(self):
+        overlays = [configfile.OverlayConfigFile(self.base) for _i in range(3)]
+        for i, overlay in enumerate(overlays):
+            overlay.update('server', 'host', 'web%d' % i)
+        self.assertEqual(['web0', 'web1', 'web2'],
+            [overlay.get_one('server', 'host') for overlay in overlays])
+        self.assertIs(overlays[0].base.blocks[0], overlays[2].base.blocks[0])
+
+    def test_flatten_and_freeze(self):
+        self.overlay.update('server', 'host', 'web42')
+        self.overlay.add('cache', 'size', '10')
+        flat = self.overlay.flatten()
+        self.assertEqual(self.write(self.overlay), self.write(flat))
+        self.assertEqual(['web42'], list(flat.get('server', 'host')))
+
+        frozen = self.overlay.freeze()
+        self.assertEqual(flat.freeze(), frozen)
+        self.assertEqual('10', frozen.get_one('cache', 'size'))
+
+    def test_base_read_only(self):
+        base = self.overlay.base
+        base.update('server', 'host', 'other')
+        self.assertEqual(['base'], list(self.overlay.get('server', 'host')))
+        self.assertEqual(['base'], list(self.overlay.base.get('server', 'host')))
+
+    def test_sections(self):
+        self.assertIs(self.base.sections['client'], self.overlay.sections['client'])
+        self.overlay.update('server', 'port', '8080')
+        self.overlay.add('cache', 'size', '10')
+
+        server = self.overlay.sections['server']
+        base_server = self.base.sections['server']
+        self.assertIsNot(base_server, server)
+        # The unchanged block is shared with the base
+        self.assertIs(base_server.blocks[1], server.ordered_blocks()[1])
+        self.assertEqual(['8080'], server.index().values['port'])
+        self.assertEqual(['10'], self.overlay.sections['cache'].index().values['size'])
+        self.assertIs(self.base.sections['client'], self.overlay.sections['client'])
+
+        self.overlay.remove('server', 'workers')
+        self.assertEqual([], self.overlay.section_index('server').values.get('workers', []))
+
+    def test_fingerprints(self):
+        self.assertEqual(self.base.fingerprint(), self.overlay.fingerprint())
+        self.assertEqual(self.base.section_fingerprint('server'),
+            self.overlay.section_fingerprint('server'))
+
+        self.overlay.update('server', 'port', '8080')
+        self.overlay.add('server', 'alias', 'www')
+        self.overlay.add('cache', 'size', '10')
+        flat = self.overlay.flatten()
+        self.assertEqual(flat.fingerprint(), self.overlay.fingerprint())
+        self.assertNotEqual(self.base.fingerprint(), self.overlay.fingerprint())
+        for name in ['server', 'client', 'cache']:
+            self.assertEqual(flat.section_fingerprint(name),
+                self.overlay.section_fingerprint(name))
+        self.assertIsNone(self.overlay.section_fingerprint('missing'))
+
+        # Cached until the overlay changes
+        fingerprint = self.overlay.fingerprint()
+        self.assertIs(fingerprint, self.overlay.fingerprint())
+        self.overlay.remove('client', 'retries')
+        self.assertNotEqual(fingerprint, self.overlay.fingerprint())
+        self.assertEqual(self.overlay.flatten().fingerprint(), self.overlay.fingerprint())
+
+    def test_lookups(self):
+        self.overlay.update('server', 'port', '8080')
+        self.overlay.add('cache', 'size', '10')
+        port = configfile.ConfigLine(configfile.ConfigLine.KIND_DATA, key='port')
+        self.assertEqual(['8080'], [line.value for line in self.overlay.get_line('server', port)])
+        self.assertEqual([], list(self.overlay.get_line('missing', port)))
+        self.assertEqual(list(self.overlay.flatten().query('*')), list(self.overlay.query('*')))
+        self.assertEqual([('cache', 'size', '10')], list(self.overlay.query('s*', 'c*')))
+
+    def test_section_generation(self):
+        server = self.overlay.section_generation('server')
+        client = self.overlay.section_generation('client')
+        self.assertIsNone(self.overlay.section_generation('cache'))
+        self.assertEqual(server, self.overlay.section_generation('server'))
+
+        self.overlay.update('server', 'port', '8080')
+        self.assertNotEqual(server, self.overlay.section_generation('server'))
+        self.assertEqual(client, self.overlay.section_generation('client'))
+        server = self.overlay.section_generation('server')
+        self.overlay.update('server', 'port', '8080', old_value='no such value')
+        self.assertEqual(server, self.overlay.section_generation('server'))
+
+        self.overlay.add('cache', 'size', '10')
+        self.assertIsNotNone(self.overlay.section_generation('cache'))
+
+    def test_section_view(self):
+        view = self.overlay.section_view('server')
+        self.assertEqual('base', view['host'])
+        view['host'] = 'web42'
+        view['timeout'] = '30'
+        del view['workers']
+        self.assertEqual(['host', 'port', 'timeout'], view.keys())
+        self.assertEqual('web42', view['host'])
+        self.assertNotIn('workers', view)
+        self.assertRaises(KeyError, view.__delitem__, 'workers')
+
+        multi = self.overlay.section_view('server', multi_value=True)
+        self.assertEqual(2, multi.replace('alias', ['www', 'web']))
+        self.assertEqual(2, multi.replace('alias', ['web', 'w3']))
+        self.assertEqual(['web', 'w3'], multi['alias'])
+        self.assertEqual(['base'], list(self.base.get('server', 'host')))
+
+    def test_apply_patch(self):
+        patch = [
+            ('server', 'port', ['80'], ['8080']),
+            ('server', 'workers', ['4'], []),
+            ('server', 'alias', [], ['www', 'web']),
+            ('cache', 'size', [], ['10']),
+        ]
+        self.assertEqual(5, self.overlay.apply_patch(patch))
+        expected = self.base.snapshot()
+        expected.apply_patch(patch)
+        self.assertEqual(expected.freeze(), self.overlay.freeze())
+        self.assertEqual(['80'], list(self.base.get('server', 'port')))
+
+        # Updating previously added lines
+        self.assertEqual(2, self.overlay.apply_patch([
+            ('server', 'alias', ['www', 'web'], ['www', 'w3', 'w4'])]))
+        self.assertEqual(['www', 'w3', 'w4'], list(self.overlay.get('server', 'alias')))
+
+    def test_apply_patch_conflict(self):
+        self.overlay.update('server', 'port', '8080')
+        with self.assertRaises(configfile.PatchConflict):
+            self.overlay.apply_patch([
+                ('server', 'host', ['base'], ['web42']),
+                ('server', 'port', ['80'], ['81']),
+            ])
+        self.assertEqual(['base'], list(self.overlay.get('server', 'host')))
+        self.assertEqual(['8080'], list(self.overlay.get('server', 'port')))
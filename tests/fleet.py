@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+# This code is distributed under the two-clause BSD license.
+# Copyright (c) 2012-2013 Raphaël Barrois
+
+from __future__ import unicode_literals
+
+import os
+import shutil
+import tempfile
+
+from .compat import io
+from .compat import unittest
+
+from confutils import fleet
+
+
+class FleetIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.write('web1.conf', ['[server]', 'legacy_mode: on', 'port: 80'])
+        self.write('db/db1.conf', ['# primary', '[server]', 'port: 5432', '[replica]', 'host: db2'])
+        self.write('README', ['Not a config file'])
+        self.index = fleet.FleetIndex(':memory:')
+        self.addCleanup(self.index.close)
+
+    def path(self, name):
+        return os.path.join(self.root, name)
+
+    def write(self, name, lines, mtime=None):
+        path = self.path(name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with io.open(path, 'wt', encoding='utf-8') as f:
+            f.write(''.join('%s\n' % line for line in lines))
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+
+    def test_read_entries(self):
+        self.assertEqual([(3, 'server', 'port', '5432'), (5, 'replica', 'host', 'db2')],
+            fleet.read_entries(self.path('db/db1.conf')))
+
+    def test_find(self):
+        result = self.index.update(self.root, pattern='*.conf')
+        self.assertEqual((2, 0, 0, []), result)
+
+        self.assertEqual([fleet.FleetEntry(self.path('web1.conf'), 2, 'server', 'legacy_mode', 'on')],
+            self.index.find(key='legacy_mode'))
+        self.assertEqual([(self.path('db/db1.conf'), 3), (self.path('web1.conf'), 3)],
+            [(e.path, e.lineno) for e in self.index.find(section='server', key='port')])
+        self.assertEqual(['db2'], [e.value for e in self.index.find(section='rep*')])
+        self.assertEqual(['5432'], [e.value for e in self.index.find(value='54*')])
+        self.assertEqual([], self.index.find(key='legacy'))
+
+    def test_incremental(self):
+        self.write('web1.conf', ['[server]', 'legacy_mode: on'], mtime=1000000000)
+        self.assertEqual((2, 0, 0, []), self.index.update(self.root, pattern='*.conf'))
+        self.assertEqual((0, 2, 0, []), self.index.update(self.root, pattern='*.conf'))
+
+        self.write('web1.conf', ['[server]', 'port: 80'], mtime=1000000001)
+        os.remove(self.path('db/db1.conf'))
+        self.assertEqual((1, 0, 1, []), self.index.update(self.root, pattern='*.conf'))
+        self.assertEqual([self.path('web1.conf')], self.index.files())
+        self.assertEqual([], self.index.find(key='legacy_mode'))
+        self.assertEqual(['80'], [e.value for e in self.index.find(key='port')])
+
+    def test_invalid_file(self):
+        result = self.index.update(self.root)
+        self.assertEqual(2, result.indexed)
+        self.assertEqual([self.path('README')], [path for path, _message in result.errors])
+
+    def test_persistent(self):
+        database = os.path.join(self.root, 'index.db')
+        with fleet.FleetIndex(database) as index:
+            index.update(self.root, pattern='*.conf')
+        with fleet.FleetIndex(database) as index:
+            self.assertEqual(2, len(index.files()))
+            self.assertEqual(0, index.update(self.root, pattern='*.conf').indexed)
+
+    def test_main(self):
+        database = os.path.join(self.root, 'index.db')
+        out = io.StringIO()
+        self.assertEqual(0, fleet.main([database, 'update', self.root, '--pattern', '*.conf'], stdout=out))
+        self.assertEqual('2 indexed, 0 unchanged, 0 removed, 0 errors\n', out.getvalue())
+
+        out = io.StringIO()
+        self.assertEqual(0, fleet.main([database, 'find', '--key', 'legacy_*'], stdout=out))
+        self.assertEqual('%s:2: [server] legacy_mode: on\n' % self.path('web1.conf'), out.getvalue())
@@ -2,6 +2,9 @@
 # This code is distributed under the two-clause BSD license.
 # Copyright (c) 2012-2013 Raphaël Barrois
 
+import threading
+import time
+
 from . import compat
 unittest = compat.unittest
 
@@ -292,3 +295,176 @@ class DictMixinTestCase(unittest.TestCase):
 
         # Ensure generators can be called several times
         self.assertEqual([1, 2], list(sorted(d.values())))
+
+
+class RWLockTestCase(unittest.TestCase):
+    def setUp(self):
+        self.lock = helpers.RWLock()
+
+    def run_in_thread(self, target):
+        thread = threading.Thread(target=target)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def test_concurrent_readers(self):
+        self.lock.acquire_read()
+        acquired = threading.Event()
+
+        def reader():
+            self.lock.acquire_read()
+            acquired.set()
+            self.lock.release_read()
+
+        self.run_in_thread(reader).join(5)
+        self.assertTrue(acquired.is_set())
+        self.lock.release_read()
+
+    def test_writer_waits_for_readers(self):
+        self.lock.acquire_read()
+        acquired = threading.Event()
+
+        def writer():
+            self.lock.acquire_write()
+            acquired.set()
+            self.lock.release_write()
+
+        thread = self.run_in_thread(writer)
+        self.assertFalse(acquired.wait(0.1))
+        self.lock.release_read()
+        thread.join(5)
+        self.assertTrue(acquired.is_set())
+
+    def test_reader_waits_for_writer(self):
+        self.lock.acquire_write()
+        acquired = threading.Event()
+
+        def reader():
+            self.lock.acquire_read()
+            acquired.set()
+            self.lock.release_read()
+
+        thread = self.run_in_thread(reader)
+        self.assertFalse(acquired.wait(0.1))
+        self.lock.release_write()
+        thread.join(5)
+        self.assertTrue(acquired.is_set())
+
+    def test_reentrant(self):
+        self.lock.acquire_read()
+        self.lock.acquire_read()
+        self.lock.release_read()
+        self.lock.release_read()
+
+        self.lock.acquire_write()
+        self.lock.acquire_write()
+        self.lock.acquire_read()
+        self.lock.release_read()
+        self.lock.release_write()
+        self.lock.release_write()
+
+        # Fully released
+        acquired = threading.Event()
+
+        def writer():
+            self.lock.acquire_write()
+            acquired.set()
+            self.lock.release_write()
+
+        self.run_in_thread(writer).join(5)
+        self.assertTrue(acquired.is_set())
+
+    def test_no_upgrade(self):
+        self.lock.acquire_read()
+        self.assertRaises(RuntimeError, self.lock.acquire_write)
+        self.lock.release_read()
+
+    def test_release_foreign_write(self):
+        self.assertRaises(RuntimeError, self.lock.release_write)
+
+    def test_release_unacquired_read(self):
+        self.assertRaises(RuntimeError, self.lock.release_read)
+
+    def test_exclusion(self):
+        state = {'writing': False, 'errors': 0}
+
+        def reader():
+            for _i in range(2000):
+                self.lock.acquire_read()
+                if state['writing']:
+                    state['errors'] += 1
+                self.lock.release_read()
+
+        def writer():
+            for _i in range(200):
+                self.lock.acquire_write()
+                state['writing'] = True
+                time.sleep(0)
+                state['writing'] = False
+                self.lock.release_write()
+
+        threads = [self.run_in_thread(reader) for _i in range(4)]
+        threads.append(self.run_in_thread(writer))
+        for thread in threads:
+            thread.join(30)
+        self.assertEqual(0, state['errors'])
+        self.assertEqual({}, self.lock._readers)
+
+
+class ReadLockedTestCase(unittest.TestCase):
+    def setUp(self):
+        class Guarded(object):
+            def __init__(self):
+                self.lock = helpers.RWLock()
+                self.state = {'writing': False, 'errors': 0}
+
+            @helpers.read_locked
+            def check(self, nested=False):
+                if self.state['writing']:
+                    self.state['errors'] += 1
+                if nested:
+                    self.check()
+                return len(self.lock._readers)
+
+            @helpers.read_locked_iter
+            def values(self):
+                yield len(self.lock._readers)
+
+        self.guarded = Guarded()
+
+    def test_uncontended(self):
+        self.assertEqual(1, self.guarded.check())
+        self.assertEqual(1, self.guarded.check(nested=True))
+        self.assertEqual([1], list(self.guarded.values()))
+        self.assertEqual({}, self.guarded.lock._readers)
+
+    def test_writer_reads(self):
+        self.guarded.lock.acquire_write()
+        self.assertEqual(0, self.guarded.check())
+        self.assertEqual([0], list(self.guarded.values()))
+        self.guarded.lock.release_write()
+        self.assertEqual(0, self.guarded.lock._writers)
+
+    def test_exclusion(self):
+        guarded = self.guarded
+
+        def reader():
+            for _i in range(2000):
+                guarded.check()
+
+        def writer():
+            for _i in range(200):
+                guarded.lock.acquire_write()
+                guarded.state['writing'] = True
+                time.sleep(0)
+                guarded.state['writing'] = False
+                guarded.lock.release_write()
+
+        threads = [threading.Thread(target=reader) for _i in range(4)]
+        threads.append(threading.Thread(target=writer))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(30)
+        self.assertEqual(0, guarded.state['errors'])
+        self.assertEqual({}, guarded.lock._readers)
@@ -255,3 +255,141 @@ class MergedConfigTestCase(unittest.TestCase):
 
         mc = merged_config.MergedConfig(d1, d2)
         self.assertEqual(42, mc.get('x', 42))
+
+
+class MergedConfigSubscriptionTestCase(unittest.TestCase):
+    def setUp(self):
+        self.events = []
+
+    def callback(self, key, old, new):
+        self.events.append((key, old, new))
+
+    def test_subscribe_add_options(self):
+        mc = merged_config.MergedConfig({'x': 1})
+        mc.subscribe('X', self.callback)
+        mc.add_options({'x': 2, 'y': 3})
+        self.assertEqual([], self.events)
+
+        mc.add_options({'x': 2})
+        self.assertEqual([], self.events)
+
+    def test_subscribe_new_key(self):
+        mc = merged_config.MergedConfig({'x': 1})
+        mc.subscribe('y', self.callback)
+        mc.add_options({'Y': 3})
+        self.assertEqual([('y', merged_config.NoDefault, 3)], self.events)
+
+    def test_subscribe_default_overridden(self):
+        mc = merged_config.MergedConfig({'x': merged_config.Default(1)})
+        mc.subscribe('x', self.callback)
+        mc.add_options({'x': 2})
+        self.assertEqual([('x', 1, 2)], self.events)
+
+    def test_replace_options(self):
+        mc = merged_config.MergedConfig({'x': 1, 'y': 2}, {'x': 3, 'z': 4})
+        mc.subscribe('x', self.callback)
+        mc.subscribe('y', self.callback)
+        mc.subscribe('z', self.callback)
+
+        mc.replace_options(0, {'y': 5})
+        self.assertEqual([('x', 1, 3), ('y', 2, 5)], sorted(self.events))
+        self.assertEqual({'y': 5}, mc.options[0])
+
+    def test_reload_options(self):
+        layer = {'x': 1, 'y': 2}
+        mc = merged_config.MergedConfig()
+        mc.add_options(layer, normalize=False)
+        mc.subscribe('x', self.callback)
+        mc.subscribe('y', self.callback)
+        mc.subscribe('z', self.callback)
+
+        layer['x'] = 10
+        del layer['y']
+        layer['z'] = 3
+        mc.reload_options(0)
+        self.assertEqual([
+            ('x', 1, 10),
+            ('y', 2, merged_config.NoDefault),
+            ('z', merged_config.NoDefault, 3),
+        ], sorted(self.events))
+
+    def test_reload_normalized_options(self):
+        layer = {'X': 1, 'y-z': 2}
+        mc = merged_config.MergedConfig(layer)
+        mc.subscribe('x', self.callback)
+        mc.subscribe('y_z', self.callback)
+
+        layer['X'] = 2
+        mc.reload_options(0)
+        self.assertEqual([('x', 1, 2)], self.events)
+        self.assertEqual(2, mc.get('x'))
+
+        del layer['y-z']
+        mc.reload_options(0)
+        self.assertEqual(('y_z', 2, merged_config.NoDefault), self.events[-1])
+
+    def test_reload_replaced_options(self):
+        mc = merged_config.MergedConfig({'x': 1})
+        layer = {'x': 2}
+        mc.replace_options(0, layer)
+        layer['x'] = 3
+        mc.reload_options(0)
+        self.assertEqual(3, mc.get('x'))
+
+    def test_unaffected_keys_not_recomputed(self):
+        mc = merged_config.MergedConfig({'x': 1}, {'y': 2})
+        mc.subscribe('x', self.callback)
+        mc.subscribe('y', self.callback)
+
+        calls = []
+        get = mc.get
+
+        def tracking_get(key, *args):
+            calls.append(key)
+            return get(key, *args)
+
+        mc.get = tracking_get
+        mc.replace_options(1, {'y': 3})
+        self.assertEqual(['y'], calls)
+        self.assertEqual([('y', 2, 3)], self.events)
+
+    def test_unchanged_keys_not_recomputed(self):
+        normalized = {'X': 1, 'y': 2, 'z': 3}
+        raw = {'a': 1, 'b': 2}
+        mc = merged_config.MergedConfig(normalized)
+        mc.add_options(raw, normalize=False)
+        for key in ['x', 'y', 'z', 'a', 'b']:
+            mc.subscribe(key, self.callback)
+
+        calls = []
+        get = mc.get
+
+        def tracking_get(key, *args):
+            calls.append(key)
+            return get(key, *args)
+
+        mc.get = tracking_get
+        normalized = {'x': 1, 'y': 2, 'z': 3}
+        mc.replace_options(0, normalized)
+        mc.reload_options(0)
+        mc.reload_options(1)
+        self.assertEqual([], calls)
+
+        normalized['y'] = 20
+        del normalized['z']
+        raw['b'] = 20
+        mc.reload_options(0)
+        mc.reload_options(1)
+        self.assertEqual(['b', 'y', 'z'], sorted(calls))
+        self.assertEqual([('b', 2, 20), ('y', 2, 20), ('z', 3, merged_config.NoDefault)],
+            sorted(self.events))
+        self.assertEqual({'x': 1, 'y': 20}, mc.options[0])
+
+    def test_unsubscribe(self):
+        mc = merged_config.MergedConfig({'x': 1})
+        mc.subscribe('x', self.callback)
+        mc.unsubscribe('X', self.callback)
+        mc.replace_options(0, {'x': 2})
+        self.assertEqual([], self.events)
+
+        self.assertRaises(KeyError, mc.unsubscribe, 'x', self.callback)
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+# This code is distributed under the two-clause BSD license.
+# Copyright (c) 2012-2013 Raphaël Barrois
+
+from __future__ import unicode_literals
+
+import datetime
+
+from .compat import unittest
+
+from confutils import configfile
+from confutils import merged_config
+from confutils import schema
+
+
+class ConvertersTestCase(unittest.TestCase):
+    def test_bool(self):
+        self.assertTrue(schema.to_bool('Yes'))
+        self.assertTrue(schema.to_bool(' on '))
+        self.assertTrue(schema.to_bool(True))
+        self.assertFalse(schema.to_bool('0'))
+        self.assertFalse(schema.to_bool('false'))
+        self.assertRaises(ValueError, schema.to_bool, 'maybe')
+
+    def test_list(self):
+        self.assertEqual(['a', 'b'], schema.to_list('a, b,'))
+        self.assertEqual([], schema.to_list(''))
+        self.assertEqual(['a'], schema.to_list(('a',)))
+
+    def test_duration(self):
+        self.assertEqual(datetime.timedelta(seconds=30), schema.to_duration('30'))
+        self.assertEqual(datetime.timedelta(minutes=5), schema.to_duration('5m'))
+        self.assertEqual(datetime.timedelta(hours=1.5), schema.to_duration('1.5h'))
+        self.assertEqual(datetime.timedelta(milliseconds=100), schema.to_duration('100ms'))
+        self.assertEqual(datetime.timedelta(seconds=2), schema.to_duration(2))
+        self.assertRaises(ValueError, schema.to_duration, '5 minutes')
+
+
+class OptionTestCase(unittest.TestCase):
+    def test_types(self):
+        self.assertEqual('int', schema.Option('x', int).type)
+        self.assertEqual('duration', schema.Option('x', 'duration').type)
+        self.assertEqual('str', schema.Option('x').type)
+
+    def test_unknown_type(self):
+        self.assertRaises(ValueError, schema.Option, 'x', complex)
+
+    def test_key(self):
+        self.assertEqual('x', schema.Option('x').key)
+        self.assertEqual('x-y', schema.Option('x', key='x-y').key)
+
+
+class MergedConfigAccessorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.schema = schema.Schema(
+            schema.Option('workers', int, default=4),
+            schema.Option('debug', bool, default=False),
+            schema.Option('hosts', list),
+            schema.Option('timeout', 'duration', key='Timeout'),
+        )
+
+    def test_values(self):
+        mc = merged_config.MergedConfig({'workers': '8', 'hosts': 'a,b', 'timeout': '1m'})
+        options = self.schema.compile(mc)
+        self.assertEqual(8, options.workers)
+        self.assertFalse(options.debug)
+        self.assertEqual(['a', 'b'], options.hosts)
+        self.assertEqual(datetime.timedelta(minutes=1), options.timeout)
+
+    def test_missing(self):
+        options = self.schema.compile(merged_config.MergedConfig())
+        self.assertRaises(configfile.ConfigError, getattr, options, 'hosts')
+
+    def test_invalid(self):
+        options = self.schema.compile(merged_config.MergedConfig({'workers': 'x'}))
+        self.assertRaises(configfile.ConfigError, getattr, options, 'workers')
+
+    def test_unknown_option(self):
+        options = self.schema.compile(merged_config.MergedConfig())
+        self.assertRaises(AttributeError, getattr, options, 'blah')
+        self.assertFalse(hasattr(options, '_blah'))
+
+    def test_cache_invalidation(self):
+        mc = merged_config.MergedConfig({'workers': '8'})
+        options = self.schema.compile(mc)
+        self.assertEqual(8, options.workers)
+        self.assertEqual(8, options.__dict__['workers'])
+
+        mc.replace_options(0, {'workers': '2', 'debug': 'yes'})
+        self.assertNotIn('workers', options.__dict__)
+        self.assertEqual(2, options.workers)
+        self.assertTrue(options.debug)
+
+    def test_detach(self):
+        mc = merged_config.MergedConfig({'workers': '8'})
+        options = self.schema.compile(mc)
+        options._detach()
+        self.assertEqual({}, mc._subscriptions)
+
+
+class SectionAccessorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.schema = schema.Schema(
+            schema.Option('port', int, default=80),
+            schema.Option('ratio', float, key='load-ratio'),
+        )
+        self.cf = configfile.ConfigFile()
+        self.cf.add('server', 'port', '8080')
+
+    def test_values(self):
+        self.cf.add('server', 'load-ratio', '0.5')
+        options = self.schema.compile(self.cf.section_view('server'))
+        self.assertEqual(8080, options.port)
+        self.assertEqual(0.5, options.ratio)
+
+    def test_missing_section(self):
+        options = self.schema.compile(self.cf.section_view('client'))
+        self.assertEqual(80, options.port)
+
+        self.cf.add('client', 'port', '81')
+        self.assertEqual(81, options.port)
+
+    def test_cache_invalidation(self):
+        options = self.schema.compile(self.cf.section_view('server'))
+        self.assertEqual(8080, options.port)
+
+        self.cf.update('server', 'port', '8000')
+        self.assertEqual(8000, options.port)
+
+        self.cf.remove('server', 'port')
+        self.assertEqual(80, options.port)
+
+    def test_cache_invalidation_on_parse(self):
+        options = self.schema.compile(self.cf.section_view('server'))
+        self.assertEqual(8080, options.port)
+
+        self.cf.parse(['[server]', 'load-ratio: 2'])
+        self.assertEqual(2.0, options.ratio)
+
+    def test_overlay(self):
+        overlay = configfile.OverlayConfigFile(self.cf)
+        options = self.schema.compile(overlay.section_view('server'))
+        self.assertEqual(8080, options.port)
+
+        overlay.update('server', 'port', '8000')
+        self.assertEqual(8000, options.port)
+        overlay.add('server', 'load-ratio', '0.5')
+        self.assertEqual(0.5, options.ratio)
+
+        other = self.schema.compile(overlay.section_view('client'))
+        self.assertEqual(80, other.port)
+        overlay.add('client', 'port', '81')
+        self.assertEqual(81, other.port)
+        # The base is untouched
+        self.assertEqual(['8080'], list(self.cf.get('server', 'port')))
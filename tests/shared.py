@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+# This code is distributed under the two-clause BSD license.
+# Copyright (c) 2012-2013 Raphaël Barrois
+
+from __future__ import unicode_literals
+
+import multiprocessing
+import os
+
+from .compat import unittest
+
+from confutils import configfile
+from confutils import shared
+
+
+def read_value(name, queue):
+    with shared.SharedConfigReader(name) as reader:
+        queue.put(reader.current().get_one('foo', 'y'))
+
+
+@unittest.skipIf(shared.shared_memory is None, "multiprocessing.shared_memory is unavailable")
+class SharedConfigTestCase(unittest.TestCase):
+    def setUp(self):
+        self.name = 'confutils_test_%d' % os.getpid()
+        self.cf = configfile.ConfigFile()
+        self.cf.parse([
+            '[foo]',
+            'x: 13',
+            'y: été',
+            '[bar]',
+            'x: 42',
+            '[foo]',
+            'x: 15',
+        ])
+        self.publisher = shared.SharedConfigPublisher(self.name)
+        self.addCleanup(self.publisher.close)
+
+    def test_nothing_published(self):
+        with shared.SharedConfigReader(self.name) as reader:
+            self.assertRaises(shared.SharedConfigError, reader.current)
+
+    def test_publish_read(self):
+        self.assertEqual(1, self.publisher.publish(self.cf))
+        with shared.SharedConfigReader(self.name) as reader:
+            config = reader.current()
+            self.assertEqual(1, reader.generation)
+            self.assertEqual(['13', '15'], list(config.get('foo', 'x')))
+            self.assertEqual('été', config.get_one('foo', 'y'))
+            self.assertEqual(list(self.cf.items('bar')), list(config.items('bar')))
+            self.assertEqual([line.text for line in self.cf], list(config))
+            del config
+
+    def test_new_generation(self):
+        self.publisher.publish(self.cf)
+        with shared.SharedConfigReader(self.name) as reader:
+            old = reader.current()
+            self.assertIs(old, reader.current())
+
+            self.cf.update('foo', 'x', '0')
+            self.assertEqual(2, self.publisher.publish(self.cf))
+
+            new = reader.current()
+            self.assertEqual(2, reader.generation)
+            self.assertEqual(['0', '0'], list(new.get('foo', 'x')))
+            # Previous generation is still readable while in use.
+            self.assertEqual(['13', '15'], list(old.get('foo', 'x')))
+            self.assertEqual(1, len(reader._retired))
+
+            # Once unused, previous generations are released.
+            del old
+            self.publisher.publish(self.cf)
+            reader.current()
+            self.assertEqual(['%s_2' % self.name], [s.name for s in reader._retired])
+            del new
+
+    def test_empty_config(self):
+        self.publisher.publish(configfile.ConfigFile())
+        with shared.SharedConfigReader(self.name) as reader:
+            self.assertEqual([], list(reader.current().items('foo')))
+
+    @unittest.skipUnless(hasattr(os, 'fork'), "Requires fork()")
+    def test_read_from_other_process(self):
+        self.publisher.publish(self.cf)
+        context = multiprocessing.get_context('fork')
+        queue = context.Queue()
+        process = context.Process(target=read_value, args=(self.name, queue))
+        process.start()
+        self.assertEqual('été', queue.get(timeout=10))
+        process.join()
+        self.assertEqual(0, process.exitcode)
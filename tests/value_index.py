@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+# This code is distributed under the two-clause BSD license.
+# Copyright (c) 2012-2013 Raphaël Barrois
+
+from __future__ import unicode_literals
+
+from .compat import unittest
+
+from confutils import configfile
+from confutils import value_index
+
+
+class ValueTokensTestCase(unittest.TestCase):
+    def test_tokens(self):
+        self.assertEqual(['postgres', 'db1.example.org', '5432', 'app'],
+            value_index.value_tokens('postgres://db1.example.org:5432/app'))
+        self.assertEqual(['a', 'b-c'], value_index.value_tokens(' a, b-c '))
+        self.assertEqual([], value_index.value_tokens(''))
+
+
+class ValueIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cf = configfile.ConfigFile()
+        self.cf.parse([
+            '# db1',
+            '[app]',
+            'db: postgres://db1:5432/app',
+            'cache: redis1:6379',
+            '[backup]',
+            'source: db1',
+            'target: db2',
+            '[app]',
+            'db: postgres://db1:5432/app',
+        ])
+
+    def test_values(self):
+        index = value_index.ValueIndex(self.cf)
+        self.assertEqual([('backup', 'source')], index.lookup('db1'))
+        self.assertEqual([('app', 'db')], index.lookup('postgres://db1:5432/app'))
+        self.assertEqual([], index.lookup('5432'))
+        self.assertNotIn('5432', index)
+
+    def test_tokens(self):
+        index = value_index.ValueIndex(self.cf, tokenize=value_index.value_tokens)
+        self.assertEqual([('app', 'db'), ('backup', 'source')], index.lookup('db1'))
+        self.assertEqual(['app', 'backup'], index.sections('db1'))
+        self.assertEqual(['app'], index.sections('5432'))
+        self.assertIn('6379', index)
+
+    def test_updates(self):
+        index = value_index.ValueIndex(self.cf, tokenize=value_index.value_tokens)
+        self.cf.update('backup', 'source', 'db3')
+        self.assertEqual(['app'], index.sections('db1'))
+        self.assertEqual(['backup'], index.sections('db3'))
+
+        self.cf.add('cache', 'host', 'redis1')
+        self.assertEqual(['app', 'cache'], index.sections('redis1'))
+
+        self.cf.remove('app', 'cache')
+        self.assertEqual(['cache'], index.sections('redis1'))
+        self.assertNotIn('6379', index)
+
+    def test_direct_updates(self):
+        index = value_index.ValueIndex(self.cf, tokenize=value_index.value_tokens)
+        line = configfile.ConfigLine(configfile.ConfigLine.KIND_DATA, key='replica', value='db3')
+        self.cf.sections['backup'].insert(line)
+        self.assertEqual([('backup', 'replica')], index.lookup('db3'))
+        self.cf.sections['backup'].blocks[0].remove(line)
+        self.assertEqual([], index.lookup('db3'))
+
+    def test_duplicates(self):
+        index = value_index.ValueIndex(self.cf, tokenize=value_index.value_tokens)
+        self.cf.compact('app', dedup=True)
+        self.assertEqual([('app', 'db'), ('backup', 'source')], index.lookup('db1'))
+        self.cf.remove('app', 'db')
+        self.assertEqual([('backup', 'source')], index.lookup('db1'))
+        self.assertNotIn('5432', index)
+
+    def test_sections(self):
+        index = value_index.ValueIndex(self.cf)
+        self.cf.rename_section('backup', 'archive')
+        self.assertEqual([('archive', 'source')], index.lookup('db1'))
+        self.cf.remove_section('archive')
+        self.assertNotIn('db1', index)
+        self.cf.parse(['[new]', 'x: db1'])
+        self.assertEqual([('new', 'x')], index.lookup('db1'))
+
+    def test_close(self):
+        index = value_index.ValueIndex(self.cf)
+        index.close()
+        self.cf.add('foo', 'x', 'db1')
+        self.assertEqual([('backup', 'source')], index.lookup('db1'))
+
+    def test_thread_safe(self):
+        cf = configfile.ThreadSafeConfigFile()
+        cf.parse(['[app]', 'host: db1'])
+        index = value_index.ValueIndex(cf)
+        cf.add('other', 'host', 'db1')
+        self.assertEqual(['app', 'other'], index.sections('db1'))